@@ -27,7 +27,9 @@ a = Analysis(
      ('C:\\Users\\pedro\\OneDrive\\Documentos\\pythonProject6\\venv\\lib\\site-packages\\filetype', 'filetype/'),
      ('C:\\Users\\pedro\\OneDrive\\Documentos\\pythonProject6\\venv\\lib\\site-packages\\deprecation.py', '.'),
      ('C:\\Users\\pedro\\OneDrive\\Documentos\\pythonProject6\\icon.ico', '.')],
-    hiddenimports = ['tkinter.font', 'typing_extensions', 'ctypes.wintypes', 'tkinter.ttk', 'CTkMessagebox', 'pytube', 'moviepy'],
+    # Conversion and tagging dependencies are imported lazily, inside the functions using them
+    hiddenimports = ['tkinter.font', 'typing_extensions', 'ctypes.wintypes', 'tkinter.ttk', 'CTkMessagebox', 'pytube', 'moviepy',
+                     'moviepy.audio.io.AudioFileClip', 'eyed3', 'proglog', 'imageio_ffmpeg', 'PIL.Image'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,245 @@
+import re
+import threading
+import time
+from datetime import datetime
+
+import settings
+from scheduler import NORMAL
+
+_RATE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)b?\s*$", re.IGNORECASE)
+_RATE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_rate(text):
+    """
+    Parses a rate such as "500K", "2.5M" or "1000000", in bytes/s.
+
+    Args:
+        text (str): The rate. K, M and G are powers of 1024, an optional trailing B is ignored.
+
+    Returns:
+        int: The rate in bytes/s, 0 meaning unlimited.
+
+    Raises:
+        ValueError: If the text is not a rate.
+    """
+    match = _RATE_PATTERN.match(str(text))
+    if not match:
+        raise ValueError(f"Invalid rate: {text!r}")
+    return int(float(match.group(1)) * _RATE_UNITS[match.group(2).lower()])
+
+
+def parse_schedule(text):
+    """
+    Parses a bandwidth schedule such as "08:00-18:00=1M, 18:00-23:00=4M". Hours outside every
+    range use the default limit, and ranges may wrap around midnight ("22:00-06:00=0").
+
+    Args:
+        text (str): Comma separated `HH:MM-HH:MM=rate` entries.
+
+    Returns:
+        list: (start minute, end minute, rate in bytes/s) tuples.
+
+    Raises:
+        ValueError: If an entry is malformed.
+    """
+    schedule = []
+    for entry in filter(None, (part.strip() for part in text.split(","))):
+        match = re.match(r"^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(.+)$", entry)
+        if not match:
+            raise ValueError(f"Invalid schedule entry: {entry!r}")
+        start_hour, start_minute, end_hour, end_minute, rate = match.groups()
+        schedule.append((int(start_hour) * 60 + int(start_minute), int(end_hour) * 60 + int(end_minute),
+                         parse_rate(rate)))
+    return schedule
+
+
+class BandwidthLimiter:
+    """
+    Global token bucket every stream read passes through, capping the total download rate.
+
+    The bucket refills at the current limit (the entry of `schedule` matching the time of day, else
+    `rate`). When it runs dry, waiting reads are served in virtual time order: each job advances its
+    own clock by the bytes it takes, so jobs in flight share the cap evenly whatever the number of
+    connections each of them opens, and a job joining late starts at the current clock instead of
+    catching up. A limit of 0 means unlimited, reads are then only counted.
+
+    Jobs of a lower priority class (see `register`) yield to the jobs of higher classes in flight:
+    their reads then share `yield_rate` only, limit or not, until the higher class is done.
+    """
+
+    def __init__(self, rate=0, schedule=None, burst=0.25, yield_rate=0):
+        self.rate = rate
+        self.schedule = schedule or []
+        self.burst = burst
+        self.yield_rate = yield_rate
+
+        self._condition = threading.Condition()
+        self._tokens = 0.0
+        self._last_refill = time.monotonic()
+        self._clock = 0.0
+        self._job_clocks = {}
+        self._waiting = []
+        self._priorities = {}
+        self._yield_tokens = 0.0
+        self._last_yield_refill = time.monotonic()
+
+        self._window_started = time.monotonic()
+        self._window_bytes = 0
+        self._throughput = 0.0
+
+    def current_rate(self, now=None):
+        """
+        Returns the limit in force.
+
+        Args:
+            now (datetime, optional): The time to look up in the schedule, defaults to now.
+
+        Returns:
+            int: The limit in bytes/s, 0 meaning unlimited.
+        """
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.schedule:
+            if start <= minute < end or (end < start and (minute >= start or minute < end)):
+                return rate
+        return self.rate
+
+    def consume(self, job_id, size):
+        """
+        Waits until `size` bytes of job `job_id` may be read, then accounts for them.
+
+        Args:
+            job_id (str): The job the read belongs to, e.g. the output file.
+            size (int): The number of bytes.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._account(size)
+            self._yield(job_id, size)
+            rate = self.current_rate()
+            if not rate:
+                return
+
+            tag = max(self._job_clocks.get(job_id, 0.0), self._clock) + size
+            self._job_clocks[job_id] = tag
+            self._waiting.append(tag)
+            try:
+                while True:
+                    self._refill(rate)
+                    # The bucket may go into debt, so reads larger than the burst still go through
+                    if self._tokens > 0 and tag == min(self._waiting):
+                        break
+                    delay = -self._tokens / rate if self._tokens <= 0 else 0.05
+                    self._condition.wait(timeout=max(delay, 0.001))
+                    rate = self.current_rate() or rate
+            finally:
+                self._waiting.remove(tag)
+
+            self._tokens -= size
+            self._clock = tag
+            self._condition.notify_all()
+
+    def register(self, job_id, priority):
+        """
+        Sets the priority class of a job until it finishes, see `scheduler`. Unregistered jobs are NORMAL.
+
+        Args:
+            job_id (str): The job.
+            priority (int): Its class.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._priorities[job_id] = priority
+
+    def finish(self, job_id):
+        """
+        Forgets a finished job.
+
+        Args:
+            job_id (str): The job.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._job_clocks.pop(job_id, None)
+            if self._priorities.pop(job_id, None) is not None:
+                # Jobs that yielded to it may go on at full speed
+                self._condition.notify_all()
+
+    def _yield(self, job_id, size):
+        # Called with the condition held: reads of a job outranked by another in flight trickle at `yield_rate`
+        priority = self._priorities.get(job_id, NORMAL)
+        while self.yield_rate and min(self._priorities.values(), default=priority) < priority:
+            now = time.monotonic()
+            self._yield_tokens = min(self._yield_tokens + (now - self._last_yield_refill) * self.yield_rate,
+                                     self.yield_rate * self.burst)
+            self._last_yield_refill = now
+            if self._yield_tokens > 0:
+                self._yield_tokens -= size
+                return
+            self._condition.wait(timeout=max(-self._yield_tokens / self.yield_rate, 0.001))
+
+    def _refill(self, rate):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._last_refill) * rate, rate * self.burst)
+        self._last_refill = now
+
+    def _account(self, size):
+        # Measured throughput, refreshed every couple of seconds
+        now = time.monotonic()
+        self._window_bytes += size
+        elapsed = now - self._window_started
+        if elapsed >= 2:
+            self._throughput = self._window_bytes / elapsed
+            self._window_bytes = 0
+            self._window_started = now
+
+    def expected_rate(self):
+        """
+        The download rate to expect from now on, for ETAs: the measured throughput, bounded by
+        the limit in force, or the limit itself until there is a measure.
+
+        Returns:
+            float: The rate in bytes/s, 0 if unknown.
+        """
+        with self._condition:
+            measured = self._throughput
+            if time.monotonic() - self._window_started > 5:
+                # Nothing was read for a while, the last measure is stale
+                measured = 0.0
+        rate = self.current_rate()
+        if rate and (not measured or measured > rate):
+            return float(rate)
+        return measured
+
+
+def limiter_from_settings():
+    """
+    Builds a limiter from `settings.BANDWIDTH_LIMIT`, `settings.BANDWIDTH_SCHEDULE` and `settings.YIELD_RATE`.
+    Invalid values are reported and ignored.
+
+    Returns:
+        BandwidthLimiter: The limiter.
+    """
+    try:
+        rate = parse_rate(settings.BANDWIDTH_LIMIT)
+    except ValueError as e:
+        print(f"Ignoring the bandwidth limit: {e}")
+        rate = 0
+    try:
+        schedule = parse_schedule(settings.BANDWIDTH_SCHEDULE)
+    except ValueError as e:
+        print(f"Ignoring the bandwidth schedule: {e}")
+        schedule = []
+    try:
+        yield_rate = parse_rate(settings.YIELD_RATE)
+    except ValueError as e:
+        print(f"Ignoring the yield rate: {e}")
+        yield_rate = 0
+    return BandwidthLimiter(rate, schedule, yield_rate=yield_rate)
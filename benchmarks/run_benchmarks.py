@@ -0,0 +1,228 @@
+"""
+Benchmarks the download engine against a local YouTube stand-in server.
+
+Every scenario runs in a fresh process with an empty cache, so peak RSS and CPU time are its own.
+The results are written as JSON, tagged with the current commit, to compare them across commits:
+
+    python benchmarks/run_benchmarks.py -o before.json
+    python benchmarks/run_benchmarks.py -o after.json --baseline before.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Each scenario is a job for `YouTubeDownloader.run`: the single-video path without conversion,
+# the merge and audio conversion paths, and the playlist pipeline with and without conversion.
+# "env" overrides settings, e.g. to compare the audio backends on downloaded files
+SCENARIOS = {
+    "single_video": {"playlist": False, "output_format": "No conversion"},
+    "merge_mp4": {"playlist": False, "output_format": "MP4"},
+    "convert_mp3": {"playlist": False, "output_format": "MP3"},
+    "convert_m4a": {"playlist": False, "output_format": "M4A"},
+    "playlist": {"playlist": True, "convert_to_mp3": False},
+    "playlist_mp3": {"playlist": True, "convert_to_mp3": True},
+    "playlist_mp3_ffmpeg": {"playlist": True, "convert_to_mp3": True,
+                            "env": {"YOUBER_STREAM_CONVERSION": "0", "YOUBER_AUDIO_BACKEND": "ffmpeg"}},
+    "playlist_mp3_moviepy": {"playlist": True, "convert_to_mp3": True,
+                             "env": {"YOUBER_STREAM_CONVERSION": "0", "YOUBER_AUDIO_BACKEND": "moviepy"}},
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the downloader against a local YouTube stand-in.")
+    parser.add_argument("-s", "--scenario", action="append", choices=list(SCENARIOS),
+                        help="Scenario to run, can be repeated. Defaults to all of them.")
+    parser.add_argument("-o", "--output", default="benchmark-results.json", help="JSON file for the results.")
+    parser.add_argument("--baseline", help="Results of a previous run to compare against.")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Runs of every scenario.")
+    parser.add_argument("--duration", type=int, default=10, help="Length of the synthetic media in seconds.")
+    parser.add_argument("--playlist-size", type=int, default=10, help="Videos in the playlist.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Server latency per request in seconds.")
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="Bandwidth cap per connection in bytes/s, 0 for no cap.")
+    parser.add_argument("--media-dir", default=os.path.join(tempfile.gettempdir(), "youber-benchmark-media"),
+                        help="Where the synthetic media is generated and reused from.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--server", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def peak_rss_bytes(who):
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_worker(scenario, server_url):
+    """
+    Runs one scenario in this process and prints its measurements as JSON.
+
+    Args:
+        scenario (str): The scenario name.
+        server_url (str): The URL of the stand-in server.
+
+    Returns:
+        None
+    """
+    from standin_server import redirect_youtube
+
+    redirect_youtube(server_url)
+
+    from downloader import YouTubeDownloader
+    from jobs import JobSpec
+
+    spec = SCENARIOS[scenario]
+    output_dir = tempfile.mkdtemp(prefix=f"youber-{scenario}-")
+    if spec["playlist"]:
+        job = JobSpec("https://www.youtube.com/playlist?list=PLbenchmark", output_dir,
+                      convert_to_mp3=spec["convert_to_mp3"])
+    else:
+        job = JobSpec("https://www.youtube.com/watch?v=bench000000", output_dir,
+                      output_format=spec["output_format"])
+
+    downloader = YouTubeDownloader()
+    started = time.perf_counter()
+    failures = downloader.run(job)
+    wall_time = time.perf_counter() - started
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    print(json.dumps({
+        "wall_time": wall_time,
+        "cpu_time": self_usage.ru_utime + self_usage.ru_stime + children_usage.ru_utime + children_usage.ru_stime,
+        "peak_rss": max(peak_rss_bytes(resource.RUSAGE_SELF), peak_rss_bytes(resource.RUSAGE_CHILDREN)),
+        "failures": len(failures),
+        "output_files": len(os.listdir(output_dir)),
+        "http": downloader.transport.stats,
+    }))
+
+
+def run_scenario(scenario, server):
+    """
+    Runs one scenario in a fresh process, with an empty cache, against the stand-in server.
+
+    Args:
+        scenario (str): The scenario name.
+        server (StandInServer): The running stand-in server.
+
+    Returns:
+        dict: The measurements of the run.
+    """
+    env = dict(os.environ)
+    env["YOUBER_CACHE_DIR"] = tempfile.mkdtemp(prefix="youber-cache-")
+    env["NO_PROXY"] = env["no_proxy"] = "127.0.0.1,localhost"
+    env.update(SCENARIOS[scenario].get("env", {}))
+
+    server.reset_bytes()
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", scenario,
+                              "--server", server.base_url],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=ROOT)
+    bytes_served = server.reset_bytes()
+    if process.returncode != 0:
+        raise RuntimeError(f"Scenario {scenario} failed:\n{process.stderr.decode('utf-8', errors='replace')}")
+
+    result = json.loads(process.stdout.decode("utf-8").strip().splitlines()[-1])
+    result["bytes"] = bytes_served
+    result["bytes_per_s"] = bytes_served / result["wall_time"] if result["wall_time"] else 0
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL).stdout.decode().strip() or None
+    except OSError:
+        return None
+
+
+def summarize(runs):
+    # The median run of every metric, robust to one noisy run
+    summary = {}
+    for key in ("wall_time", "bytes_per_s", "peak_rss", "cpu_time"):
+        values = sorted(run[key] for run in runs)
+        summary[key] = values[len(values) // 2]
+    return summary
+
+
+def compare(results, baseline):
+    """
+    Prints how every scenario changed compared to a previous run.
+
+    Args:
+        results (dict): The results of this run.
+        baseline (dict): The results of the previous run.
+
+    Returns:
+        None
+    """
+    print(f"\nCompared to {baseline.get('commit') or 'baseline'}:")
+    for scenario, result in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        changes = []
+        for key in ("wall_time", "bytes_per_s", "peak_rss", "cpu_time"):
+            before, after = previous["summary"][key], result["summary"][key]
+            change = (after - before) / before * 100 if before else 0
+            changes.append(f"{key} {change:+.1f}%")
+        print(f"  {scenario}: {', '.join(changes)}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.worker:
+        run_worker(args.worker, args.server)
+        return 0
+
+    from standin_server import StandInServer, generate_media
+
+    print("Generating synthetic media..")
+    media = generate_media(args.media_dir, args.duration)
+    server = StandInServer(media, playlist_size=args.playlist_size, latency=args.latency,
+                           bandwidth=args.bandwidth).start()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {"duration": args.duration, "playlist_size": args.playlist_size, "latency": args.latency,
+                   "bandwidth": args.bandwidth, "repeat": args.repeat},
+        "scenarios": {},
+    }
+    try:
+        for scenario in args.scenario or list(SCENARIOS):
+            runs = []
+            for _ in range(max(1, args.repeat)):
+                run = run_scenario(scenario, server)
+                runs.append(run)
+                print(f"{scenario}: {run['wall_time']:.2f}s, {run['bytes_per_s'] / 1e6:.2f} MB/s, "
+                      f"peak RSS {run['peak_rss'] / 1e6:.0f} MB, CPU {run['cpu_time']:.2f}s, "
+                      f"{run['http']['connections']} connection(s) for {run['http']['requests']} request(s), "
+                      f"{run['failures']} failure(s)")
+            results["scenarios"][scenario] = {"runs": runs, "summary": summarize(runs)}
+    finally:
+        server.stop()
+
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fh:
+            compare(results, json.load(fh))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+import io
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+from requests.adapters import BaseAdapter
+
+from ffmpeg_tools import run_ffmpeg
+from http_session import get_transport
+
+# Minimal player JS that pytube's `Cipher` can parse. The stream URLs served here are pre-signed,
+# so the transforms are never applied, but pytube still builds the cipher from this file.
+PLAYER_JS = """var Bm={AJ:function(a){a.reverse()}, VR:function(a,b){a.splice(0,b)}};
+Yq=function(a){a=a.split("");Bm.AJ(a,1);Bm.VR(a,2);return a.join("")};
+c&&d.set("signature",encodeURIComponent(Yq(e)));
+var Npa=[Ipa];
+a.C&&(b=a.get("n"))&&(b=Npa[0](b),a.set("n",b),Npa.length||Ipa(""));
+Ipa=function(a){var b=a.split(""),c=[function(d){d.reverse()},b];try{c[0](c[1])}catch(e){return"enhanced_except_"+a}return b.join("")};
+"""
+PLAYER_JS_PATH = "/s/player/bench000/player_ias.vflset/en_US/base.js"
+
+# The synthetic streams, by itag: progressive 360p, adaptive 720p video and adaptive audio
+STREAM_FORMATS = {
+    18: {"mimeType": 'video/mp4; codecs="avc1.42001E, mp4a.40.2"', "qualityLabel": "360p", "width": 640,
+         "height": 360, "fps": 30, "bitrate": 500000, "audioQuality": "AUDIO_QUALITY_LOW"},
+    136: {"mimeType": 'video/mp4; codecs="avc1.4d401f"', "qualityLabel": "720p", "width": 1280, "height": 720,
+          "fps": 30, "bitrate": 1500000},
+    140: {"mimeType": 'audio/mp4; codecs="mp4a.40.2"', "bitrate": 130000, "audioQuality": "AUDIO_QUALITY_MEDIUM"},
+}
+PROGRESSIVE_ITAGS = (18,)
+
+# Bumped whenever the encoding of the synthetic media changes, so stale files are not reused
+MEDIA_VERSION = 2
+ADAPTIVE_ITAGS = (136, 140)
+
+
+def video_ids(count, prefix="bench"):
+    """
+    Builds valid (11 character) video IDs for the synthetic videos.
+
+    Args:
+        count (int): How many IDs.
+        prefix (str): The first characters of every ID.
+
+    Returns:
+        list: The video IDs.
+    """
+    width = 11 - len(prefix)
+    return [f"{prefix}{i:0{width}d}" for i in range(count)]
+
+
+def generate_media(directory, duration):
+    """
+    Encodes the synthetic media served for every itag, reusing the files of a previous run.
+
+    Args:
+        directory (str): Where to store the files.
+        duration (int): The length of the media in seconds.
+
+    Returns:
+        dict: The file contents by itag, plus the JPEG thumbnail under "thumbnail".
+    """
+    os.makedirs(directory, exist_ok=True)
+    video_source = ["-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={duration}"]
+    audio_source = ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}"]
+    commands = {
+        18: video_source + audio_source + ["-vf", "scale=640:360", "-c:v", "libx264", "-preset", "ultrafast",
+                                           "-c:a", "aac", "-b:a", "96k", "-movflags", "+faststart"],
+        136: video_source + ["-c:v", "libx264", "-preset", "ultrafast", "-an"],
+        # Fragmented like YouTube's DASH audio, so it can be read from a pipe
+        140: audio_source + ["-c:a", "aac", "-b:a", "128k", "-vn", "-movflags", "+frag_keyframe+empty_moov",
+                             "-frag_duration", "1000000"],
+    }
+
+    media = {}
+    for itag, args in commands.items():
+        path = os.path.join(directory, f"{itag}-{duration}s-{MEDIA_VERSION}.mp4")
+        if not os.path.exists(path):
+            run_ffmpeg(["-y"] + args + [path])
+        with open(path, "rb") as fh:
+            media[itag] = fh.read()
+
+    thumbnail = io.BytesIO()
+    Image.new("RGB", (1280, 720), (200, 40, 40)).save(thumbnail, format="JPEG")
+    media["thumbnail"] = thumbnail.getvalue()
+    return media
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests the downloader sends to YouTube, with the latency and per-connection
+    bandwidth of the server it belongs to.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, which Nagle's algorithm would hold back on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/watch":
+            self.send_body(self.server.watch_page(query.get("v", "")).encode("utf-8"), "text/html")
+        elif url.path == "/playlist":
+            self.send_body(self.server.playlist_page().encode("utf-8"), "text/html")
+        elif url.path == PLAYER_JS_PATH:
+            self.send_body(PLAYER_JS.encode("utf-8"), "text/javascript")
+        elif url.path == "/videoplayback":
+            self.send_media(self.server.media.get(int(query.get("itag", 0))), "video/mp4")
+        elif re.match(r"/vi/[\w-]{11}/maxresdefault\.jpg$", url.path):
+            self.send_body(self.server.media["thumbnail"], "image/jpeg")
+        else:
+            self.send_error(404)
+
+    def do_HEAD(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        data = self.server.media.get(int(query.get("itag", ["0"])[0])) if url.path == "/videoplayback" else None
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if url.path == "/youtubei/v1/player":
+            video_id = parse_qs(url.query).get("videoId", [""])[0]
+            self.send_body(json.dumps(self.server.player_response(video_id)).encode("utf-8"), "application/json")
+        elif url.path == "/youtubei/v1/browse":
+            page = int(body.get("continuation", "0"))
+            self.send_body(json.dumps(self.server.continuation_response(page)).encode("utf-8"),
+                           "application/json")
+        else:
+            self.send_error(404)
+
+    def send_body(self, data, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_media(self, data, content_type):
+        if data is None:
+            self.send_error(404)
+            return
+
+        start, end = 0, len(data) - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        # Throttle the connection to the bandwidth cap, one chunk at a time
+        chunk_size = 16 * 1024
+        cap = self.server.bandwidth
+        started = time.monotonic()
+        sent = 0
+        for offset in range(start, end + 1, chunk_size):
+            chunk = data[offset:min(offset + chunk_size, end + 1)]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            self.server.count_bytes(len(chunk))
+            if cap:
+                delay = sent / cap - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    A local imitation of the parts of YouTube the downloader talks to: watch pages, the player
+    endpoint, the player JS, a paginated playlist, thumbnails and range-capable stream endpoints.
+
+    Every video shares the same synthetic media. `latency` is added before every response and
+    `bandwidth` caps each connection in bytes/s (0 for no cap).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, media, playlist_size=10, page_size=100, latency=0.0, bandwidth=0, address=("127.0.0.1", 0)):
+        super().__init__(address, StandInHandler)
+        self.media = media
+        self.video_ids = video_ids(playlist_size)
+        self.page_size = page_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.bytes_served = 0
+        self._bytes_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serves requests from a background thread.
+
+        Returns:
+            StandInServer: The server itself.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count_bytes(self, count):
+        with self._bytes_lock:
+            self.bytes_served += count
+
+    def reset_bytes(self):
+        """
+        Returns the number of media bytes served so far and resets the counter.
+
+        Returns:
+            int: The bytes served since the last reset.
+        """
+        with self._bytes_lock:
+            count, self.bytes_served = self.bytes_served, 0
+        return count
+
+    def video_details(self, video_id):
+        return {
+            "videoId": video_id,
+            "title": f"Benchmark video {video_id}",
+            "author": "Youber benchmarks",
+            "lengthSeconds": "10",
+            "thumbnail": {"thumbnails": [{"url": f"{self.base_url}/vi/{video_id}/maxresdefault.jpg",
+                                          "width": 1280, "height": 720}]},
+        }
+
+    def player_response(self, video_id):
+        expire = int(time.time()) + 6 * 3600
+
+        def stream_format(itag):
+            entry = dict(STREAM_FORMATS[itag])
+            entry.update({
+                "itag": itag,
+                "url": f"{self.base_url}/videoplayback?id={video_id}&itag={itag}&expire={expire}&signature=bench",
+                "contentLength": str(len(self.media[itag])),
+            })
+            return entry
+
+        return {
+            "playabilityStatus": {"status": "OK"},
+            "videoDetails": self.video_details(video_id),
+            "streamingData": {
+                "expiresInSeconds": "21540",
+                "formats": [stream_format(itag) for itag in PROGRESSIVE_ITAGS],
+                "adaptiveFormats": [stream_format(itag) for itag in ADAPTIVE_ITAGS],
+            },
+        }
+
+    def watch_page(self, video_id):
+        player_response = {"playabilityStatus": {"status": "OK"}, "videoDetails": self.video_details(video_id)}
+        return (f'<html><head><meta itemprop="datePublished" content="2023-05-01">'
+                f'<script src="{PLAYER_JS_PATH}"></script></head><body>'
+                f'<script>var ytInitialPlayerResponse = {json.dumps(player_response)};</script>'
+                f'<script>var ytInitialData = {{}};</script></body></html>')
+
+    def playlist_items(self, page):
+        start = page * self.page_size
+        items = []
+        for index, video_id in enumerate(self.video_ids[start:start + self.page_size], start):
+            details = self.video_details(video_id)
+            items.append({"playlistVideoRenderer": {
+                "videoId": video_id,
+                "title": {"runs": [{"text": details["title"]}]},
+                "index": {"simpleText": str(index + 1)},
+                "lengthSeconds": details["lengthSeconds"],
+                "thumbnail": details["thumbnail"],
+            }})
+        if start + self.page_size < len(self.video_ids):
+            items.append({"continuationItemRenderer": {
+                "continuationEndpoint": {"continuationCommand": {"token": str(page + 1)}}}})
+        return items
+
+    def playlist_page(self):
+        initial_data = {
+            "contents": {"twoColumnBrowseResultsRenderer": {"tabs": [{"tabRenderer": {"content": {
+                "sectionListRenderer": {"contents": [{"itemSectionRenderer": {"contents": [
+                    {"playlistVideoListRenderer": {"contents": self.playlist_items(0)}}]}}]}}}}]}},
+            "sidebar": {"playlistSidebarRenderer": {"items": [{"playlistSidebarPrimaryInfoRenderer": {
+                "title": {"runs": [{"text": "Benchmark playlist"}]}}}]}},
+        }
+        return (f'<html><body><script>ytcfg.set({{"INNERTUBE_API_KEY": "bench"}});</script>'
+                f'<script>var ytInitialData = {json.dumps(initial_data)};</script></body></html>')
+
+    def continuation_response(self, page):
+        return {"onResponseReceivedActions": [
+            {"appendContinuationItemsAction": {"continuationItems": self.playlist_items(page)}}]}
+
+
+class RedirectToStandIn(BaseAdapter):
+    """
+    Transport adapter sending the requests made to youtube.com to the stand-in server instead,
+    over the pooled adapter of the shared transport.
+    """
+
+    def __init__(self, base_url, adapter):
+        super().__init__()
+        self.base_url = base_url
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        request.url = self.base_url + request.url.split(url.netloc, 1)[1]
+        return self.adapter.send(request, **kwargs)
+
+    def close(self):
+        pass
+
+
+def redirect_youtube(base_url):
+    """
+    Makes every request to youtube.com made through the shared transport go to the stand-in server.
+
+    Args:
+        base_url (str): The URL of the stand-in server.
+
+    Returns:
+        None
+    """
+    session = get_transport().session
+    redirect = RedirectToStandIn(base_url, session.get_adapter(base_url))
+    for prefix in ("https://www.youtube.com/", "https://youtube.com/"):
+        session.mount(prefix, redirect)
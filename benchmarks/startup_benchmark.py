@@ -0,0 +1,231 @@
+"""
+Measures the cold start of Youber: the time until the first window is drawn, the time until the command
+line is ready, and the import cost of every module on the way.
+
+Every measure runs in a fresh interpreter. The run fails (exit code 1) when a conversion dependency is
+imported at startup, or when a measure regresses past the tolerance compared to a baseline:
+
+    python benchmarks/startup_benchmark.py -o startup-before.json
+    python benchmarks/startup_benchmark.py -o startup-after.json --baseline startup-before.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies of conversion, tagging and merging, which must only be imported when those run.
+# Pillow is only checked for the command line, customtkinter imports it for the window anyway
+LAZY_MODULES = {
+    "gui": ["moviepy", "numpy", "imageio", "imageio_ffmpeg", "eyed3", "proglog"],
+    "cli": ["moviepy", "numpy", "imageio", "imageio_ffmpeg", "eyed3", "proglog", "PIL"],
+}
+
+# What each entry point imports before it can serve the user
+ENTRY_MODULES = {"gui": "gui_setup", "cli": "cli"}
+
+# Builds the main window as main.py does and draws it once
+_FIRST_WINDOW = """
+import customtkinter
+import gui_setup
+root = customtkinter.CTk()
+app = gui_setup.YouTubeDownloaderApp(root)
+root.update()
+root.destroy()
+"""
+
+_IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cold start of the GUI and the command line.")
+    parser.add_argument("-o", "--output", default="startup-results.json", help="JSON file for the results.")
+    parser.add_argument("--baseline", help="Results of a previous run to compare against.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Runs of every measure, the median is kept.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Relative slowdown over the baseline counted as a regression.")
+    parser.add_argument("--min-delta", type=float, default=0.02,
+                        help="Slowdown in seconds below which a change is noise, whatever the tolerance.")
+    return parser.parse_args(argv)
+
+
+def run_python(code, env):
+    """
+    Runs Python code in a fresh interpreter from the repository root.
+
+    Args:
+        code (str): The code.
+        env (dict): The environment.
+
+    Returns:
+        tuple: The wall time in seconds, the exit code and the stderr output.
+    """
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE)
+    return time.perf_counter() - started, process.returncode, process.stderr.decode("utf-8", errors="replace")
+
+
+def import_costs(module, env):
+    """
+    Measures the import cost of a module and of everything it imports, with `python -X importtime`.
+
+    Args:
+        module (str): The module.
+        env (dict): The environment.
+
+    Returns:
+        dict: The cumulative import time in seconds of every top-level package and project module,
+            and the modules it loaded.
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    costs = {}
+    for line in process.stderr.decode("utf-8", errors="replace").splitlines():
+        match = _IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        package = name.split(".")[0]
+        # The first import of a package holds the cumulative time of its submodules
+        if package not in costs:
+            costs[package] = int(match.group(2)) / 1e6
+        elif name == package:
+            costs[package] = max(costs[package], int(match.group(2)) / 1e6)
+    return costs
+
+
+def project_modules():
+    return {name[:-3] for name in os.listdir(ROOT) if name.endswith(".py")}
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(entry, env, repeat):
+    """
+    Measures the cold start of one entry point.
+
+    Args:
+        entry (str): "gui" or "cli".
+        env (dict): The environment.
+        repeat (int): Runs of every measure.
+
+    Returns:
+        dict: The measures: "ready" (seconds until usable, None if it could not run), the import
+            cost of its modules and the conversion dependencies it imported eagerly.
+    """
+    module = ENTRY_MODULES[entry]
+    result = {}
+
+    code = _FIRST_WINDOW if entry == "gui" else f"import {module}"
+    times = []
+    for _ in range(max(1, repeat)):
+        wall_time, code_returned, stderr = run_python(code, env)
+        if code_returned != 0:
+            # e.g. no display to open the window on
+            result["skipped"] = (stderr.strip().splitlines() or ["failed"])[-1]
+            break
+        times.append(wall_time)
+    result["ready"] = median(times) if times else None
+
+    runs = [import_costs(module, env) for _ in range(max(1, repeat))]
+    names = set().union(*runs)
+    result["imports"] = {name: median([run.get(name, 0.0) for run in runs]) for name in sorted(names)}
+
+    check = (f"import sys, {module}; "
+             f"print(','.join(name for name in {LAZY_MODULES[entry]!r} if name in sys.modules))")
+    process = subprocess.run([sys.executable, "-c", check], cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+    result["eager"] = [name for name in process.stdout.decode().strip().split(",") if name]
+    return result
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """
+    Prints how the cold start changed compared to a previous run.
+
+    Args:
+        results (dict): The results of this run.
+        baseline (dict): The results of the previous run.
+        tolerance (float): Relative slowdown counted as a regression.
+        min_delta (float): Slowdown in seconds ignored as noise.
+
+    Returns:
+        list: The regressions, as messages.
+    """
+    regressions = []
+    print(f"\nCompared to {baseline.get('commit') or 'baseline'}:")
+    for entry, result in results["entries"].items():
+        previous = baseline.get("entries", {}).get(entry)
+        if previous is None:
+            continue
+        measures = [("ready", result["ready"], previous.get("ready"))]
+        measures += [(f"import {name}", seconds, previous["imports"].get(name))
+                     for name, seconds in result["imports"].items() if name in project_modules()]
+        for label, after, before in measures:
+            if after is None or before is None:
+                continue
+            change = (after - before) / before * 100 if before else 0
+            if after - before > max(min_delta, before * tolerance):
+                regressions.append(f"{entry} {label}: {before * 1000:.0f} ms -> {after * 1000:.0f} ms")
+            if label == "ready":
+                print(f"  {entry}: ready {change:+.1f}% ({before * 1000:.0f} ms -> {after * 1000:.0f} ms)")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL).stdout.decode().strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    env = dict(os.environ)
+    # A cache that already exists, as on every start but the first one
+    env["YOUBER_CACHE_DIR"] = tempfile.mkdtemp(prefix="youber-startup-cache-")
+    run_python("import downloader; downloader.YouTubeDownloader()", env)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"repeat": args.repeat},
+        "entries": {},
+    }
+    for entry in ENTRY_MODULES:
+        result = measure(entry, env, args.repeat)
+        results["entries"][entry] = result
+        ready = f"{result['ready'] * 1000:.0f} ms" if result["ready"] is not None else f"skipped ({result['skipped']})"
+        heaviest = sorted(result["imports"].items(), key=lambda item: item[1], reverse=True)[:5]
+        print(f"{entry}: ready in {ready}, imports "
+              f"{', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in heaviest)}")
+
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
+    print(f"Results saved to {args.output}")
+
+    failures = [f"{entry} imports {', '.join(result['eager'])} at startup"
+                for entry, result in results["entries"].items() if result["eager"]]
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fh:
+            failures += compare(results, json.load(fh), args.tolerance, args.min_delta)
+    for failure in failures:
+        print(f"Regression: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+import argparse
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import settings
+from bandwidth import parse_rate, parse_schedule
+from cluster import Coordinator, Worker
+from download_archive import DownloadArchive
+from downloader import YouTubeDownloader
+from jobs import JobSpec, OUTPUT_FORMATS
+from scheduler import BULK, PRIORITY_NAMES
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line.
+
+    Args:
+        argv (list, optional): The arguments, defaults to `sys.argv[1:]`.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Download YouTube videos and playlists without the GUI.")
+    parser.add_argument("urls", nargs="*", help="Video or playlist URLs.")
+    parser.add_argument("-i", "--input", help="File with one URL per line. Blank lines and # comments are skipped.")
+    parser.add_argument("-o", "--output-dir", help="Directory to save the files to. Defaults to the current one, "
+                                                   "or to the directory the coordinator gives in --worker mode.")
+    parser.add_argument("-f", "--format", default=OUTPUT_FORMATS[0], type=str.lower,
+                        choices=[output_format.lower() for output_format in OUTPUT_FORMATS],
+                        help="Output format of single videos.")
+    parser.add_argument("-q", "--quality", help="Resolution of single videos, e.g. 720p. Defaults to the highest.")
+    parser.add_argument("--video-policy", default=settings.VIDEO_POLICY,
+                        help='How video streams are picked, e.g. "best <=1080p" or "smallest prefer mp4".')
+    parser.add_argument("--audio-policy", default=settings.AUDIO_POLICY,
+                        help='How audio streams are picked, e.g. "best prefer opus" or "smallest >=128kbps".')
+    parser.add_argument("--no-audio", action="store_true", help="Skip the audio track of single videos.")
+    parser.add_argument("--no-video", action="store_true", help="Skip the video track of single videos.")
+    parser.add_argument("--playlist-video", action="store_true",
+                        help="Download playlist items as video instead of audio only.")
+    parser.add_argument("--mp3", action="store_true", help="Convert playlist items to MP3.")
+    parser.add_argument("--sync", action="store_true",
+                        help="Only download the playlist items added since the last sync of the playlist.")
+    parser.add_argument("--report-removed", action="store_true",
+                        help="With --sync, enumerate whole playlists to list the items removed since the last sync.")
+    parser.add_argument("--no-archive", action="store_true",
+                        help="Download playlist items again even if the download archive has them.")
+    parser.add_argument("--priority", default="normal", choices=PRIORITY_NAMES,
+                        help="Priority class of the URLs: downloads and conversions of a lower class yield to "
+                             "the ones of a higher class running in the same process.")
+    parser.add_argument("--resume", action="store_true",
+                        help="First finish the playlist downloads an earlier run left interrupted.")
+    parser.add_argument("-j", "--parallel", type=int, default=2,
+                        help="URLs processed at the same time, or jobs taken at the same time in --worker mode.")
+    parser.add_argument("-c", "--connections", type=int, default=settings.CONNECTIONS_PER_STREAM,
+                        help="HTTP connections per stream.")
+    parser.add_argument("--limit-rate", type=parse_rate,
+                        help="Cap on the total download rate in bytes/s, e.g. 500K or 2M. 0 for unlimited.")
+    parser.add_argument("--schedule", type=parse_schedule,
+                        help='Time-of-day rate limits, e.g. "08:00-19:00=1M, 19:00-08:00=0".')
+    parser.add_argument("--trace", default=settings.TRACE_FILE or None, metavar="FILE",
+                        help="Write the timing of every stage of every job to FILE when done: a Chrome trace "
+                             "(chrome://tracing, Perfetto) if it ends with .json, JSON lines otherwise.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print the time spent per stage and the cache, connection and archive counters when done.")
+    parser.add_argument("--metrics", default=settings.METRICS_ADDRESS or None, metavar="HOST:PORT",
+                        help="Serve the stage timings as Prometheus metrics at http://HOST:PORT/metrics.")
+    parser.add_argument("--serve", nargs="?", const=settings.CLUSTER_ADDRESS, metavar="ADDRESS",
+                        help="Hand the videos out to workers instead of downloading them, listening on host:port "
+                             f"or unix:/path (default {settings.CLUSTER_ADDRESS}).")
+    parser.add_argument("--worker", nargs="?", const=settings.CLUSTER_ADDRESS, metavar="ADDRESS",
+                        help="Download the videos a coordinator started with --serve hands out.")
+    parser.add_argument("--retag", metavar="DIR",
+                        help="Write the tags and cover of the MP3s of DIR recorded in the download archive again, "
+                             "instead of downloading.")
+    return parser.parse_args(argv)
+
+
+def read_urls(args):
+    """
+    Collects the URLs given on the command line and in the input file.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        list: The URLs, in order.
+    """
+    urls = list(args.urls)
+    if args.input:
+        with open(args.input, "r", encoding="utf-8") as fh:
+            for line in fh:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    urls.append(line)
+    return urls
+
+
+def make_jobs(args, urls):
+    """
+    Builds the jobs of the URLs from the command line options.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+        urls (list): The URLs.
+
+    Returns:
+        list: The `JobSpec`s, in order.
+    """
+    return [JobSpec(url=url, output_dir=args.output_dir or ".", output_format=args.format, quality=args.quality,
+                    audio=not args.no_audio, video=not args.no_video, only_audio=not args.playlist_video,
+                    convert_to_mp3=args.mp3, sync=args.sync, report_removed=args.report_removed,
+                    video_policy=args.video_policy, audio_policy=args.audio_policy)
+            for url in urls]
+
+
+def make_downloader(args):
+    """
+    Builds a downloader configured by the command line options.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        YouTubeDownloader: The downloader.
+    """
+    downloader = YouTubeDownloader(connections_per_stream=args.connections)
+    if args.limit_rate is not None:
+        downloader.limiter.rate = args.limit_rate
+    if args.schedule is not None:
+        downloader.limiter.schedule = args.schedule
+    if args.no_archive:
+        downloader.archive = None
+    if args.metrics:
+        downloader.tracer.serve_metrics(args.metrics)
+    return downloader
+
+
+def export_trace(args, downloader):
+    """
+    Writes the stage timings of the run to the --trace file, if one was given.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+        downloader (YouTubeDownloader): The downloader that ran the jobs.
+
+    Returns:
+        None
+    """
+    if not args.trace:
+        return
+    try:
+        downloader.tracer.export(args.trace)
+        print(f"Trace written to {args.trace}")
+    except OSError as e:
+        print(f"Could not write the trace to {args.trace}: {e}")
+
+
+def print_stats(args, downloader):
+    """
+    Prints the end-of-run counters of the downloader with --verbose.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+        downloader (YouTubeDownloader): The downloader that ran the jobs.
+
+    Returns:
+        None
+    """
+    if not args.verbose:
+        return
+    print(f"Stages: {downloader.tracer.summary()}")
+    print(f"Metadata cache: {downloader.metadata_cache.stats}")
+    print(f"HTTP transport: {downloader.transport.stats}")
+    if downloader.archive is not None:
+        print(f"Download archive: {downloader.archive.stats}")
+
+
+def serve(args, jobs):
+    """
+    Runs a coordinator handing the videos of the jobs out to workers.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+        jobs (list): The jobs.
+
+    Returns:
+        int: The exit code, 0 if every video was downloaded.
+    """
+    archive = DownloadArchive() if settings.DOWNLOAD_ARCHIVE and not args.no_archive else None
+    failures = Coordinator(jobs, address=args.serve, archive=archive).run()
+    print(f"Done: {len(failures)} failure(s).")
+    return 1 if failures else 0
+
+
+def run_worker(args):
+    """
+    Runs a worker taking videos from a coordinator until it has none left.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: The exit code, 0 if every job the worker took succeeded.
+    """
+    downloader = make_downloader(args)
+    stats = Worker(downloader, address=args.worker, output_dir=args.output_dir).run(args.parallel)
+    print_stats(args, downloader)
+    export_trace(args, downloader)
+    return 1 if stats["failed"] else 0
+
+
+def retag(args):
+    """
+    Tags the MP3s of the --retag directory again.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: The exit code, 0 if every MP3 was tagged.
+    """
+    downloader = make_downloader(args)
+    failures = downloader.retag_directory(args.retag)
+    for path, error in failures:
+        print(f"Failed: {path}: {error}")
+    print_stats(args, downloader)
+    export_trace(args, downloader)
+    print(f"Done: {len(failures)} failure(s).")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    """
+    Runs the downloader on every URL and prints its status messages.
+
+    Args:
+        argv (list, optional): The arguments, defaults to `sys.argv[1:]`.
+
+    Returns:
+        int: The exit code, 0 if every URL was processed successfully.
+    """
+    args = parse_args(argv)
+    if args.worker:
+        return run_worker(args)
+    if args.retag:
+        return retag(args)
+    urls = read_urls(args)
+    if not urls and not args.resume:
+        print("No URL given.")
+        return 2
+    jobs = make_jobs(args, urls)
+    if args.serve:
+        return serve(args, jobs)
+
+    downloader = make_downloader(args)
+    print_lock = threading.Lock()
+
+    def print_status(event):
+        # Byte-level progress is too chatty for a terminal, only status messages are printed
+        if event["type"] == "status":
+            with print_lock:
+                print(event["text"], flush=True)
+
+    downloader.progress.add_listener(print_status)
+
+    resumed_failed = 0
+    if args.resume:
+        if downloader.job_queue is None:
+            print("The job queue is disabled (YOUBER_JOB_QUEUE=0), nothing to resume.")
+        resumed = downloader.scheduler.call(BULK, downloader.resume_interrupted, name="resume")
+        for job, failures in resumed:
+            if failures:
+                resumed_failed += 1
+                print(f"Failed: {len(failures)} item(s) of {job.url}")
+        print(f"Resumed: {len(resumed) - resumed_failed}/{len(resumed)} interrupted job(s) completed.")
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as executor:
+        priority = PRIORITY_NAMES.index(args.priority)
+        futures = {executor.submit(downloader.scheduler.call, priority, downloader.run, job, name=job.url): job
+                   for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                failures = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Failed: {job.url}: {e}")
+                continue
+            if failures:
+                failed += 1
+                print(f"Failed: {len(failures)} item(s) of {job.url}")
+
+    print_stats(args, downloader)
+    export_trace(args, downloader)
+    if jobs:
+        print(f"Done: {len(jobs) - failed}/{len(jobs)} URL(s) processed successfully.")
+    return 1 if failed or resumed_failed else 0
+
+
+if __name__ == "__main__":
+    # Playlist conversions run in worker processes, which frozen executables have to bootstrap
+    multiprocessing.freeze_support()
+    sys.exit(main())
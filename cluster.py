@@ -0,0 +1,593 @@
+import hmac
+import itertools
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+
+from pytube import Playlist
+
+import settings
+from jobs import JobSpec
+from playlist_metadata import iter_playlist_pages
+from playlist_sync import PlaylistSync
+from scheduler import NORMAL
+
+# Seconds an idle worker waits before asking again, while the last jobs may still fail and be handed out again
+_WAIT_INTERVAL = 1
+
+# Seconds a worker keeps trying to reach a coordinator that is not listening yet
+_CONNECT_TIMEOUT = 30
+
+
+def parse_address(address):
+    """
+    Parses a coordinator address.
+
+    Args:
+        address (str): "host:port" for TCP ("[::1]:8765" for IPv6), or "unix:/path/to/socket".
+
+    Returns:
+        tuple: The socket family and the address to bind or connect to.
+
+    Raises:
+        ValueError: If the address is malformed.
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid address {address!r}, expected host:port or unix:/path")
+    if host.startswith("[") and host.endswith("]"):
+        return socket.AF_INET6, (host[1:-1], int(port))
+    return socket.AF_INET, (host, int(port))
+
+
+def send_message(stream, message):
+    """
+    Writes one message of the protocol: a JSON object on a line of its own.
+
+    Args:
+        stream (file): The binary socket file.
+        message (dict): The message, with its "type".
+
+    Returns:
+        None
+    """
+    stream.write(json.dumps(message).encode("utf-8") + b"\n")
+    stream.flush()
+
+
+def read_message(stream):
+    """
+    Reads one message of the protocol.
+
+    Args:
+        stream (file): The binary socket file.
+
+    Returns:
+        dict: The message, or None if the other side closed the connection.
+
+    Raises:
+        ValueError: If the line is not a JSON object.
+    """
+    line = stream.readline()
+    if not line:
+        return None
+    message = json.loads(line)
+    if not isinstance(message, dict):
+        raise ValueError(f"Invalid message: {line[:100]!r}")
+    return message
+
+
+class VideoTask:
+    """
+    One video handed to a worker: a single video job, or an item of a playlist job.
+    """
+
+    __slots__ = ("task_id", "video_url", "video_id", "job", "batch", "attempts", "lease", "worker", "renewed_at")
+
+    def __init__(self, task_id, video_url, job, batch=None, video_id=None):
+        self.task_id = task_id
+        self.video_url = video_url
+        self.video_id = video_id
+        self.job = job
+        self.batch = batch
+        self.attempts = 0
+        # The current assignment: its ID, the worker holding it and when it was handed out or last renewed
+        self.lease = None
+        self.worker = None
+        self.renewed_at = None
+
+    def __repr__(self):
+        return f"<VideoTask {self.task_id} {self.video_url}>"
+
+    def as_message(self, renew_interval):
+        return {"type": "task", "task_id": self.task_id, "lease": self.lease, "renew": renew_interval,
+                "video_url": self.video_url, "video_id": self.video_id, "playlist": self.batch is not None,
+                "job": self.job.as_dict()}
+
+
+class PlaylistBatch:
+    """
+    The items of one playlist job, tracked until all of them are done so a sync can be committed.
+    """
+
+    __slots__ = ("job", "sync", "outstanding", "enumerated", "failed_ids", "closed")
+
+    def __init__(self, job):
+        self.job = job
+        self.sync = None
+        self.outstanding = 0
+        self.enumerated = False
+        self.failed_ids = set()
+        self.closed = False
+
+
+class Coordinator:
+    """
+    Owns the queue of video jobs of a multi-worker run and hands them out to workers connecting over
+    TCP or a Unix socket. No broker is involved: the protocol is one JSON object per line.
+
+    A worker says "hello" (with the shared token, if one is set), then repeatedly asks for a job with
+    "ready", renews its lease with "renew" while the job makes progress, and reports it with "result".
+    It is answered with a "task", with "wait" while the last jobs may still come back, or with "done".
+    Workers pull jobs, so fast ones simply take more of them.
+
+    Playlists are enumerated page by page as workers ask for jobs, and their archived items are skipped
+    before any worker sees them. Workers report the archive entry of the items they download, which is
+    recorded in the coordinator's archive, so the next run skips them wherever they were downloaded.
+    Jobs whose worker fails or disconnects are handed out again, up to `retries` times. So are the jobs
+    of a worker that goes `lease_timeout` seconds without renewing their lease, e.g. on a stalled
+    download: every assignment is a lease, and results reported for an expired lease are ignored.
+    """
+
+    def __init__(self, jobs, address=settings.CLUSTER_ADDRESS, token=settings.CLUSTER_TOKEN, archive=None,
+                 playlist_sync=None, retries=settings.CLUSTER_RETRIES, lease_timeout=settings.CLUSTER_LEASE_TIMEOUT):
+        self.jobs = jobs
+        self.address = address
+        self.token = token
+        self.archive = archive
+        self.playlist_sync = playlist_sync
+        self.retries = retries
+        self.lease_timeout = lease_timeout
+        # (URL, error) pairs of the videos and playlists that failed
+        self.failures = []
+        # Jobs done, failed, bytes downloaded and first contact of every worker, by name
+        self.workers = {}
+
+        self._lock = threading.Lock()
+        # Held while enumerating, so pages are fetched by one handler at a time and in order
+        self._source_lock = threading.Lock()
+        self._tasks = self._iter_tasks()
+        self._retry = deque()
+        # Jobs handed out and not reported yet, by lease
+        self._in_flight = {}
+        self._leases = itertools.count(1)
+        self._enumerated = False
+        self._finished = threading.Event()
+
+    def _iter_tasks(self):
+        task_ids = itertools.count(1)
+        for job in self.jobs:
+            if not job.is_playlist:
+                yield VideoTask(next(task_ids), job.url, job)
+                continue
+
+            batch = PlaylistBatch(job)
+            try:
+                if job.sync:
+                    if self.playlist_sync is None:
+                        self.playlist_sync = PlaylistSync()
+                    batch.sync = self.playlist_sync.sync(job.url, report_removed=job.report_removed)
+                    print(f"Synced {batch.sync.title or batch.sync.playlist_id}: "
+                          f"{len(batch.sync.videos)} video(s) to download, {len(batch.sync.removed)} removed")
+                    pages = [batch.sync.videos]
+                else:
+                    pages = iter_playlist_pages(Playlist(job.url))
+                for page in pages:
+                    if self.archive is not None:
+                        archived = self.archive.archived((video.video_id for video in page), job.archive_format)
+                        page = [video for video in page if video.video_id not in archived]
+                    for video in page:
+                        with self._lock:
+                            batch.outstanding += 1
+                        yield VideoTask(next(task_ids), video.watch_url, job, batch, video.video_id)
+            except Exception as e:
+                print(f"Could not enumerate {job.url}: {e}")
+                with self._lock:
+                    self.failures.append((job.url, str(e)))
+            with self._lock:
+                batch.enumerated = True
+                self._close_batch(batch)
+
+    def accepts(self, token):
+        """
+        Tells whether a worker presenting `token` may take jobs.
+
+        Args:
+            token (str): The token sent in the worker's "hello".
+
+        Returns:
+            bool: True if no token is required or if it matches.
+        """
+        return not self.token or hmac.compare_digest(str(token or ""), self.token)
+
+    def assign(self, worker=None):
+        """
+        Picks the next job for a worker: one to retry first, else the next one of the queue.
+
+        Args:
+            worker (str, optional): The name of the worker, reported if its lease expires.
+
+        Returns:
+            dict: The reply to the worker, a "task", "wait" or "done" message.
+        """
+        with self._lock:
+            self._expire_leases()
+            task = self._retry.popleft() if self._retry else None
+        if task is None:
+            with self._source_lock:
+                task = next(self._tasks, None)
+
+        with self._lock:
+            if task is None:
+                self._enumerated = True
+                self._check_finished()
+                if self._finished.is_set():
+                    return {"type": "done"}
+                return {"type": "wait", "seconds": _WAIT_INTERVAL}
+            task.attempts += 1
+            task.lease, task.worker, task.renewed_at = next(self._leases), worker, time.monotonic()
+            self._in_flight[task.lease] = task
+            # Renewed several times per timeout, so a late renewal does not expire a job making progress
+            return task.as_message(max(1, self.lease_timeout / 3))
+
+    def renew(self, lease):
+        """
+        Extends a lease, on a worker's word that its job is making progress.
+
+        Args:
+            lease (int): The lease.
+
+        Returns:
+            bool: False if the lease already expired.
+        """
+        with self._lock:
+            task = self._in_flight.get(lease)
+            if task is None:
+                return False
+            task.renewed_at = time.monotonic()
+            return True
+
+    def complete(self, worker, result):
+        """
+        Records the result a worker reported.
+
+        Args:
+            worker (str): The name of the worker.
+            result (dict): The "result" message: "task_id", "lease", "error" (None on success), "bytes"
+                downloaded since the worker's previous result, "seconds" spent and the "archive" entry
+                of a playlist item downloaded.
+
+        Returns:
+            None
+        """
+        entry = result.get("archive")
+        if entry and not result.get("error") and self.archive is not None:
+            # Downloaded even if the lease expired meanwhile
+            self.archive.record(entry["video_id"], entry["format"], entry["itag"], entry["path"], entry["size"],
+                                entry["host"])
+        with self._lock:
+            stats = self._worker_stats(worker)
+            stats["bytes"] += result.get("bytes") or 0
+            stats["seconds"] += result.get("seconds") or 0
+            task = self._in_flight.pop(result.get("lease"), None)
+            if task is None:
+                # Reported after its lease expired, the job was handed out again
+                return
+            stats["jobs"] += 1
+            if result.get("error"):
+                stats["failed"] += 1
+            self._settle(task, result.get("error"))
+
+    def release(self, worker, leases):
+        """
+        Hands out again the jobs of a worker that disconnected before reporting them.
+
+        Args:
+            worker (str): The name of the worker.
+            leases (iterable): The leases of the jobs it held.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            for lease in leases:
+                task = self._in_flight.pop(lease, None)
+                if task is not None:
+                    self._settle(task, f"worker {worker} disconnected")
+            self._check_finished()
+
+    def _expire_leases(self):
+        # Called with the lock held
+        deadline = time.monotonic() - self.lease_timeout
+        for lease, task in list(self._in_flight.items()):
+            if task.renewed_at < deadline:
+                del self._in_flight[lease]
+                self._settle(task, f"no progress from worker {task.worker} in {self.lease_timeout}s")
+
+    def _worker_stats(self, worker):
+        return self.workers.setdefault(worker, {"jobs": 0, "failed": 0, "bytes": 0, "seconds": 0.0,
+                                                "since": time.monotonic()})
+
+    def _settle(self, task, error):
+        # Called with the lock held
+        if error and task.attempts <= self.retries:
+            print(f"Retrying {task.video_url}: {error}")
+            self._retry.append(task)
+            return
+        if error:
+            print(f"Failed: {task.video_url}: {error}")
+            self.failures.append((task.video_url, error))
+        if task.batch is not None:
+            task.batch.outstanding -= 1
+            if error:
+                task.batch.failed_ids.add(task.video_id)
+            self._close_batch(task.batch)
+        self._check_finished()
+
+    def _close_batch(self, batch):
+        # Called with the lock held, once per playlist when its last item is settled
+        if batch.closed or not batch.enumerated or batch.outstanding:
+            return
+        batch.closed = True
+        if batch.sync is not None:
+            self.playlist_sync.commit(batch.sync, batch.failed_ids)
+
+    def _check_finished(self):
+        if self._enumerated and not self._retry and not self._in_flight:
+            self._finished.set()
+
+    def run(self):
+        """
+        Serves jobs until every one of them is done or failed for good.
+
+        Returns:
+            list: The (URL, error) pairs of the videos and playlists that failed.
+        """
+        family, target = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(target):
+                # Left over by a coordinator that did not exit cleanly
+                os.remove(target)
+            server = _UnixServer(target, _CoordinatorHandler)
+        else:
+            _TCPServer.address_family = family
+            server = _TCPServer(target, _CoordinatorHandler)
+        server.coordinator = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Coordinator listening on {self.address}")
+
+        try:
+            # Short waits keep the main thread responsive to Ctrl+C
+            while not self._finished.wait(1):
+                with self._lock:
+                    self._expire_leases()
+        finally:
+            server.shutdown()
+            server.server_close()
+            if family == socket.AF_UNIX and os.path.exists(target):
+                os.remove(target)
+
+        for worker, stats in sorted(self.workers.items()):
+            elapsed = max(time.monotonic() - stats["since"], 1e-6)
+            print(f"Worker {worker}: {stats['jobs']} job(s), {stats['failed']} failed, "
+                  f"{stats['bytes'] / elapsed / 1e6:.2f} MB/s")
+        return self.failures
+
+
+class _CoordinatorHandler(socketserver.StreamRequestHandler):
+    """
+    One worker connection, served on a thread of its own.
+    """
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        try:
+            hello = read_message(self.rfile)
+        except (OSError, ValueError):
+            return
+        if not hello or hello.get("type") != "hello" or not coordinator.accepts(hello.get("token")):
+            send_message(self.wfile, {"type": "error", "error": "Unknown worker or invalid token"})
+            return
+        worker = str(hello.get("worker") or self.client_address)
+
+        held = set()
+        try:
+            while True:
+                message = read_message(self.rfile)
+                if message is None:
+                    break
+                if message.get("type") == "result":
+                    held.discard(message.get("lease"))
+                    coordinator.complete(worker, message)
+                elif message.get("type") == "renew":
+                    if message.get("lease") in held:
+                        coordinator.renew(message["lease"])
+                elif message.get("type") == "ready":
+                    reply = coordinator.assign(worker)
+                    if reply["type"] == "task":
+                        held.add(reply["lease"])
+                    send_message(self.wfile, reply)
+                    if reply["type"] == "done":
+                        break
+        except (OSError, ValueError) as e:
+            print(f"Lost worker {worker}: {e}")
+        finally:
+            coordinator.release(worker, held)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class Worker:
+    """
+    Takes video jobs from a coordinator and runs them with a local `YouTubeDownloader`: download,
+    conversion and tagging, as a playlist item or a single video would go. Each slot is a connection
+    of its own running one job at a time, so a worker with several slots runs jobs side by side.
+    """
+
+    def __init__(self, downloader, address=settings.CLUSTER_ADDRESS, token=settings.CLUSTER_TOKEN, name=None,
+                 output_dir=None):
+        self.downloader = downloader
+        self.address = address
+        self.token = token
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        # Overrides the output directory of the jobs, e.g. when the coordinator runs on another machine
+        self.output_dir = output_dir
+        self.stats = {"jobs": 0, "failed": 0, "bytes": 0}
+        self._lock = threading.Lock()
+        self._reported_bytes = 0
+
+    def run(self, slots=1):
+        """
+        Runs jobs until the coordinator has none left.
+
+        Args:
+            slots (int): The number of jobs run at the same time.
+
+        Returns:
+            dict: The number of jobs done and failed, and the bytes downloaded.
+        """
+        started = time.monotonic()
+        threads = [threading.Thread(target=self._run_slot, args=(slot,)) for slot in range(max(1, slots))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(f"Worker {self.name}: {self.stats['jobs']} job(s), {self.stats['failed']} failed, "
+              f"{self.stats['bytes'] / elapsed / 1e6:.2f} MB/s")
+        return self.stats
+
+    def _connect(self):
+        family, target = parse_address(self.address)
+        deadline = time.monotonic() + _CONNECT_TIMEOUT
+        while True:
+            connection = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                connection.connect(target)
+                return connection
+            except OSError:
+                connection.close()
+                if time.monotonic() > deadline:
+                    raise
+                # The coordinator may not be listening yet
+                time.sleep(0.5)
+
+    def _run_slot(self, slot):
+        try:
+            connection = self._connect()
+        except OSError as e:
+            print(f"Could not reach the coordinator at {self.address}: {e}")
+            return
+        with connection, connection.makefile("rwb") as stream:
+            try:
+                send_message(stream, {"type": "hello", "worker": self.name, "slot": slot, "token": self.token})
+                while True:
+                    send_message(stream, {"type": "ready"})
+                    message = read_message(stream)
+                    if message is None or message["type"] == "done":
+                        break
+                    if message["type"] == "error":
+                        print(f"Rejected by the coordinator: {message.get('error')}")
+                        break
+                    if message["type"] == "wait":
+                        time.sleep(message.get("seconds", _WAIT_INTERVAL))
+                        continue
+                    send_message(stream, self._execute_renewing(stream, message))
+            except (OSError, ValueError) as e:
+                print(f"Lost the coordinator at {self.address}: {e}")
+
+    def _execute_renewing(self, stream, task):
+        # Renews the lease while bytes keep coming in, so only a stalled job expires. The result is
+        # only sent once the renewals stopped, so both never write to the stream at the same time
+        done = threading.Event()
+
+        def renew():
+            downloaded = self.downloader.stream_downloader.bytes_downloaded
+            while not done.wait(task["renew"]):
+                current = self.downloader.stream_downloader.bytes_downloaded
+                if current == downloaded:
+                    continue
+                downloaded = current
+                try:
+                    send_message(stream, {"type": "renew", "lease": task["lease"]})
+                except OSError:
+                    return
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            return self.execute(task)
+        finally:
+            done.set()
+            renewer.join()
+
+    def execute(self, task):
+        """
+        Runs one job.
+
+        Args:
+            task (dict): The "task" message of the coordinator.
+
+        Returns:
+            dict: The "result" message to report.
+        """
+        job = JobSpec.from_dict(task["job"])
+        if self.output_dir:
+            job.output_dir = self.output_dir
+        started, started_at = time.monotonic(), time.time()
+        error = None
+        entry = None
+        try:
+            if task["playlist"]:
+                self.downloader.scheduler.call(NORMAL, self.downloader.process_playlist_item, task["video_url"], job,
+                                               name=task["video_url"])
+                entry = self._archive_entry(task, job, started_at)
+            else:
+                self.downloader.scheduler.call(NORMAL, self.downloader.run, job, name=job.url)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        with self._lock:
+            # Bytes read since the previous result of any slot, so the coordinator's sums stay exact
+            downloaded = self.downloader.stream_downloader.bytes_downloaded
+            transferred, self._reported_bytes = downloaded - self._reported_bytes, downloaded
+            self.stats["jobs"] += 1
+            self.stats["failed"] += error is not None
+            self.stats["bytes"] += transferred
+        return {"type": "result", "task_id": task["task_id"], "lease": task["lease"], "error": error,
+                "bytes": transferred,
+                "seconds": round(time.monotonic() - started, 3), "archive": entry}
+
+    def _archive_entry(self, task, job, since):
+        # What the local archive recorded for the item, for the coordinator's archive
+        archive = self.downloader.archive
+        if archive is None or not task.get("video_id"):
+            return None
+        entry = archive.lookup(task["video_id"], job.archive_format)
+        if entry is None or entry["downloaded_at"] < since:
+            return None
+        return {"video_id": task["video_id"], "format": job.archive_format, "itag": entry["itag"],
+                "path": entry["path"], "size": entry["size"], "host": socket.gethostname()}
@@ -0,0 +1,173 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import settings
+
+# HTTP statuses meaning the server wants fewer requests
+THROTTLE_STATUSES = (429, 503)
+
+
+def error_status(error):
+    """
+    Reads the HTTP status of a failed request from a `requests` or `urllib` error.
+
+    Args:
+        error (Exception): The error.
+
+    Returns:
+        int: The status code, or None if the error carries none.
+    """
+    status = getattr(error, "code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD controller of how many tasks may run at once, between `min_workers` and `max_workers`.
+
+    Tasks run inside `slot()`. Once per `window` seconds the controller looks at the throughput of
+    the last window, measured with `sample` (a monotonic counter such as the bytes downloaded so far,
+    or the number of finished tasks by default), and at the errors the tasks raised:
+
+    - any throttling status (429/503) or an error rate over `max_error_rate` halves the limit;
+    - a raise that brought no throughput gain is taken back, and probing pauses for a few windows;
+    - otherwise, if tasks had to wait for a slot, the limit grows by one.
+
+    Every change is printed with its reason and kept in `decisions`.
+    """
+
+    def __init__(self, name, min_workers=settings.PIPELINE_IO_MIN_WORKERS, max_workers=settings.PIPELINE_IO_MAX_WORKERS,
+                 initial=settings.PIPELINE_IO_INITIAL_WORKERS, window=settings.ADAPTIVE_WINDOW, sample=None,
+                 max_error_rate=0.2, min_gain=0.05, hold_windows=3):
+        self.name = name
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.limit = min(max(initial, self.min_workers), self.max_workers)
+        self.window = window
+        self.sample = sample
+        self.max_error_rate = max_error_rate
+        self.min_gain = min_gain
+        self.hold_windows = hold_windows
+        self.decisions = []
+
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._saturated = False
+        self._completed = 0
+        self._errors = 0
+        self._throttled = 0
+        self._window_started = time.monotonic()
+        self._window_sample = self._sample()
+        self._last_throughput = None
+        self._probing = False
+        self._hold = 0
+
+    def _sample(self):
+        return self.sample() if self.sample is not None else self._completed
+
+    @contextmanager
+    def slot(self):
+        """
+        Runs the body of the `with` block once fewer than `limit` tasks are running.
+        An exception raised by the body counts as an error of the window before it propagates.
+
+        Yields:
+            None
+        """
+        self.acquire()
+        try:
+            yield
+        except Exception as e:
+            self.release(e)
+            raise
+        else:
+            self.release()
+
+    def acquire(self):
+        """
+        Waits for a free slot. Waiting tasks also drive the periodic adjustment of the limit.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._waiting += 1
+            try:
+                while self._active >= self.limit:
+                    self._saturated = True
+                    self._condition.wait(timeout=self.window)
+                    self._maybe_adjust()
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            if self._active >= self.limit:
+                self._saturated = True
+
+    def release(self, error=None):
+        """
+        Frees a slot and records how its task ended.
+
+        Args:
+            error (Exception, optional): The error the task raised, if any.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._active -= 1
+            self._completed += 1
+            if error is not None:
+                self._errors += 1
+                if error_status(error) in THROTTLE_STATUSES:
+                    self._throttled += 1
+            self._maybe_adjust()
+            self._condition.notify_all()
+
+    def _maybe_adjust(self):
+        # Runs with the condition held, at most once per window
+        now = time.monotonic()
+        elapsed = now - self._window_started
+        if elapsed < self.window:
+            return
+
+        current_sample = self._sample()
+        throughput = (current_sample - self._window_sample) / elapsed
+        errors, throttled, completed, saturated = self._errors, self._throttled, self._completed, self._saturated
+        self._window_started = now
+        self._window_sample = current_sample
+        self._errors = self._throttled = self._completed = 0
+        self._saturated = self._active >= self.limit
+
+        if throttled or (completed and errors / completed > self.max_error_rate):
+            reason = (f"{throttled} throttled response(s)" if throttled
+                      else f"{errors}/{completed} task(s) failed")
+            self._set_limit(max(self.min_workers, self.limit // 2), reason)
+            self._probing = False
+            self._hold = self.hold_windows
+        elif self._probing and self._last_throughput is not None and \
+                throughput < self._last_throughput * (1 + self.min_gain):
+            self._set_limit(max(self.min_workers, self.limit - 1),
+                            f"no gain from the last worker ({throughput:.1f}/s vs {self._last_throughput:.1f}/s)")
+            self._probing = False
+            self._hold = self.hold_windows
+        elif self._hold:
+            self._hold -= 1
+            self._probing = False
+        elif saturated and self.limit < self.max_workers:
+            self._set_limit(self.limit + 1, f"tasks waiting for a slot at {throughput:.1f}/s")
+            self._probing = True
+        else:
+            self._probing = False
+        self._last_throughput = throughput
+
+    def _set_limit(self, limit, reason):
+        if limit == self.limit:
+            return
+        print(f"[{self.name}] concurrency {self.limit} -> {limit}: {reason}")
+        self.decisions.append((time.time(), self.limit, limit, reason))
+        self.limit = limit
+        self._condition.notify_all()
@@ -0,0 +1,173 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import settings
+
+# Video IDs looked up per query, below SQLite's limit of bound parameters
+_LOOKUP_BATCH = 500
+
+
+class DownloadArchive:
+    """
+    Persistent record of the videos already downloaded, backed by SQLite.
+
+    Entries are keyed by video ID and output format (e.g. "mp3"), and hold the itag of the stream,
+    the output file and its size. A video counts as archived only while that file still exists with
+    the recorded size, so deleting an output is enough to download it again. Outputs written on another
+    machine (e.g. by a cluster worker) cannot be checked on the local disk, they are trusted as recorded.
+
+    The primary key index keeps lookups fast with hundreds of thousands of entries, and WAL mode
+    with a busy timeout lets several threads and processes read and write the same archive.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(settings.CACHE_DIR, "archive.sqlite3")
+        self.stats = {"hits": 0, "recorded": 0}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Writers of other processes hold the database for a few milliseconds at most, wait for them
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    video_id TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    itag INTEGER,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    host TEXT,
+                    downloaded_at REAL NOT NULL,
+                    PRIMARY KEY (video_id, format)
+                ) WITHOUT ROWID""")
+            # Columns added since the table was first created
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(downloads)")}
+            if "host" not in columns:
+                self._connection.execute("ALTER TABLE downloads ADD COLUMN host TEXT")
+
+    def record(self, video_id, output_format, itag, path, size=None, host=None):
+        """
+        Records a finished download, replacing any previous entry of the video in that format.
+
+        Args:
+            video_id (str): The video ID.
+            output_format (str): The output format, see `JobSpec.archive_format`.
+            itag (int): The itag of the downloaded stream.
+            path (str): The output file.
+            size (int, optional): The size of the output, for an output on another machine.
+            host (str, optional): The machine the output was written on, e.g. by a cluster worker.
+                Local outputs are checked and measured on the disk.
+
+        Returns:
+            None
+        """
+        if host == socket.gethostname():
+            host = None
+        if host is None:
+            if not os.path.exists(path):
+                print(f"Not archiving {video_id}, {path} does not exist")
+                return
+            path, size = os.path.abspath(path), os.path.getsize(path)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                INSERT INTO downloads (video_id, format, itag, path, size, host, downloaded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(video_id, format) DO UPDATE SET itag = excluded.itag, path = excluded.path,
+                    size = excluded.size, host = excluded.host, downloaded_at = excluded.downloaded_at""",
+                                     (video_id, output_format, itag, path, size, host, time.time()))
+            self.stats["recorded"] += 1
+
+    def lookup(self, video_id, output_format):
+        """
+        Returns the archive entry of a video.
+
+        Args:
+            video_id (str): The video ID.
+            output_format (str): The output format.
+
+        Returns:
+            dict: The "itag", "path", "size" and "downloaded_at" of the entry, or None if there is none.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT itag, path, size, downloaded_at FROM downloads WHERE video_id = ? AND format = ?",
+                (video_id, output_format)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("itag", "path", "size", "downloaded_at"), row))
+
+    def archived(self, video_ids, output_format):
+        """
+        Finds which of the videos were already downloaded in a format and still have their output.
+        Only reads the archive and the local disk, no request is made. The entries of outputs that
+        no longer exist are dropped.
+
+        Args:
+            video_ids (iterable): The video IDs.
+            output_format (str): The output format.
+
+        Returns:
+            set: The IDs of the archived videos.
+        """
+        video_ids = list(video_ids)
+        archived = set()
+        missing = []
+        for start in range(0, len(video_ids), _LOOKUP_BATCH):
+            batch = video_ids[start:start + _LOOKUP_BATCH]
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT video_id, path, size, host FROM downloads WHERE format = ? "
+                    f"AND video_id IN ({', '.join('?' * len(batch))})", [output_format] + batch).fetchall()
+            for video_id, path, size, host in rows:
+                if host is not None or (os.path.exists(path) and os.path.getsize(path) == size):
+                    archived.add(video_id)
+                elif not os.path.exists(path):
+                    missing.append(video_id)
+        # Outputs deleted since they were recorded: their entries are of no use anymore
+        for video_id in missing:
+            self.forget(video_id, output_format)
+        with self._lock:
+            self.stats["hits"] += len(archived)
+        return archived
+
+    def entries_in(self, directory, output_format):
+        """
+        Lists the videos downloaded in a format into a directory of this machine.
+
+        Args:
+            directory (str): The directory.
+            output_format (str): The output format.
+
+        Returns:
+            list: (video ID, output path) pairs of the outputs still there, in path order.
+        """
+        directory = os.path.abspath(directory)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT video_id, path FROM downloads WHERE format = ? AND host IS NULL ORDER BY path",
+                (output_format,)).fetchall()
+        return [(video_id, path) for video_id, path in rows
+                if os.path.dirname(path) == directory and os.path.exists(path)]
+
+    def forget(self, video_id, output_format=None):
+        """
+        Drops the entries of a video, so it is downloaded again.
+
+        Args:
+            video_id (str): The video ID.
+            output_format (str, optional): Only drop the entry of this format.
+
+        Returns:
+            None
+        """
+        with self._lock, self._connection:
+            if output_format is None:
+                self._connection.execute("DELETE FROM downloads WHERE video_id = ?", (video_id,))
+            else:
+                self._connection.execute("DELETE FROM downloads WHERE video_id = ? AND format = ?",
+                                         (video_id, output_format))
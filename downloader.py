@@ -1,28 +1,56 @@
-import concurrent
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
-import eyed3
-from PIL import Image
-from io import BytesIO
-import requests
-from proglog import ProgressBarLogger
-from pytube import YouTube, Playlist
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import os
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-from moviepy.video.io.VideoFileClip import VideoFileClip
+from pytube import Playlist, extract
+
+import settings
+from bandwidth import limiter_from_settings
+from concurrency import AdaptiveConcurrency
+from download_archive import DownloadArchive
+from ffmpeg_tools import CoverFile, FFmpegError, audio_output_args, encode_chunks, remux_audio_and_video, transcode_audio
+from http_session import get_transport
+from job_queue import CONVERTING, DONE, DOWNLOADING, FAILED, UNFINISHED, JobQueue
+from metadata_cache import MetadataCache
+from pipeline import StagedPipeline
+from playlist_metadata import iter_playlist_pages
+from playlist_sync import PlaylistSync
+from progress_bus import ProgressBus
+from scheduler import BULK, INTERACTIVE, Scheduler, current_priority
+from segmented_download import SegmentedDownloader
+from stream_selection import stream_index
+from thumbnail_cache import ThumbnailCache, video_id_from_thumbnail_url
+from tracing import Tracer
+
+# Samples moviepy decodes at a time, as in `AudioFileClip.write_audiofile`
+MOVIEPY_BUFFER_SIZE = 2000
+
+
+def make_bar_logger(downloader):
+    """
+    Builds the proglog logger reporting moviepy progress on the progress bus of a downloader.
+    proglog comes with moviepy, so it is only imported when the moviepy backend runs.
+
+    Args:
+        downloader (YouTubeDownloader): The downloader.
+
+    Returns:
+        ProgressBarLogger: The logger.
+    """
+    from proglog import ProgressBarLogger
 
+    class MyBarLogger(ProgressBarLogger):
+        def __init__(self, downloader):
+            super().__init__()
+            self.downloader = downloader
 
-class MyBarLogger(ProgressBarLogger):
-    def __init__(self, downloader):
-        super().__init__()
-        self.downloader = downloader
+        def bars_callback(self, bar, attr, value, old_value=None):
+            # Every time the logger progress is updated, this function is called.
+            # It only records the latest value, the GUI picks it up on its next refresh
+            self.downloader.progress.publish(f"moviepy-{bar}", "processing", value, self.bars[bar]['total'],
+                                             "Processing video..", unit="frames")
 
-    def bars_callback(self, bar, attr, value, old_value=None):
-        # Every time the logger progress is updated, this function is called
-        percentage = (value / self.bars[bar]['total']) * 100
-        self.downloader.main_app.finish_label.configure(text=f"Processing video.. {percentage:.2f}%",
-                                                        text_color="purple")
+    return MyBarLogger(downloader)
 
 
 def set_mp3_metadata_eyed3(filename, album, artist, year, genre, image_data):
@@ -47,11 +75,15 @@ def set_mp3_metadata_eyed3(filename, album, artist, year, genre, image_data):
         - "Error loading MP3 file" if the file cannot be loaded.
         - "Metadata updated successfully." after saving the changes to the MP3 file.
     """
+    # Only needed to retag existing files, imported on first use
+    import eyed3
 
     audio = eyed3.load(filename)
     if audio is None:
         print("Error loading MP3 file")
         return
+    if audio.tag is None:
+        audio.initTag()
 
     # Set the metadata tags
     audio.tag.album = album
@@ -63,98 +95,466 @@ def set_mp3_metadata_eyed3(filename, album, artist, year, genre, image_data):
     if image_data:
         audio.tag.images.set(3, image_data, "image/jpeg")
 
-    # Save the changes to the MP3 file
+    # Save the changes to the MP3 file. The tag is written in place when it fits in the one the file
+    # already has (e.g. the one written at encoding time), without rewriting the audio after it
     audio.tag.save()
     print("Metadata updated successfully.")
 
 
+def tag_mp3_files(entries):
+    """
+    Tags many MP3 files in one call, so a single worker process can handle a whole batch.
+
+    Args:
+        entries (list): (path, album, artist, year, image_data) tuples, as `set_mp3_metadata_eyed3` takes them.
+
+    Returns:
+        list: The (path, error message) pairs of the files that could not be tagged.
+    """
+    failures = []
+    for path, album, artist, year, image_data in entries:
+        try:
+            set_mp3_metadata_eyed3(path, album, artist, year, "", image_data)
+        except Exception as e:
+            failures.append((path, str(e)))
+    return failures
+
+
+def audio_tags(album, artist, year):
+    """
+    The tags written by ffmpeg at encoding time, matching the ones `set_mp3_metadata_eyed3` sets.
+
+    Args:
+        album (str): The album name.
+        artist (str): The artist name.
+        year (datetime or str): The date of release, only its year is kept.
+
+    Returns:
+        dict: The ffmpeg metadata.
+    """
+    if hasattr(year, "strftime"):
+        # ID3v2.3 only holds the year reliably
+        year = year.strftime("%Y")
+    return {"album": album, "artist": artist, "date": year}
+
+
+def convert_audio_to_mp3(audio_path, logger=None, tags=None, cover=None):
+    """
+    Converts an audio file to MP3 next to it, tagged, then removes the original.
+
+    With the "ffmpeg" `settings.AUDIO_BACKEND`, a single ffmpeg process decodes, encodes and tags
+    the file. With "moviepy", moviepy decodes the file and its samples are piped into one ffmpeg
+    process encoding and tagging them. Either way the MP3 is written once, with its tags and cover.
+
+    Args:
+        audio_path (str): The path of the downloaded audio file.
+        logger (Logger, optional): An optional logger object for logging conversion progress (moviepy only).
+        tags (dict, optional): The tags to embed, see `audio_tags`.
+        cover (bytes, optional): The album cover image to embed.
+
+    Returns:
+        str: The path to the converted MP3 file.
+    """
+
+    # Define the output MP3 file path
+    mp3_path = os.path.splitext(audio_path)[0] + ".mp3"
+
+    if settings.AUDIO_BACKEND == "moviepy":
+        # Imported on first use: moviepy pulls in numpy and imageio, which slow down the start a lot
+        from moviepy.audio.io.AudioFileClip import AudioFileClip
+
+        # Decode the audio using moviepy, as 16 bits samples
+        audio_clip = AudioFileClip(audio_path)
+        try:
+            chunks = (chunk.tobytes() for chunk in audio_clip.iter_chunks(
+                chunksize=MOVIEPY_BUFFER_SIZE, quantize=True, nbytes=2, fps=audio_clip.fps, logger=logger))
+            with CoverFile(cover) as cover_path:
+                # With the cover as a second input, ffmpeg reads the samples through a thread whose
+                # queue only holds 8 packets by default, which stalls the pipe
+                encode_chunks(chunks, mp3_path, audio_output_args("mp3", tags=tags, cover_path=cover_path),
+                              ["-thread_queue_size", "1024", "-f", "s16le", "-ar", str(audio_clip.fps),
+                               "-ac", str(audio_clip.nchannels)])
+        finally:
+            # Close the audio clip to release resources
+            audio_clip.close()
+    else:
+        transcode_audio(audio_path, mp3_path, "mp3", tags, cover)
+
+    # Remove the original WebM audio file if it exists
+    if os.path.exists(audio_path):
+        try:
+            os.remove(audio_path)
+        except FileExistsError:
+            print("Got a problem while excluding a file. It is being used by another process, but this is "
+                  "just a warning, as the file was removed.")
+    else:
+        print(f"Original audio file does not exist at {audio_path}")
+    return mp3_path
+
+
+def convert_and_tag(audio_path, convert, album, artist, year, image_data):
+    """
+    Conversion stage of the playlist pipeline: converts a downloaded file to MP3, tagging it while it is encoded.
+    Runs in a worker process, so it only takes plain values and never touches the GUI.
+
+    Args:
+        audio_path (str): The path of the downloaded file.
+        convert (bool): Whether to perform the conversion or not.
+        album (str): The album name.
+        artist (str): The artist name.
+        year (str): The year of release.
+        image_data (bytes): The binary data of the album cover image.
+
+    Returns:
+        str: The path to the MP3 file, or None if no conversion was requested.
+    """
+    if not convert:
+        return None
+    # Converted and tagged in one go
+    return convert_audio_to_mp3(audio_path, tags=audio_tags(album, artist, year), cover=image_data)
+
+
 class YouTubeDownloader:
-    def __init__(self, main_app):
-        self.playlist_urls = None
-        self.audio_path = None
-        self.main_app = main_app
-        self.logger = MyBarLogger(self)
+    """
+    The download engine. It takes explicit `JobSpec`s and reports what it does on `self.progress`,
+    so it runs the same behind the GUI, the command line or a script.
+    """
+
+    def __init__(self, connections_per_stream=settings.CONNECTIONS_PER_STREAM):
+        self._logger = None
+        # One keep-alive pool for pages, player requests, thumbnails and stream bodies
+        self.transport = get_transport()
+        # Caps the total download rate, shared evenly between the streams in flight
+        self.limiter = limiter_from_settings()
+        # Times every stage of every job, from the page fetches to the conversions
+        self.tracer = Tracer()
+        self.stream_downloader = SegmentedDownloader(connections=connections_per_stream,
+                                                     session=self.transport.session, limiter=self.limiter,
+                                                     tracer=self.tracer)
+        self.metadata_cache = MetadataCache()
+        # Playlist items already downloaded are skipped before any request, None disables it
+        self.archive = DownloadArchive() if settings.DOWNLOAD_ARCHIVE else None
+        # State of every playlist item, so interrupted runs resume where they stopped. None disables it
+        self.job_queue = JobQueue() if settings.JOB_QUEUE else None
+        # What each synced playlist held last time
+        self.playlist_sync = PlaylistSync()
+        self.thumbnail_cache = ThumbnailCache(session=self.transport.session)
+        self.progress = ProgressBus(rate_estimator=self.limiter.expected_rate)
+        # Runs the jobs by priority class and shares the encoders between them
+        self.scheduler = Scheduler(tracer=self.tracer)
+        self.tracer.add_collector(self.scheduler.prometheus_lines)
+        # Playlist items run as many at once as the measured download throughput keeps benefiting from
+        self.pipeline = StagedPipeline(AdaptiveConcurrency(
+            "playlist", sample=lambda: self.stream_downloader.bytes_downloaded), tracer=self.tracer,
+            scheduler=self.scheduler)
+
+    @property
+    def logger(self):
+        """
+        The proglog logger reporting moviepy progress, built on first use.
+        """
+        if self._logger is None:
+            self._logger = make_bar_logger(self)
+        return self._logger
 
-    def download(self):
+    def download(self, job, priority=INTERACTIVE):
         """
         Start the download in a separate thread.
+
+        Args:
+            job (JobSpec): The video to download.
+            priority (int): Its priority class. Interactive by default, playlists running meanwhile yield to it.
         """
 
         # This method starts the download in a separate thread
-        threading.Thread(target=self.download_in_background).start()
+        self.progress.reset()
+        self.scheduler.submit(priority, self.run, job, name=job.url)
 
-    def download_playlist(self):
+    def download_playlist(self, job, videos=None, priority=BULK):
         """
         Starts the download of the playlist in a separate thread.
+
+        Args:
+            job (JobSpec): The playlist to download.
+            videos (list, optional): The playlist records, if they were already fetched.
+            priority (int): Its priority class. Bulk by default, it yields to single videos.
         """
 
         # This method starts the download in a separate thread
-        threading.Thread(target=self.download_playlist_in_background).start()
+        self.progress.reset()
+        self.scheduler.submit(priority, self.download_playlist_in_background, job, videos, name=job.url)
 
-    def download_image(self, thumbnail_url, title):
+    def run(self, job):
         """
-        Downloads an image from the given thumbnail URL.
+        Processes a job in the calling thread, whether it points to a video or a playlist.
+
+        Args:
+            job (JobSpec): The job to run.
+
+        Returns:
+            list: The (video URL, error) pairs of the items that failed. Empty if everything went fine.
+
+        Raises:
+            Exception: If a single video download fails.
+        """
+        if job.is_playlist:
+            return self.download_playlist_in_background(job)
+        with self.tracer.job(job.url):
+            self.download_in_background(job)
+        return []
+
+    def on_stream_progress(self, stream, _, bytes_remaining):
+        """
+        A pytube progress callback that records the progress of a stream download on the progress bus.
+
+        Args:
+            stream: The stream object representing the download.
+            _: The chunk just written, not used in this function.
+            bytes_remaining: The number of bytes remaining to be downloaded.
+
+        Returns:
+            None
+        """
+        self.progress.publish(f"{stream.title}/{stream.itag}", stream.type, stream.filesize - bytes_remaining,
+                              stream.filesize, stream.title)
+
+    def download_image(self, thumbnail_url, title, video_id=None):
+        """
+        Gets the cover art of a video from the thumbnail cache, downloading it only the first time.
 
         Parameters:
             thumbnail_url (str): The URL of the thumbnail image to download.
             title (str): The title of the image.
+            video_id (str, optional): The video ID. Read from the thumbnail URL if not given.
 
         Returns:
-            bytes: The downloaded image data as bytes, or None if the download failed.
+            bytes: The JPEG image data as bytes, or None if the download failed.
         """
-        response = requests.get(thumbnail_url)
+        video_id = video_id or video_id_from_thumbnail_url(thumbnail_url)
+        if video_id is None:
+            print(f"Could not find the video ID of thumbnail {thumbnail_url}")
+            return None
 
-        if response.status_code == 200:
-            img_data = Image.open(BytesIO(response.content))
-            # Convert the image data to bytes
-            with BytesIO() as img_bytes_io:
-                img_data.save(img_bytes_io,
-                              format='JPEG')  # You can specify the desired format ('JPEG', 'PNG', etc.)
-                img_data = img_bytes_io.getvalue()
+        with self.tracer.span("thumbnail") as span:
+            img_data = self.thumbnail_cache.get_cover(video_id, thumbnail_url)
+            span.bytes = len(img_data or b"")
 
-            self.main_app.finish_label.configure(text=f"Finished album download for: {title}",
-                                                 text_color="purple")
-            return img_data
-        return None
+        if img_data is not None:
+            self.progress.status(f"Finished album download for: {title}", "purple")
+        return img_data
 
-    def download_audio_and_convert_to_mp3(self, video_url, save_path):
+    def stream_refresher(self, video_url, itag):
         """
-        Downloads a video from the given YouTube `video_url` and converts it to mp3 format.
-        Then, updates the metadata of the mp3 with some info from the video.
+        Builds a callable that fetches a fresh copy of a stream, used when its signed URL expires.
 
         Args:
-            video_url (str): The URL of the YouTube video to download.
-            save_path (str): The directory in which to save the downloaded file.
+            video_url (str): The URL of the YouTube video the stream belongs to.
+            itag (int): The itag of the stream.
+
+        Returns:
+            callable: A function returning the refreshed stream.
+        """
+
+        def refresh():
+            # Its URLs were refused: dropped, so no other download picks it up again before its TTL ends
+            self.metadata_cache.invalidate_manifest(video_url)
+            yt = self.metadata_cache.get_youtube(video_url)
+            yt.register_on_progress_callback(self.on_stream_progress)
+            return yt.streams.get_by_itag(itag)
+
+        return refresh
+
+    def stream_to_mp3(self, stream, mp3_path, refresh=None, tags=None, cover=None):
+        """
+        Encodes a stream to MP3 while it downloads: its bytes are piped into ffmpeg as they arrive,
+        so no intermediate audio file is written and the MP3 is ready, tagged, right after the last byte.
+
+        Args:
+            stream (Stream): The pytube stream holding the audio.
+            mp3_path (str): The path of the MP3 file.
+            refresh (callable, optional): Returns a fresh copy of the stream when its URL has expired.
+            tags (dict, optional): The tags to embed, see `audio_tags`.
+            cover (bytes, optional): The album cover image to embed.
+
+        Returns:
+            str: The path of the MP3 file, or None if ffmpeg could not encode the stream from a pipe
+                (the caller then downloads the file and converts it).
+        """
+        try:
+            with CoverFile(cover) as cover_path, self.tracer.span("stream_convert") as span:
+                encode_chunks(self.stream_downloader.iter_chunks(stream, refresh), mp3_path,
+                              audio_output_args("mp3", tags=tags, cover_path=cover_path))
+                span.bytes = os.path.getsize(mp3_path)
+                return mp3_path
+        except FFmpegError as e:
+            print(f"Could not encode {os.path.basename(mp3_path)} while downloading, "
+                  f"converting after the download instead: {e}")
+            return None
+
+    def archive_item(self, video_id, job, itag, path):
+        """
+        Records a finished playlist item in the download archive, if there is one.
+
+        Args:
+            video_id (str): The video ID.
+            job (JobSpec): The playlist job the video belongs to.
+            itag (int): The itag of the downloaded stream.
+            path (str): The output file.
 
         Returns:
             None
         """
-        yt = YouTube(video_url)
-        self.main_app.finish_label.configure(text=f"Initializing download for: {yt.title}",
-                                             text_color="purple")
-        yt.register_on_progress_callback(self.main_app.progress_callback)
+        if self.archive is not None and path:
+            self.archive.record(video_id, job.archive_format, itag, path)
 
-        img_data = self.download_image(yt.thumbnail_url, yt.title)
+    def download_playlist_item(self, video_url, job, pending=None, run_id=None):
+        """
+        Download stage of the playlist pipeline: fetches the metadata, the cover art and the stream of a video.
 
-        if self.main_app.playlist_only_audio.get():
-            # Download the highest quality audio
-            audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
-            audio_stream.download(output_path=save_path)
-        else:
-            # Download the highest quality audio and video streams
-            audio_stream = yt.streams.filter(progressive=True, file_extension='mp4').order_by(
-                'resolution').desc().first()
-            audio_stream.download(output_path=save_path)
+        Args:
+            video_url (str): The URL of the YouTube video to download.
+            job (JobSpec): The playlist job the video belongs to.
+            pending (dict, optional): Receives (video ID, itag) by video URL for the items handed over
+                to the conversion stage, to archive them once converted.
+            run_id (int, optional): The job queue run of the item, which records what resuming its
+                conversion needs once it is downloaded.
 
-        self.main_app.finish_label.configure(text=f"Downloaded video/mp3 for: {yt.title}",
-                                             text_color="purple")
+        Returns:
+            tuple: The arguments of `convert_and_tag` for this video, or None if it is already done.
+        """
+        with self.tracer.span("metadata"):
+            yt = self.metadata_cache.get_youtube(video_url)
+        self.progress.status(f"Initializing download for: {yt.title}", "purple")
+        yt.register_on_progress_callback(self.on_stream_progress)
+
+        img_data = self.download_image(yt.thumbnail_url, yt.title, yt.video_id)
+
+        if not job.only_audio and not job.convert_to_mp3:
+            video_stream = stream_index(yt).select_video(job.video_policy)
+            video_path = self.download_playlist_video(yt, video_stream, job)
+            self.progress.status(f"Downloaded video for: {yt.title}", "purple")
+            self.archive_item(yt.video_id, job, video_stream.itag, video_path)
+            return None
+
+        # Only the audio is kept, from the audio stream the policy picks
+        audio_stream = stream_index(yt).select_audio(job.audio_policy)
+        refresh = self.stream_refresher(video_url, audio_stream.itag)
 
-        mp3_path = self.convert_mp3(self.main_app.convert_to_mp3.get(), save_path, audio_stream.default_filename, yt)
+        if job.convert_to_mp3 and settings.STREAM_CONVERSION:
+            mp3_path = os.path.join(job.output_dir, os.path.splitext(audio_stream.default_filename)[0] + ".mp3")
+            tags = audio_tags(yt.title, yt.author, yt.publish_date)
+            if self.stream_to_mp3(audio_stream, mp3_path, refresh, tags, img_data) is not None:
+                # Encoded and tagged while downloading, nothing is left for the conversion stage
+                self.progress.status(f"Downloaded mp3 for: {yt.title}", "purple")
+                self.archive_item(yt.video_id, job, audio_stream.itag, mp3_path)
+                return None
 
-        if mp3_path is not None:
-            self.try_update_metadata(yt, mp3_path, img_data)
+        audio_path = self.stream_downloader.download(audio_stream, job.output_dir, refresh=refresh)
 
-    def convert_mp3(self, convert, save_path, filename, yt, logger=None):
+        self.progress.status(f"Downloaded video/mp3 for: {yt.title}", "purple")
+
+        if not job.convert_to_mp3:
+            # Kept as downloaded, nothing is left for the conversion stage
+            self.archive_item(yt.video_id, job, audio_stream.itag, audio_path)
+            return None
+        if pending is not None:
+            pending[video_url] = (yt.video_id, audio_stream.itag)
+        if run_id is not None:
+            # Enough to convert and tag the file again without a request, should the run be interrupted
+            self.job_queue.set_state(run_id, video_url, CONVERTING, {
+                "path": audio_path, "album": yt.title, "artist": yt.author,
+                "year": yt.publish_date.strftime("%Y") if yt.publish_date else None,
+                "thumbnail_url": yt.thumbnail_url, "video_id": yt.video_id, "itag": audio_stream.itag})
+        return audio_path, job.convert_to_mp3, yt.title, yt.author, yt.publish_date, img_data
+
+    def resume_conversion(self, video_url, job, data, pending=None):
+        """
+        Picks up a playlist item an interrupted run left between its download and its conversion,
+        without downloading it again.
+
+        Args:
+            video_url (str): The URL of the YouTube video.
+            job (JobSpec): The playlist job the video belongs to.
+            data (dict): What the job queue recorded once the item was downloaded.
+            pending (dict, optional): Receives (video ID, itag) by video URL, as in `download_playlist_item`.
+
+        Returns:
+            tuple: The arguments of `convert_and_tag` for this video, None if it was converted before
+                the run was interrupted, or False if its downloaded file is gone.
+        """
+        audio_path = data["path"]
+        if not os.path.exists(audio_path):
+            mp3_path = os.path.splitext(audio_path)[0] + ".mp3"
+            if not os.path.exists(mp3_path):
+                return False
+            # Converted, the run only stopped before recording it
+            self.archive_item(data["video_id"], job, data["itag"], mp3_path)
+            return None
+        self.progress.status(f"Resuming conversion for: {data['album']}", "purple")
+        img_data = self.download_image(data["thumbnail_url"], data["album"], data["video_id"])
+        if pending is not None:
+            pending[video_url] = (data["video_id"], data["itag"])
+        return audio_path, job.convert_to_mp3, data["album"], data["artist"], data["year"], img_data
+
+    def process_playlist_item(self, video_url, job):
+        """
+        Runs both stages of the playlist pipeline for one item in the calling thread, for callers
+        scheduling the items themselves (e.g. a cluster worker).
+
+        Args:
+            video_url (str): The URL of the YouTube video to download.
+            job (JobSpec): The playlist job the video belongs to.
+
+        Returns:
+            None
+        """
+        pending = {}
+        with self.tracer.job(video_url), self.tracer.span("item"):
+            conversion = self.download_playlist_item(video_url, job, pending)
+            if conversion is None:
+                return
+            with self.scheduler.encoder(), self.tracer.span("convert_and_tag"):
+                mp3_path = convert_and_tag(*conversion)
+        if video_url in pending:
+            video_id, itag = pending.pop(video_url)
+            self.archive_item(video_id, job, itag, mp3_path)
+
+    def download_playlist_video(self, yt, video_stream, job):
+        """
+        Downloads a playlist item as a video file. A progressive stream is saved as it is; a video-only
+        stream is downloaded with the audio stream of the job's audio policy, and both are merged into an MP4.
+
+        Args:
+            yt (YouTube): The video.
+            video_stream (Stream): The video stream the job's video policy picked.
+            job (JobSpec): The playlist job the video belongs to.
+
+        Returns:
+            str: The path of the video file.
+        """
+        if video_stream.is_progressive:
+            return self.stream_downloader.download(video_stream, job.output_dir,
+                                                   refresh=self.stream_refresher(yt.watch_url, video_stream.itag))
+
+        audio_stream = stream_index(yt).select_audio(job.audio_policy)
+        stem = os.path.splitext(video_stream.default_filename)[0]
+        video_path = self.stream_downloader.download(
+            video_stream, job.output_dir, f"{stem}-video.{video_stream.subtype}",
+            refresh=self.stream_refresher(yt.watch_url, video_stream.itag))
+        audio_path = self.stream_downloader.download(
+            audio_stream, job.output_dir, f"{stem}-audio.{audio_stream.subtype}",
+            refresh=self.stream_refresher(yt.watch_url, audio_stream.itag))
+
+        # Copies the tracks as they are when MP4 can hold them
+        output_path = os.path.join(job.output_dir, f"{stem}.mp4")
+        with self.scheduler.encoder(), self.tracer.span("merge"):
+            mode = remux_audio_and_video(video_path, audio_path, output_path)
+        self.progress.status(f"Merged {os.path.basename(output_path)} ({mode})", "purple")
+        os.remove(video_path)
+        os.remove(audio_path)
+        return output_path
+
+    def convert_mp3(self, convert, save_path, filename, yt, logger=None, image_data=None):
         """
         Convert a downloaded audio file to MP3 format.
 
@@ -164,6 +564,7 @@ class YouTubeDownloader:
             filename (str): The name of the downloaded audio file.
             yt (YouTube): The YouTube object representing the downloaded video.
             logger (Logger, optional): An optional logger object for logging conversion progress.
+            image_data (bytes, optional): The album cover image, embedded by the ffmpeg backend.
 
         Returns:
             str: The path to the converted MP3 file.
@@ -176,109 +577,275 @@ class YouTubeDownloader:
             # Get the downloaded audio file path
             audio_path = os.path.join(save_path, filename)
 
-            # Define the output MP3 file path
-            mp3_path = os.path.splitext(audio_path)[0] + ".mp3"
+            self.progress.status(f"Starting conversion for: {yt.title}", "purple")
 
-            self.main_app.finish_label.configure(text=f"Starting conversion for: {yt.title}",
-                                                 text_color="purple")
+            with self.scheduler.encoder(), self.tracer.span("convert") as span:
+                mp3_path = convert_audio_to_mp3(audio_path, logger,
+                                                audio_tags(yt.title, yt.author, yt.publish_date), image_data)
+                span.bytes = os.path.getsize(mp3_path)
+            return mp3_path
 
-            # Convert the audio to MP3 using moviepy
-            audio_clip = AudioFileClip(audio_path)
-            audio_clip.write_audiofile(mp3_path, codec='mp3', logger=logger)
+    def tag_files(self, entries, batch_size=settings.TAG_BATCH_SIZE):
+        """
+        Tags existing MP3 files on the conversion process pool, `batch_size` files per worker call.
+        Tags are written in place whenever the files' current tags have room for them.
 
-            # Close the audio clip to release resources
-            audio_clip.close()
+        Args:
+            entries (list): (path, album, artist, year, image_data) tuples.
+            batch_size (int): The number of files each worker call tags.
+
+        Returns:
+            list: The (path, error message) pairs of the files that could not be tagged.
+        """
+        batches = [entries[start:start + batch_size] for start in range(0, len(entries), max(1, batch_size))]
+        failures = []
+        with self.tracer.span("tag", files=len(entries)), \
+                ProcessPoolExecutor(max_workers=self.pipeline.cpu_workers) as processes:
+            for batch_failures in processes.map(tag_mp3_files, batches):
+                failures += batch_failures
+        return failures
+
+    def retag_directory(self, directory):
+        """
+        Writes the tags and cover of the MP3s of a directory again from the metadata of their videos,
+        e.g. after another tool changed them. The download archive tells which video each MP3 comes
+        from, so only the MP3s it recorded are tagged. They are tagged in batches, see `tag_files`.
 
-            # Remove the original WebM audio file if it exists
-            if os.path.exists(audio_path):
+        Args:
+            directory (str): The directory holding the MP3s.
+
+        Returns:
+            list: The (path, error message) pairs of the files that could not be tagged.
+        """
+        if self.archive is None:
+            print("The download archive is disabled, the videos the MP3s come from are unknown")
+            return []
+        entries = self.archive.entries_in(directory, "mp3")
+        self.progress.status(f"Retagging {len(entries)} MP3 file(s) in {directory}", "purple")
+        concurrency = AdaptiveConcurrency("retag")
+
+        def load_tags(entry):
+            video_id, path = entry
+            with concurrency.slot():
+                yt = self.metadata_cache.get_youtube(f"https://www.youtube.com/watch?v={video_id}")
+                image_data = self.download_image(yt.thumbnail_url, yt.title, video_id)
+            year = yt.publish_date.strftime("%Y") if yt.publish_date else None
+            return path, yt.title, yt.author, year, image_data
+
+        tagged, failures = [], []
+        with ThreadPoolExecutor(max_workers=concurrency.max_workers) as threads:
+            futures = {threads.submit(load_tags, entry): entry for entry in entries}
+            for future, (_, path) in futures.items():
                 try:
-                    os.remove(audio_path)
-                except FileExistsError:
-                    print("Got a problem while excluding a file. It is being used by another process, but this is "
-                          "just a warning, as the file was removed.")
-            else:
-                print(f"Original audio file does not exist at {audio_path}")
-            return mp3_path
+                    tagged.append(future.result())
+                except Exception as e:
+                    failures.append((path, f"Could not load its metadata: {e}"))
+        return failures + self.tag_files(tagged)
 
-    def try_update_metadata(self, yt, mp3_path, image_data):
+    def download_playlist_in_background(self, job, videos=None, run_id=None):
         """
-        Updates the metadata of an MP3 file with information from a YouTube video.
+        Downloads all the videos in the playlist in the background, through a staged pipeline:
+        downloads run on a wide thread pool and feed conversions running on a process pool.
+        Without `videos`, the playlist is enumerated page by page while the first items already download.
 
-        Parameters:
-            yt (YouTube object): The YouTube video object.
-            mp3_path (str): The path to the MP3 file.
-            image_data (bytes): The binary data of the album cover image.
+        Args:
+            job (JobSpec): The playlist to download.
+            videos (list, optional): The playlist records, fetched from `job.url` if not given.
+            run_id (int, optional): The job queue run to carry on with, already claimed. By default, an
+                interrupted run of the same job nobody works on, or a new one.
 
         Returns:
-            None
+            list: The (video URL, error) pairs of the items that failed.
         """
 
-        # Embed album cover into the MP3 file
-        if os.path.exists(mp3_path) and image_data:
-            self.main_app.finish_label.configure(text=f"Processing metadata for: {yt.title}",
-                                                 text_color="purple")
+        # An interrupted run of the same job carries on: its done items are skipped, its downloaded ones converted
+        if run_id is None and self.job_queue is not None:
+            run_id = self.job_queue.open_run(job)
+        try:
+            return self.download_playlist_run(job, videos, run_id)
+        finally:
+            if run_id is not None:
+                # Resumable again if it failed before finishing, a no-op once finished
+                self.job_queue.release(run_id)
 
-            set_mp3_metadata_eyed3(mp3_path, yt.title, yt.author, yt.publish_date, "", image_data)
+    def download_playlist_run(self, job, videos, run_id):
+        """
+        Runs `download_playlist_in_background` for a claimed job queue run, see there.
 
-            self.main_app.finish_label.configure(text=f"All done: {yt.title}",
-                                                 text_color="purple")
+        Args:
+            job (JobSpec): The playlist to download.
+            videos (list): The playlist records, or None to fetch them from `job.url`.
+            run_id (int): The job queue run, None without a job queue.
 
-    def download_playlist_in_background(self):
+        Returns:
+            list: The (video URL, error) pairs of the items that failed.
         """
-        Downloads all the videos in the playlist concurrently in the background.
-        Max_workers is set to 75% of CPU cores available.
+        # Downloaded items of the run waiting for their conversion, by URL
+        resumable = {}
+
+        sync = None
+        if job.sync:
+            sync = self.playlist_sync.sync(job.url, report_removed=job.report_removed, videos=videos)
+            pages = [sync.videos]
+            self.report_sync(sync)
+        elif videos is None and run_id is not None and self.job_queue.is_enumerated(run_id):
+            # Resumed from the queue, without enumerating the playlist again
+            pages = [self.job_queue.queued_videos(run_id)]
+        elif videos is None:
+            pages = iter_playlist_pages(Playlist(job.url))
+        else:
+            pages = [videos]
+
+        start_time = time.time()
+        state = {"done": 0, "total": 0, "enumerated": False}
+        state_lock = threading.Lock()
+
+        def video_urls():
+            # Only read by the pipeline as it has room for more items
+            for page in pages:
+                if self.archive is not None:
+                    # Checked against the archive and the disk only, archived items cost no request at all
+                    archived = self.archive.archived((video.video_id for video in page), job.archive_format)
+                    if archived:
+                        self.progress.status(f"Skipping {len(archived)} video(s) already downloaded", "purple")
+                        page = [video for video in page if video.video_id not in archived]
+                if run_id is not None:
+                    states = self.job_queue.enqueue(run_id, page)
+                    done = [video for video in page if states[video.watch_url][0] == DONE]
+                    if done:
+                        self.progress.status(f"Skipping {len(done)} video(s) done before the run was interrupted",
+                                             "purple")
+                        page = [video for video in page if states[video.watch_url][0] != DONE]
+                    resumable.update((video_url, data) for video_url, (item_state, data) in states.items()
+                                     if item_state == CONVERTING and data)
+                with state_lock:
+                    state["total"] += len(page)
+                for video in page:
+                    yield video.watch_url
+            if run_id is not None:
+                self.job_queue.set_enumerated(run_id)
+            state["enumerated"] = True
+        # Items in the conversion stage, archived once converted
+        pending = {}
+
+        def on_done(video_url, mp3_path, error):
+            if error is None and video_url in pending:
+                video_id, itag = pending.pop(video_url)
+                self.archive_item(video_id, job, itag, mp3_path)
+            if run_id is not None:
+                self.job_queue.set_state(run_id, video_url, DONE if error is None else FAILED,
+                                         error=None if error is None else str(error))
+            with state_lock:
+                state["done"] += 1
+                done, total = state["done"], state["total"]
+            elapsed_time = time.time() - start_time
+            # The total grows while the playlist is still being enumerated
+            self.progress.status(f"Downloaded video {done}/{total}{'' if state['enumerated'] else '+'} - "
+                                 f"Elapsed time: {elapsed_time:.2f}s", "purple")
+
+        def download_item(video_url):
+            with self.tracer.job(video_url), self.tracer.span("item"):
+                if video_url in resumable:
+                    conversion = self.resume_conversion(video_url, job, resumable.pop(video_url), pending)
+                    if conversion is not False:
+                        return conversion
+                if run_id is not None:
+                    self.job_queue.set_state(run_id, video_url, DOWNLOADING)
+                return self.download_playlist_item(video_url, job, pending, run_id)
+
+        failures = self.pipeline.run(video_urls(), download_item, convert_and_tag, on_done, current_priority())
+
+        if sync is not None:
+            self.playlist_sync.commit(sync, (extract.video_id(video_url) for video_url, _ in failures))
+        if run_id is not None:
+            self.job_queue.finish_run(run_id)
+
+        elapsed_time = time.time() - start_time
+        total = state["total"]
+        self.progress.status(f"All videos downloaded {total - len(failures)}/{total} - "
+                             f"Elapsed time: {elapsed_time:.2f}s",
+                             "green" if not failures else "orange")
+        return failures
+
+    def resume_interrupted(self):
+        """
+        Runs again, in the calling thread, the playlist jobs an earlier session left unfinished,
+        e.g. because the app was closed or crashed in the middle of them.
+
+        Returns:
+            list: The (job, failures) pairs of the resumed jobs, see `download_playlist_in_background`.
+        """
+        if self.job_queue is None:
+            return []
+        results = []
+        for run_id, job in self.job_queue.interrupted():
+            if not self.job_queue.claim(run_id):
+                # Started again by hand or by another process meanwhile
+                continue
+            counts = self.job_queue.counts(run_id)
+            left = sum(counts.get(state, 0) for state in UNFINISHED)
+            self.progress.status(f"Resuming the interrupted download of {job.url}: {counts.get(DONE, 0)} item(s) "
+                                 f"done, {left} left", "purple")
+            try:
+                results.append((job, self.download_playlist_in_background(job, run_id=run_id)))
+            except Exception as e:
+                # e.g. the playlist is gone, the run is tried again next session, up to JOB_QUEUE_MAX_RESUMES times
+                self.progress.status(f"Could not resume {job.url}: {e}", "red")
+                results.append((job, [(job.url, e)]))
+        return results
+
+    def report_sync(self, sync):
+        """
+        Reports what changed in a playlist since its last sync.
 
         Args:
-            self (YouTubeDownloader): The instance of the class.
+            sync (SyncResult): The result of the sync.
 
         Returns:
             None
         """
-
-        # Loop through the videos in the playlist and download each one concurrently
-        save_path = self.main_app.save_path_var.get()
-        with ThreadPoolExecutor(max_workers=int(os.cpu_count() * 0.75)) as executor:  # Adjust max_workers as needed
-            futures = []
-            start_time = time.time()
-            for video in self.playlist_urls:
-                futures.append(executor.submit(self.download_audio_and_convert_to_mp3, video, save_path))
-
-            i = 0
-            for future in concurrent.futures.as_completed(futures):
-                future.result()
-                i += 1
-                end_time = time.time()
-                elapsed_time = end_time - start_time
-                self.main_app.finish_label.configure(
-                    text=f"Downloaded video {i}/{len(self.playlist_urls)} - Elapsed time: {elapsed_time:.2f}s",
-                    text_color="purple")
-            # Wait for all threads to complete
-            concurrent.futures.wait(futures)
-
-        self.main_app.finish_label.configure(
-            text=f"All videos downloaded {i}/{len(self.playlist_urls)} - Elapsed time: {elapsed_time:.2f}s",
-            text_color="green")
-
-    def download_audio(self, title, save_path):
+        if not sync.complete:
+            self.progress.status(f"Synced {sync.title or sync.playlist_id}: {len(sync.videos)} video(s) to download, "
+                                 f"stopped at the first known video", "purple")
+            return
+        self.progress.status(f"Synced {sync.title or sync.playlist_id}: {len(sync.videos)} video(s) to download, "
+                             f"{len(sync.removed)} removed", "purple")
+        for video_id, title in sync.removed:
+            self.progress.status(f"Removed from the playlist: {title or video_id}", "orange")
+
+    def download_audio(self, title, save_path, yt, as_mp3=False, policy=settings.AUDIO_POLICY):
         """
         Downloads the audio track for a given title and saves it to the specified path.
 
         Args:
             title (str): The title of the audio track.
             save_path (str): The path where the audio track will be saved.
+            yt (YouTube): The video the audio track belongs to.
+            as_mp3 (bool): Encode the track to MP3 while it downloads, if `settings.STREAM_CONVERSION` allows.
+            policy (str): The selection policy picking the audio stream.
 
         Returns:
-            str: The path to the downloaded audio file.
+            str: The path to the downloaded audio file, which is the MP3 if it was encoded while downloading.
         """
-        audio_stream = self.main_app.streams.filter(only_audio=True).order_by('abr').desc().first()
+        audio_stream = stream_index(yt).select_audio(policy)
+        refresh = self.stream_refresher(yt.watch_url, audio_stream.itag)
+        self.progress.status("Downloading audio track..", "blue")
+
+        if as_mp3 and settings.STREAM_CONVERSION:
+            image_data = self.download_image(yt.thumbnail_url, title, yt.video_id)
+            mp3_path = self.stream_to_mp3(audio_stream, os.path.join(save_path, f"{title}-audio.mp3"), refresh,
+                                          audio_tags(yt.title, yt.author, yt.publish_date), image_data)
+            if mp3_path is not None:
+                self.progress.status("Downloaded and converted audio track.", "green")
+                return mp3_path
+
         audio_extension = audio_stream.mime_type.split("/")[-1]
         audio_filename = f"{title}-audio.{audio_extension}"
-        self.main_app.finish_label.configure(text="Downloading audio track..", text_color="blue")
-        audio_stream.download(output_path=save_path, filename=audio_filename)
-        self.main_app.finish_label.configure(text="Downloaded audio track.", text_color="green")
+        self.stream_downloader.download(audio_stream, save_path, audio_filename, refresh=refresh)
+        self.progress.status("Downloaded audio track.", "green")
         return os.path.join(save_path, audio_filename)
 
-    def download_video(self, title, save_path, video_stream):
+    def download_video(self, title, save_path, video_stream, yt):
         """
         Downloads a video track.
 
@@ -286,22 +853,24 @@ class YouTubeDownloader:
             title (str): The title of the video.
             save_path (str): The path where the video will be saved.
             video_stream: The video stream to download.
+            yt (YouTube): The video the stream belongs to.
 
         Returns:
             str: The path of the downloaded video.
         """
 
-        self.main_app.finish_label.configure(text="Downloading video track.", text_color="yellow")
+        self.progress.status("Downloading video track.", "yellow")
 
         video_extension = video_stream.mime_type.split("/")[-1]
         video_filename = f"{title}.{video_extension}"
-        video_stream.download(output_path=save_path, filename=video_filename)
+        self.stream_downloader.download(video_stream, save_path, video_filename,
+                                        refresh=self.stream_refresher(yt.watch_url, video_stream.itag))
         video_path = os.path.join(save_path, video_filename)
 
-        self.main_app.finish_label.configure(text="Downloaded successfully", text_color="green")
+        self.progress.status("Downloaded successfully", "green")
         return video_path
 
-    def merge_audio_and_video(self, title, save_path, video_path, audio_path, thumbnail, yt):
+    def merge_audio_and_video(self, title, save_path, video_path, audio_path, thumbnail, yt, output_format):
         """
         Merges audio and video files to create a final video with audio track.
 
@@ -312,96 +881,115 @@ class YouTubeDownloader:
             audio_path (str): The path to the audio file.
             thumbnail (str): The path to the thumbnail image.
             yt (YouTube): A instance of the downloaded video.
+            output_format (str): The output format in lower case, e.g. "mp3" or "no conversion".
 
         Returns:
             None
         """
 
-        if self.main_app.selected_format.get().lower() == "mp3":
-            image_data = self.download_image(thumbnail, audio_path.split('\\')[-1])
-            mp3_path = self.convert_mp3(True, save_path, audio_path.split('\\')[-1], yt, self.logger)
-            self.try_update_metadata(yt, mp3_path, image_data)
+        if output_format == "mp3":
+            image_data = self.download_image(thumbnail, os.path.basename(audio_path), yt.video_id)
+            if not audio_path.endswith(".mp3"):
+                # Tagged while it is encoded, like the MP3s encoded while downloading
+                self.convert_mp3(True, save_path, os.path.basename(audio_path), yt, self.logger, image_data)
             if audio_path != video_path and video_path != "":
                 os.remove(video_path)
-        elif (self.main_app.selected_format.get().lower() in ["mp4", "avi", "mkv"]
+        elif output_format in ("m4a", "opus"):
+            image_data = self.download_image(thumbnail, title, yt.video_id)
+            output_audio_path = os.path.join(save_path, f"{title}.{output_format}")
+            self.progress.status(f"Saving the audio track as {output_format.upper()}..", "purple")
+            try:
+                # Copies the audio track as it is when its codec fits the container
+                with self.scheduler.encoder(), self.tracer.span("merge"):
+                    mode = transcode_audio(audio_path, output_audio_path, output_format,
+                                           audio_tags(yt.title, yt.author, yt.publish_date), image_data)
+                os.remove(audio_path)
+                if audio_path != video_path and video_path != "":
+                    os.remove(video_path)
+                self.progress.status(f"Download complete. Audio track {'copied' if mode == 'copy' else 'encoded'} "
+                                     f"to {output_audio_path}.", "green")
+            except IOError as e:
+                self.progress.status(f"Error while saving the audio track: {str(e)}", "red")
+        elif (output_format in ["mp4", "avi", "mkv"]
               and audio_path != video_path and video_path != ""):
-            self.main_app.finish_label.configure(text="Creating objects..", text_color="purple")
-            video_clip = VideoFileClip(video_path)
-            audio_clip = AudioFileClip(audio_path)
-
-            self.main_app.finish_label.configure(text="Merging audio track..", text_color="purple")
-            final_clip = video_clip.set_audio(audio_clip)
-
-            self.main_app.finish_label.configure(text="Processing video..", text_color="purple")
+            self.progress.status("Merging audio track..", "purple")
             output_video_path = os.path.join(save_path,
-                                             f"{title}-converted.{self.main_app.selected_format.get().lower()}")
+                                             f"{title}-converted.{output_format}")
 
             try:
-                final_clip.write_videofile(output_video_path, codec='libx264', logger=self.logger)
+                # Copies the tracks as they are when the container allows it, re-encoding only what does not fit
+                with self.scheduler.encoder(), self.tracer.span("merge"):
+                    mode = remux_audio_and_video(video_path, audio_path, output_video_path)
                 os.remove(video_path)
                 os.remove(audio_path)
 
-                self.main_app.finish_label.configure(text="Download complete. Converted audio and video tracks.",
-                                                     text_color="green")
+                self.progress.status(f"Download complete. Merged audio and video tracks ({mode}).",
+                                     "green")
             except IOError as e:
                 error_message = f"Error during video and audio merging: {str(e)}"
-                self.main_app.finish_label.configure(text=error_message, text_color="red")
-        elif self.main_app.selected_format.get().lower() != "no conversion":
-            self.main_app.finish_label.configure(text="To convert to any format besides MP3 you need to enable both "
-                                                      "outputs.", text_color="red")
+                self.progress.status(error_message, "red")
+        elif output_format != "no conversion":
+            self.progress.status("To convert to any format besides MP3 you need to enable both outputs.", "red")
             if audio_path != video_path and video_path != "":
                 os.remove(video_path)
             if audio_path != "":
                 os.remove(audio_path)
 
-    def download_in_background(self):
+    def download_in_background(self, job):
         """
         Downloads a video or audio file in the background.
 
         Parameters:
-            self (YouTubeDownloader): The instance of the class.
+            job (JobSpec): The video to download.
 
         Returns:
             None
         """
 
-        is_audio_only = self.main_app.audio_var.get()
-        is_video_only = self.main_app.video_var.get()
-        save_path = self.main_app.save_path_var.get()
-        selected_quality = self.main_app.quality_var.get()
+        is_audio_only = job.audio
+        is_video_only = job.video
+        save_path = job.output_dir
+        with self.tracer.span("metadata"):
+            yt = self.metadata_cache.get_youtube(job.url)
+        yt.register_on_progress_callback(self.on_stream_progress)
+        index = stream_index(yt)
+        # An explicit quality narrows the policy down to that resolution
+        policy = f"{job.video_policy} {job.quality}" if job.quality else job.video_policy
         video_path = ''
-        self.audio_path = ''
-
-        title = (f"{self.main_app.yt.title.replace(' ', '_').replace(':', '-').replace('|', '-')}"
-                 f"-{selected_quality.split(' - ')[0]}")
-        thumbnail = self.main_app.yt.thumbnail_url
+        audio_path = ''
 
         if is_audio_only:
-            video_stream = self.main_app.streams.filter(res=selected_quality.split(" - ")[0]).first()
-
-            if not video_stream.is_progressive:
-                self.audio_path = self.download_audio(title, save_path)
-            elif not is_video_only:
-                self.audio_path = self.download_audio(title, save_path)
-            elif is_video_only and not video_stream.is_progressive:
-                self.audio_path = self.download_audio(title, save_path)
+            video_stream = index.select_video(policy)
+            # A progressive stream of the same resolution brings the audio along
+            video_stream = (index.at_resolution(video_stream.resolution, progressive=True) or [video_stream])[0]
         else:
-            video_stream = self.main_app.streams.filter(res=selected_quality.split(" - ")[0],
-                                                        file_extension="webm").first()
+            video_stream = index.select_video(policy, progressive=False)
+        selected_quality = video_stream.resolution
+
+        title = (f"{yt.title.replace(' ', '_').replace(':', '-').replace('|', '-')}"
+                 f"-{selected_quality}")
+        thumbnail = yt.thumbnail_url
+
+        if is_audio_only and (not video_stream.is_progressive or not is_video_only):
+            audio_path = self.download_audio(title, save_path, yt, as_mp3=job.format == "mp3",
+                                             policy=job.audio_policy)
 
         if is_video_only:
-            video_path = self.download_video(title, save_path, video_stream)
+            video_path = self.download_video(title, save_path, video_stream, yt)
 
-        if self.audio_path == "":
-            self.audio_path = video_path
-        self.merge_audio_and_video(title, save_path, video_path, self.audio_path, thumbnail, self.main_app.yt)
+        if audio_path == "":
+            audio_path = video_path
+        self.merge_audio_and_video(title, save_path, video_path, audio_path, thumbnail, yt, job.format)
 
-    def fetch_qualities(self):
+    def fetch_qualities(self, url):
         """
         Fetches the qualities of a video based on the provided URL.
 
+        Args:
+            url (str): The URL of the YouTube video.
+
         Returns:
-            - A list of qualities of the video.
+            - A tuple with the YouTube object and a list of qualities of the video.
               Each quality is represented as a string in the format:
               "{resolution} - {download_speed} - {fps}".
               - {resolution}: The resolution of the video stream.
@@ -414,51 +1002,37 @@ class YouTubeDownloader:
             Exception
         """
 
-        # Get the URL from the entry field
-        url = self.main_app.url_var.get()
-
-        qualities = {}
-
         # Fetch the video details
         try:
-            self.main_app.yt = YouTube(url)
-            self.main_app.yt.register_on_progress_callback(self.main_app.progress_callback)
-            self.main_app.streams = self.main_app.yt.streams
-            for stream in self.main_app.streams:
-                if stream.resolution is not None:
-                    resolution = stream.resolution
-                    fast = "Fast download" if stream.is_progressive else "Slow download"
-                    fps = f" - {stream.fps} fps" if stream.fps is not None else ""
-                    stream_value = resolution + f" - {fast}" + fps
-                    if resolution not in qualities or "Fast download" not in qualities[resolution]:
-                        qualities[resolution] = stream_value
-
-            # Convert the dictionary values to a list
-            qualities_list = list(qualities.values())
-
-            return qualities_list
+            yt = self.metadata_cache.get_youtube(url)
+            qualities_list = []
+            for resolution, progressive, fps in stream_index(yt).resolutions():
+                fast = "Fast download" if progressive else "Slow download"
+                fps = f" - {fps} fps" if fps is not None else ""
+                qualities_list.append(resolution + f" - {fast}" + fps)
+
+            return yt, qualities_list
         except Exception as e:
             # Handle exceptions, e.g., invalid URL or unavailable video
             print(f"Error fetching qualities: {e}")
             return None
 
-    def fetch_playlist(self):
+    def fetch_playlist(self, url):
         """
-        Fetches a playlist from a given URL.
+        Fetches the first page of a playlist from a given URL, the following pages are fetched as they are read.
+        Titles, durations and thumbnails come from the playlist pages themselves, no video is opened.
 
-        :return: A tuple containing the video URLs and the title of the playlist.
+        :param url: The URL of the playlist.
+        :return: A tuple containing the video records of the first page, an iterator over the records
+                 of the following pages and the title of the playlist.
                  Returns None if there is an error fetching the playlist.
         """
 
-        # Get the URL from the entry field
-        url = self.main_app.url_var.get()
-
         # Fetch the video details
         try:
-            # Create a Playlist object
             playlist = Playlist(url)
-            self.playlist_urls = playlist.video_urls
-            return playlist.video_urls, playlist.title
+            pages = iter_playlist_pages(playlist)
+            return next(pages, []), pages, playlist.title
         except Exception as e:
             # Handle exceptions, e.g., invalid URL or unavailable video
             print(f"Error fetching playlists: {e}")
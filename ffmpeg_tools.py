@@ -0,0 +1,369 @@
+import os
+import re
+import subprocess
+import tempfile
+import threading
+
+import settings
+
+# Codecs each target container can hold without re-encoding
+CONTAINER_CODECS = {
+    "mp4": {
+        "video": {"h264", "hevc", "av1", "vp9", "mpeg4"},
+        "audio": {"aac", "mp3", "alac", "ac3"},
+    },
+    "mkv": {
+        "video": {"h264", "hevc", "av1", "vp8", "vp9", "mpeg4", "theora"},
+        "audio": {"aac", "mp3", "opus", "vorbis", "flac", "ac3", "alac"},
+    },
+    "avi": {
+        "video": {"h264", "mpeg4", "mjpeg"},
+        "audio": {"mp3", "aac", "ac3"},
+    },
+}
+
+# Encoders used for the tracks that do not fit the target container
+FALLBACK_ENCODERS = {
+    "mp4": {"video": "libx264", "audio": "aac"},
+    "mkv": {"video": "libx264", "audio": "aac"},
+    "avi": {"video": "libx264", "audio": "libmp3lame"},
+}
+
+# ffmpeg muxers of the containers not named after their extension
+CONTAINER_MUXERS = {"mkv": "matroska"}
+
+# Audio outputs: the encoder used when the source cannot be copied, the source codecs that can,
+# the ffmpeg muxer, and whether the container holds a cover image
+AUDIO_FORMATS = {
+    "mp3": {"encoder": "libmp3lame", "copy": {"mp3"}, "muxer": "mp3", "cover": True},
+    "m4a": {"encoder": "aac", "copy": {"aac", "alac"}, "muxer": "ipod", "cover": True},
+    "opus": {"encoder": "libopus", "copy": {"opus"}, "muxer": "opus", "cover": False},
+}
+
+_STREAM_PATTERN = re.compile(r"Stream #\d+:\d+.*?: (Video|Audio): (\w+)")
+
+
+class FFmpegError(IOError):
+    pass
+
+
+def get_ffmpeg_exe():
+    """
+    Returns the path of the ffmpeg binary bundled with imageio-ffmpeg.
+
+    Returns:
+        str: The ffmpeg executable path.
+    """
+    # Imported on first use: imageio-ffmpeg loads pkg_resources, which takes longer than the rest of the startup
+    import imageio_ffmpeg
+
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def run_ffmpeg(args):
+    """
+    Runs ffmpeg with the given arguments.
+
+    Args:
+        args (list): The command line arguments, without the executable.
+
+    Returns:
+        str: The stderr output of ffmpeg.
+
+    Raises:
+        FFmpegError: If ffmpeg exits with an error.
+    """
+    process = subprocess.run([get_ffmpeg_exe(), "-hide_banner", "-nostdin"] + args,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = process.stderr.decode("utf-8", errors="replace")
+    if process.returncode != 0:
+        raise FFmpegError(f"ffmpeg exited with code {process.returncode}: {stderr.strip().splitlines()[-1:]}")
+    return stderr
+
+
+class FFmpegPipe:
+    """
+    An ffmpeg process reading its input from stdin, to encode data while it is still arriving.
+
+    stderr is drained by a thread so ffmpeg never blocks on it; its tail ends up in the error message.
+    """
+
+    def __init__(self, output_args, input_args=None):
+        """
+        Starts ffmpeg.
+
+        Args:
+            output_args (list): The arguments following the input, ending with the output path.
+            input_args (list, optional): Options describing the input, e.g. the format of raw samples.
+        """
+        self.process = subprocess.Popen([get_ffmpeg_exe(), "-hide_banner"] + (input_args or []) + ["-i", "pipe:0"]
+                                        + output_args,
+                                        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self._stderr = []
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self._stderr.append(line.decode("utf-8", errors="replace"))
+
+    def write(self, data):
+        """
+        Feeds input data to ffmpeg.
+
+        Args:
+            data (bytes): The data.
+
+        Returns:
+            None
+
+        Raises:
+            FFmpegError: If ffmpeg exited, e.g. because it cannot read the input.
+        """
+        try:
+            self.process.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            self.close()
+            raise FFmpegError("ffmpeg stopped reading its input")
+
+    def close(self):
+        """
+        Ends the input and waits for ffmpeg to finish the output.
+
+        Returns:
+            None
+
+        Raises:
+            FFmpegError: If ffmpeg exits with an error.
+        """
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.wait()
+        self._stderr_thread.join()
+        if self.process.returncode != 0:
+            raise FFmpegError(f"ffmpeg exited with code {self.process.returncode}: "
+                              f"{''.join(self._stderr).strip().splitlines()[-1:]}")
+
+    def abort(self):
+        """
+        Stops ffmpeg without waiting for the output, e.g. when the download failed.
+
+        Returns:
+            None
+        """
+        self.process.kill()
+        self.process.wait()
+        self._stderr_thread.join()
+
+
+def encode_chunks(chunks, output_path, output_args, input_args=None):
+    """
+    Encodes data coming in chunks (e.g. a download in progress) with ffmpeg, without an input file.
+    The output is written next to `output_path` and only moved there once ffmpeg succeeded.
+
+    Args:
+        chunks (iterable): The input data, in order.
+        output_path (str): The path of the encoded file.
+        output_args (list): The encoding arguments, which must name the output format with -f
+            since the temporary file has no meaningful extension.
+        input_args (list, optional): Options describing the input, e.g. the format of raw samples.
+
+    Returns:
+        str: The output path.
+
+    Raises:
+        FFmpegError: If ffmpeg fails. Errors raised by `chunks` propagate as they are.
+    """
+    tmp_path = output_path + ".part"
+    # e.g. the folder of a playlist, created by nothing else before its first item is encoded
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    encoder = FFmpegPipe(["-y"] + output_args + [tmp_path], input_args)
+    try:
+        for chunk in chunks:
+            encoder.write(chunk)
+        encoder.close()
+    except BaseException:
+        encoder.abort()
+        if hasattr(chunks, "close"):
+            # Stops a generator's pending downloads right away
+            chunks.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def audio_output_args(output_format, source_codec=None, tags=None, cover_path=None):
+    """
+    Builds the ffmpeg arguments following an audio input: the cover input, the stream mapping, the
+    encoder (or a stream copy when the source codec fits the output), the tags and the muxer.
+
+    The encoder uses `settings.AUDIO_BITRATE`, or for MP3 the VBR quality `settings.MP3_VBR_QUALITY`
+    when it is set.
+
+    Args:
+        output_format (str): "mp3", "m4a" or "opus".
+        source_codec (str, optional): The codec of the input audio, if known.
+        tags (dict, optional): Tags such as "title", "album", "artist" or "date". Empty values are skipped.
+        cover_path (str, optional): A JPEG image embedded as cover art, when the container can hold one.
+
+    Returns:
+        list: The arguments, to be followed by the output path.
+    """
+    audio_format = AUDIO_FORMATS[output_format]
+    with_cover = cover_path is not None and audio_format["cover"]
+
+    args = ["-i", cover_path] if with_cover else []
+    args += ["-map", "0:a:0"]
+    if with_cover:
+        args += ["-map", "1:v:0", "-c:v", "copy", "-disposition:v:0", "attached_pic"]
+
+    if source_codec in audio_format["copy"]:
+        args += ["-c:a", "copy"]
+    elif output_format == "mp3" and settings.MP3_VBR_QUALITY >= 0:
+        args += ["-c:a", audio_format["encoder"], "-q:a", str(settings.MP3_VBR_QUALITY)]
+    else:
+        args += ["-c:a", audio_format["encoder"], "-b:a", settings.AUDIO_BITRATE]
+
+    if output_format == "mp3":
+        # ID3v2.3 is the version most players read
+        args += ["-id3v2_version", "3"]
+    for key, value in (tags or {}).items():
+        if value:
+            args += ["-metadata", f"{key}={value}"]
+    return args + ["-f", audio_format["muxer"]]
+
+
+class CoverFile:
+    """
+    Context manager holding cover art bytes in a temporary file for ffmpeg, None without cover.
+    """
+
+    def __init__(self, image_data):
+        self.image_data = image_data
+        self.path = None
+
+    def __enter__(self):
+        if self.image_data:
+            fd, self.path = tempfile.mkstemp(suffix=".jpg")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(self.image_data)
+        return self.path
+
+    def __exit__(self, *exc_info):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def transcode_audio(input_path, output_path, output_format=None, tags=None, cover=None):
+    """
+    Writes the audio of a media file in one ffmpeg invocation: decoding, encoding (or copying the
+    track when its codec fits the output), tags and cover art.
+
+    Args:
+        input_path (str): The downloaded file.
+        output_path (str): The audio file to write.
+        output_format (str, optional): "mp3", "m4a" or "opus". Defaults to the output extension.
+        tags (dict, optional): Tags such as "title", "album", "artist" or "date".
+        cover (bytes, optional): JPEG cover art.
+
+    Returns:
+        str: "copy" if the audio track was copied as is, "encode" otherwise.
+
+    Raises:
+        FFmpegError: If ffmpeg fails.
+    """
+    output_format = output_format or os.path.splitext(output_path)[1].lstrip(".").lower()
+    source_codec = probe_codecs(input_path)["audio"]
+    tmp_path = output_path + ".part"
+
+    with CoverFile(cover) as cover_path:
+        try:
+            run_ffmpeg(["-y", "-i", input_path] + audio_output_args(output_format, source_codec, tags, cover_path)
+                       + [tmp_path])
+        except FFmpegError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, output_path)
+    return "copy" if source_codec in AUDIO_FORMATS[output_format]["copy"] else "encode"
+
+
+def probe_codecs(path):
+    """
+    Reads the codecs of the first video and audio tracks of a media file.
+
+    Args:
+        path (str): The path of the media file.
+
+    Returns:
+        dict: A dictionary with "video" and "audio" keys, each holding a codec name or None.
+    """
+    # Without an output file ffmpeg exits with an error, but still prints the input streams
+    process = subprocess.run([get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-i", path],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = process.stderr.decode("utf-8", errors="replace")
+
+    codecs = {"video": None, "audio": None}
+    for kind, codec in _STREAM_PATTERN.findall(stderr):
+        kind = kind.lower()
+        # Cover art shows up as an extra video track after the real one
+        if codecs[kind] is None:
+            codecs[kind] = codec
+    return codecs
+
+
+def remux_audio_and_video(video_path, audio_path, output_path):
+    """
+    Muxes a video track and an audio track into one file.
+
+    Tracks whose codec fits the target container are stream-copied, only the others are re-encoded,
+    so the usual case is a pure copy that runs at disk speed. The merged file is written next to
+    `output_path` and only moved there once ffmpeg succeeded.
+
+    Args:
+        video_path (str): The path of the file holding the video track.
+        audio_path (str): The path of the file holding the audio track.
+        output_path (str): The path of the merged file. Its extension selects the container.
+
+    Returns:
+        str: The remux mode used: "stream copy", "partial re-encode" or "re-encode".
+
+    Raises:
+        FFmpegError: If ffmpeg fails.
+    """
+    container = os.path.splitext(output_path)[1].lstrip(".").lower()
+    supported = CONTAINER_CODECS.get(container, {"video": set(), "audio": set()})
+    encoders = FALLBACK_ENCODERS.get(container, FALLBACK_ENCODERS["mkv"])
+
+    video_codec = probe_codecs(video_path)["video"]
+    audio_codec = probe_codecs(audio_path)["audio"]
+
+    copy_video = video_codec in supported["video"]
+    copy_audio = audio_codec in supported["audio"]
+
+    args = ["-y", "-i", video_path, "-i", audio_path, "-map", "0:v:0", "-map", "1:a:0",
+            "-c:v", "copy" if copy_video else encoders["video"],
+            "-c:a", "copy" if copy_audio else encoders["audio"]]
+    if container == "mp4" and copy_video and video_codec == "hevc":
+        # Apple players only recognise HEVC in MP4 when tagged as hvc1
+        args += ["-tag:v", "hvc1"]
+
+    # A failed merge never leaves a truncated file under the final name
+    tmp_path = output_path + ".part"
+    try:
+        run_ffmpeg(args + ["-f", CONTAINER_MUXERS.get(container, container), tmp_path])
+    except FFmpegError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+
+    if copy_video and copy_audio:
+        return "stream copy"
+    if copy_video or copy_audio:
+        return "partial re-encode"
+    return "re-encode"
@@ -1,18 +1,18 @@
 import concurrent
 import os
-import re
 import sys
 import tkinter as tk
 import threading
 from concurrent.futures import ThreadPoolExecutor
-from io import BytesIO
 from tkinter import filedialog
-from PIL import Image
 import customtkinter
-import requests
-from pytube import YouTube
 
+import settings
+from concurrency import AdaptiveConcurrency
 from downloader import YouTubeDownloader
+from jobs import JobSpec, OUTPUT_FORMATS
+from progress_bus import format_snapshot
+from scheduler import BULK
 
 customtkinter.set_appearance_mode("System")
 customtkinter.set_default_color_theme("blue")
@@ -30,7 +30,7 @@ class YouTubeDownloaderApp:
 
         self.root.iconbitmap(icon_path)
 
-        self.downloader = YouTubeDownloader(self)
+        self.downloader = YouTubeDownloader()
 
         # Variables
         self.url_var = tk.StringVar()
@@ -39,6 +39,7 @@ class YouTubeDownloaderApp:
         self.video_var = tk.BooleanVar(value=True)
         self.max_min_quality = tk.BooleanVar(value=True)
         self.playlist_only_audio = tk.BooleanVar(value=True)
+        self.playlist_sync = tk.BooleanVar(value=False)
         self.convert_to_mp3 = tk.BooleanVar(value=False)
         self.format_label = None
         self.format_menu = None
@@ -55,6 +56,10 @@ class YouTubeDownloaderApp:
         self.video_name_label = None
         self.finish_label = None
         self.yt = None
+        self.playlist_videos = None
+        # Whether every page of the playlist was listed, and which playlist the pages being loaded belong to
+        self.playlist_complete = False
+        self.playlist_generation = 0
         self.quality_label = None
         self.save_path_button = None
         self.save_label = None
@@ -65,6 +70,12 @@ class YouTubeDownloaderApp:
 
         self.create_widgets_1()
 
+        # Playlists a previous session left unfinished carry on in the background
+        self.downloader.scheduler.submit(BULK, self.downloader.resume_interrupted, name="resume")
+
+        # Start rendering the progress published by the download workers
+        self.root.after(settings.PROGRESS_REFRESH_MS, self.drain_progress)
+
     def create_widgets_1(self):
         """
         Create and initialize widgets for the user interface.
@@ -140,6 +151,12 @@ class YouTubeDownloaderApp:
                                                         variable=self.convert_to_mp3)
         download_mp3_switch.grid(row=3, column=0, padx=10, pady=10, sticky="w")
 
+        # Create a switch (checkbutton) to only download what changed since the last sync
+        sync_switch = customtkinter.CTkCheckBox(self.video_info_frame,
+                                                text="Only New Videos",
+                                                variable=self.playlist_sync)
+        sync_switch.grid(row=4, column=0, padx=10, pady=10, sticky="w")
+
         # Label for save path
         self.save_label = customtkinter.CTkLabel(self.root, text="2. Save to:")
         self.save_label.pack(padx=10, pady=10)
@@ -152,7 +169,7 @@ class YouTubeDownloaderApp:
 
         # Button to start download
         self.playlist_download_button = customtkinter.CTkButton(self.root, text="Download",
-                                                                command=self.downloader.download_playlist)
+                                                                command=self.start_playlist_download)
         self.playlist_download_button.pack(padx=10, pady=10)
         self.playlist_download_button.configure(state=tk.DISABLED)  # Initially disabled
 
@@ -182,12 +199,9 @@ class YouTubeDownloaderApp:
 
         # Load and display the video thumbnail
         thumbnail_url = self.yt.thumbnail_url
-        # Fetch the image data using requests
-        response = requests.get(thumbnail_url)
-        if response.status_code == 200:
-            # Convert the image data to a Pillow Image object
-            img_data = Image.open(BytesIO(response.content))
-
+        # Fetched once per video, the cover art of the download reuses the same image
+        img_data = self.downloader.thumbnail_cache.get_gui_image(self.yt.video_id, thumbnail_url)
+        if img_data is not None:
             # Convert the Pillow Image to a PhotoImage
             thumbnail = customtkinter.CTkImage(light_image=img_data, size=(100, 100))
 
@@ -217,7 +231,7 @@ class YouTubeDownloaderApp:
         self.quality_menu.pack(padx=10, pady=10)
 
         # Create a list of format options
-        format_options = ["No conversion", "MP3", "AVI", "MKV", "MP4"]  # You can add more formats as needed
+        format_options = OUTPUT_FORMATS
 
         # Create a StringVar to store the selected format
         self.selected_format = tk.StringVar()
@@ -259,7 +273,7 @@ class YouTubeDownloaderApp:
 
         # Button to start download
         self.download_button = customtkinter.CTkButton(self.root, text="Download",
-                                                       command=self.downloader.download)
+                                                       command=self.start_download)
         self.download_button.pack(padx=10, pady=10)
         self.download_button.configure(state=tk.DISABLED)  # Initially disabled
 
@@ -346,40 +360,134 @@ class YouTubeDownloaderApp:
         """
 
         self.root.after(0, self.start_spinner)
+        # Stops listing the pages of a previous playlist
+        self.playlist_generation += 1
 
         if "playlist" in self.url_var.get():
-            playlist_videos, title = self.downloader.fetch_playlist()
+            playlist = self.downloader.fetch_playlist(self.url_var.get())
 
-            if playlist_videos is not None:
+            if playlist is not None:
+                playlist_videos, pages, title = playlist
+                self.playlist_videos = list(playlist_videos)
+                self.playlist_complete = False
                 # Update UI in the main thread
                 self.root.after(0, lambda: self.create_playlist_layout(playlist_videos, title))
+                # The following pages are listed as they arrive
+                self.load_playlist_pages(pages, self.playlist_generation)
 
             else:
                 self.root.after(0, self.handle_error)
 
         else:
-            qualities = self.downloader.fetch_qualities()
+            video = self.downloader.fetch_qualities(self.url_var.get())
 
-            if qualities is not None:
+            if video is not None:
+                self.yt, qualities = video
                 self.root.after(0, lambda: self.create_video_layout(qualities))
 
             else:
                 self.root.after(0, self.handle_error)
 
-    def progress_callback(self, stream, _, bytes_remaining):
+    def load_playlist_pages(self, pages, generation):
         """
-        A callback function that updates the progress of a download.
+        Fetches the remaining pages of a playlist and adds each one to the list as soon as it arrives.
+        Runs in a background thread.
 
         Args:
-            stream: The stream object representing the download.
-            _: An optional argument that is not used in this function.
-            bytes_remaining: The number of bytes remaining to be downloaded.
+            pages (iterator): The video records of the remaining pages, one list per page.
+            generation (int): The playlist the pages belong to. Loading stops once another URL is opened.
 
         Returns:
             None
         """
-        percent_done = int((1 - bytes_remaining / stream.filesize) * 100)
-        self.finish_label.configure(text=f"Downloaded: {percent_done}%", text_color="yellow")
+        try:
+            for page in pages:
+                if generation != self.playlist_generation:
+                    return
+                self.root.after(0, lambda page=page: self.add_playlist_page(page, generation))
+        except Exception as e:
+            print(f"Error fetching the playlist pages: {e}")
+            return
+
+        def finish():
+            if generation == self.playlist_generation:
+                self.playlist_complete = True
+
+        self.root.after(0, finish)
+
+    def add_playlist_page(self, videos, generation):
+        """
+        Adds a page of playlist videos to the list. Runs in the main thread.
+
+        Args:
+            videos (list): The PlaylistVideo records of the page.
+            generation (int): The playlist the page belongs to.
+
+        Returns:
+            None
+        """
+        if generation != self.playlist_generation:
+            return
+        self.playlist_videos += videos
+        self.load_video_names(videos)
+
+    def job_spec(self):
+        """
+        Builds the job for the downloader from the current state of the widgets.
+
+        Returns:
+            JobSpec: The job to run.
+        """
+        return JobSpec(
+            url=self.url_var.get(),
+            output_dir=self.save_path_var.get(),
+            output_format=self.selected_format.get() if self.selected_format is not None else OUTPUT_FORMATS[0],
+            quality=self.quality_var.get().split(" - ")[0] or None,
+            audio=self.audio_var.get(),
+            video=self.video_var.get(),
+            only_audio=self.playlist_only_audio.get(),
+            convert_to_mp3=self.convert_to_mp3.get(),
+            sync=self.playlist_sync.get(),
+            # "Maximum Quality" follows the configured policies, otherwise the smallest streams are taken
+            video_policy=None if self.max_min_quality.get() else "smallest",
+            audio_policy=None if self.max_min_quality.get() else "smallest",
+        )
+
+    def start_download(self):
+        """
+        Starts downloading the video with the selected options.
+
+        Returns:
+            None
+        """
+        self.downloader.download(self.job_spec())
+
+    def start_playlist_download(self):
+        """
+        Starts downloading the playlist with the selected options, reusing the entries already listed
+        once the whole playlist is. Otherwise the downloader enumerates it again, downloading as it goes.
+
+        Returns:
+            None
+        """
+        self.downloader.download_playlist(self.job_spec(), self.playlist_videos if self.playlist_complete else None)
+
+    def drain_progress(self):
+        """
+        Shows the latest progress published by the download workers.
+
+        Workers never touch the widgets themselves: they publish to the downloader's progress bus,
+        and this method, running on the Tk thread, renders a coalesced snapshot of it at a fixed rate.
+
+        Returns:
+            None
+        """
+        snapshot = self.downloader.progress.snapshot()
+        if snapshot is not None and self.finish_label is not None and self.finish_label.winfo_exists():
+            _, color = snapshot["status"]
+            self.finish_label.configure(text=format_snapshot(snapshot), text_color=color or "yellow")
+
+        self.root.after(settings.PROGRESS_REFRESH_MS, self.drain_progress)
 
     def hide_widgets(self):
         """
@@ -504,84 +612,67 @@ class YouTubeDownloaderApp:
     def load_video_names(self, videos):
         """
         Loads the video names into the video_names_text widget.
-        It uses concurrency to load the video names in parallel to speed up the process.
-        Max_workers is set to 75% of CPU cores available.
+        Titles read from the playlist page are shown right away. Only the entries that came without one
+        are opened, concurrently, to load their title. How many are opened at once adapts to how fast
+        titles come back.
 
         Parameters:
-            videos (list): A list of video URLs.
+            videos (list): A list of PlaylistVideo records.
 
         Returns:
             None
         """
 
-        def load_title(video_url, index):
+        self.video_names_text.insert(tk.END, "".join(f"{video.index} - {video.title}\n"
+                                                     for video in videos if video.title is not None))
+
+        missing = [video for video in videos if video.title is None]
+        if not missing:
+            return
+
+        def load_title(video):
             """
-            Loads the title of a video from a given URL and inserts it into the video_names_text widget.
+            Loads the title of a video by opening it, as a fallback for entries the playlist page had no title for.
 
             Parameters:
-                video_url (str): The URL of the video.
-                index (int): The index of the video.
+                video (PlaylistVideo): The playlist entry.
 
             Returns:
                 str: The title of the video with the index appended.
             """
-            yt = YouTube(video_url)
-            title = f"{index} - {yt.title}\n"
-            self.video_names_text.insert(tk.END, title)
-            return title
+            video.youtube(self.downloader.metadata_cache)
+            return f"{video.index} - {video.title}\n"
 
         def background_task():
             """
-            Executes a background task using a thread pool executor to load video titles and sort them in a text box.
-
-            This function uses a thread pool executor to load video titles asynchronously.
-            It creates a number of threads based on the CPU count,
-            and then submits tasks to load titles for each video in the 'videos' list.
-            The 'load_title' function is called for each video, passing the video and an index as parameters.
-            The titles are loaded concurrently in separate threads.
-
-            After all threads have completed, the function retrieves the text from the 'video_names_text' textbox.
-            It splits the text into lines and removes any blank lines.
-            Then, it extracts numbers from each non-blank line using a regular expression.
-            The lines are sorted based on the parsed numbers,
-            and the sorted lines are joined back together to form the sorted text.
-
-            Finally, the function updates the 'video_names_text' textbox with the sorted text,
-            by deleting the existing content and inserting the sorted text at the end.
+            Executes a background task using a thread pool executor to load the missing video titles,
+            then rewrites the text box with every title in playlist order.
             """
-            with ThreadPoolExecutor(max_workers=int(os.cpu_count() * 0.75)) as executor:
-                futures = []
-                i = 0
-                for video in videos:
-                    futures.append(executor.submit(load_title, video, i))
-                    i += 1
-
-                # Wait for all threads to complete
-                concurrent.futures.wait(futures)
-
-                # Extract the text from self.video_names_text
-                text = self.video_names_text.get("1.0", tk.END)
+            concurrency = AdaptiveConcurrency("titles")
 
-                # Split the text into lines and remove blank lines
-                lines = [line for line in text.splitlines() if line.strip()]
+            def load_title_in_slot(video):
+                with concurrency.slot():
+                    return load_title(video)
 
-                # Parse and extract numbers from each non-blank line
-                def extract_number(line):
-                    match = re.search(r'(\d+)', line)
-                    if match:
-                        return int(match.group(1))
-                    return 0
+            with ThreadPoolExecutor(max_workers=concurrency.max_workers) as executor:
+                futures = [executor.submit(load_title_in_slot, video) for video in missing]
 
-                # Sort the lines based on the parsed numbers
-                sorted_lines = sorted(lines, key=extract_number)
+                # Wait for all threads to complete
+                concurrent.futures.wait(futures)
 
-                # Reconstruct the sorted text
-                sorted_text = '\n'.join(sorted_lines)
+            # Every page listed so far, some of them may still miss titles. A copy, since the Tk thread
+            # appends the pages still coming in
+            sorted_text = "".join(f"{video.index} - {video.title}\n"
+                                  for video in sorted(list(self.playlist_videos), key=lambda video: video.index)
+                                  if video.title is not None)
 
-                # Update the CTkTextbox with the sorted text
+            def show_titles():
                 self.video_names_text.delete("1.0", tk.END)
                 self.video_names_text.insert(tk.END, sorted_text)
 
+            # Tk widgets are only touched from the Tk thread
+            self.root.after(0, show_titles)
+
         # Create a thread to run the background task
         background_thread = threading.Thread(target=background_task)
         background_thread.start()
@@ -0,0 +1,185 @@
+import socket
+import threading
+import time
+from urllib.error import HTTPError, URLError
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import settings
+
+# Headers pytube sends with each of its requests
+PYTUBE_HEADERS = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+
+
+class _TimedConnection:
+    """
+    Mixin timing `connect()`, which covers the TCP handshake and, for HTTPS, the TLS handshake.
+    """
+
+    on_connect = None
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        self.on_connect(self.host, time.perf_counter() - started)
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    A pooling adapter that reports every request and every new connection to its transport.
+    """
+
+    def __init__(self, transport, **kwargs):
+        self.transport = transport
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        on_connect = staticmethod(self.transport._record_connection)
+        http_connection = type("TimedHTTPConnection", (_TimedConnection, HTTPConnection), {"on_connect": on_connect})
+        https_connection = type("TimedHTTPSConnection", (_TimedConnection, HTTPSConnection),
+                                {"on_connect": on_connect})
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("TimedHTTPConnectionPool", (HTTPConnectionPool,), {"ConnectionCls": http_connection}),
+            "https": type("TimedHTTPSConnectionPool", (HTTPSConnectionPool,), {"ConnectionCls": https_connection}),
+        }
+
+    def send(self, request, **kwargs):
+        self.transport._record_request()
+        return super().send(request, **kwargs)
+
+
+class PytubeResponse:
+    """
+    Wraps a streamed `requests` response in the small part of the `urlopen` response interface pytube uses.
+    """
+
+    def __init__(self, response):
+        self._response = response
+
+    def read(self, amt=None):
+        # Reading the body to its end hands the connection back to the pool
+        return self._response.raw.read(amt, decode_content=True)
+
+    def info(self):
+        return self._response.headers
+
+    def __del__(self):
+        # pytube drops some responses unread, their connection must still go back to the pool
+        self._response.close()
+
+
+class HttpTransport:
+    """
+    The keep-alive connection pool shared by the whole downloader: pytube's page, player and
+    stream requests, thumbnails and segmented stream downloads all go through `self.session`.
+
+    Each host gets at most `connections_per_host` connections, further requests wait for a free one.
+    `stats` counts the requests, the connections opened for them and the time spent in handshakes.
+    """
+
+    def __init__(self, connections_per_host=settings.HTTP_CONNECTIONS_PER_HOST, max_hosts=settings.HTTP_POOL_HOSTS):
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "connections": 0, "handshake_time": 0.0}
+
+        self.session = requests.Session()
+        adapter = CountingAdapter(self, pool_connections=max_hosts, pool_maxsize=connections_per_host,
+                                  pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _record_request(self):
+        with self._lock:
+            self._stats["requests"] += 1
+
+    def _record_connection(self, host, seconds):
+        with self._lock:
+            self._stats["connections"] += 1
+            self._stats["handshake_time"] += seconds
+
+    @property
+    def stats(self):
+        """
+        The transport counters.
+
+        Returns:
+            dict: The requests sent, the connections opened, the requests that reused a pooled
+                connection and the total handshake time in seconds.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["reused"] = max(0, stats["requests"] - stats["connections"])
+        return stats
+
+    def execute_pytube_request(self, url, method=None, headers=None, data=None, timeout=None):
+        """
+        Drop-in replacement of `pytube.request._execute_request` running on the shared pool.
+        HTTP errors and timeouts are raised as the `urllib` errors pytube expects.
+
+        Args:
+            url (str): The URL.
+            method (str, optional): The HTTP method, GET by default or POST when there is data.
+            headers (dict, optional): Extra headers.
+            data (dict or bytes, optional): The request body, dicts are sent as JSON.
+            timeout (float, optional): The socket timeout, `settings.REQUEST_TIMEOUT` by default.
+
+        Returns:
+            PytubeResponse: The response.
+        """
+        if not url.lower().startswith("http"):
+            raise ValueError("Invalid URL")
+        if timeout is None or timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = settings.REQUEST_TIMEOUT
+
+        request_headers = dict(PYTUBE_HEADERS)
+        request_headers.update(headers or {})
+        kwargs = {}
+        if data:
+            kwargs["data" if isinstance(data, bytes) else "json"] = data
+
+        try:
+            response = self.session.request(method or ("POST" if data else "GET"), url, headers=request_headers,
+                                            timeout=timeout, stream=True, **kwargs)
+        except requests.Timeout as e:
+            raise URLError(socket.timeout(str(e)))
+        except requests.RequestException as e:
+            raise URLError(e)
+
+        if response.status_code >= 400:
+            response.close()
+            raise HTTPError(url, response.status_code, response.reason, response.headers, None)
+        return PytubeResponse(response)
+
+    def patch_pytube(self):
+        """
+        Routes every request pytube makes through this transport.
+
+        Returns:
+            None
+        """
+        from pytube import request
+
+        request._execute_request = self.execute_pytube_request
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Returns the transport shared by the whole process, creating it on first use.
+    It also carries pytube's requests from then on.
+
+    Returns:
+        HttpTransport: The shared transport.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = HttpTransport()
+            _transport.patch_pytube()
+        return _transport
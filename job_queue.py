@@ -0,0 +1,313 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import settings
+from jobs import JobSpec
+from playlist_metadata import PlaylistVideo
+
+# States of a video job, in the order it goes through them. The tags are written while the MP3
+# is encoded, so tagging is part of the conversion
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+CONVERTING = "converting"
+DONE = "done"
+FAILED = "failed"
+
+# States a job was left in when its run was interrupted
+UNFINISHED = (QUEUED, DOWNLOADING, CONVERTING)
+
+# Seconds between two refreshes of the claims of a process on its runs. A claim not refreshed for
+# CLAIM_TIMEOUT seconds belongs to a process that is gone, and the run may be claimed again
+HEARTBEAT_INTERVAL = 30
+CLAIM_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+
+class JobQueue:
+    """
+    Durable record of the playlist runs and of the state of each of their videos, backed by SQLite.
+
+    Every state transition is committed as it happens, so when the app closes, crashes or the machine
+    reboots mid-run, the next start knows which videos were done and where the others stopped.
+    A video left converting keeps the path of its downloaded file and its tags, so the conversion
+    is run again without downloading it again. WAL mode keeps each transition to a short append,
+    and a transition lost on power failure only means redoing one stage.
+
+    Runs count how many times they were resumed. Past `settings.JOB_QUEUE_MAX_RESUMES`, they are
+    given up on, so a run failing every time is not resumed on every start.
+
+    A run is claimed by the queue working on it until it is finished or released, so two jobs (e.g.
+    the resume at startup and the same playlist started by hand, or two processes) never share a
+    run. Claims are kept alive by a heartbeat, so the claims of a process that crashed expire.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(settings.CACHE_DIR, "jobs.sqlite3")
+        self._lock = threading.Lock()
+        # Identifies the claims of this queue, whatever the process
+        self.owner = uuid.uuid4().hex
+        self._claimed = set()
+        self._heartbeat = None
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id INTEGER PRIMARY KEY,
+                    job TEXT NOT NULL,
+                    enumerated INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    heartbeat REAL,
+                    started_at REAL NOT NULL,
+                    finished_at REAL
+                )""")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS video_jobs (
+                    run_id INTEGER NOT NULL,
+                    video_url TEXT NOT NULL,
+                    video_id TEXT,
+                    title TEXT,
+                    position INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    data TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (run_id, video_url)
+                ) WITHOUT ROWID""")
+            # Columns added since the table was first created
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(runs)")}
+            if "attempts" not in columns:
+                self._connection.execute("ALTER TABLE runs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            if "owner" not in columns:
+                self._connection.execute("ALTER TABLE runs ADD COLUMN owner TEXT")
+                self._connection.execute("ALTER TABLE runs ADD COLUMN heartbeat REAL")
+
+    def open_run(self, job):
+        """
+        Claims the unfinished run of a job nobody else works on, to carry on with it, or starts a new one.
+        Carrying on with a run counts as one more attempt at it.
+
+        Args:
+            job (JobSpec): The playlist job.
+
+        Returns:
+            int: The run ID, claimed until `finish_run` or `release`.
+        """
+        spec = json.dumps(job.as_dict(), sort_keys=True)
+        now = time.time()
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                "SELECT run_id FROM runs WHERE job = ? AND finished_at IS NULL AND attempts < ? "
+                "AND (owner IS NULL OR heartbeat < ?) ORDER BY run_id DESC",
+                (spec, settings.JOB_QUEUE_MAX_RESUMES, now - CLAIM_TIMEOUT)).fetchall()
+            run_id = next((run_id for run_id, in rows if self._claim(run_id, now)), None)
+            if run_id is None:
+                run_id = self._connection.execute(
+                    "INSERT INTO runs (job, owner, heartbeat, started_at) VALUES (?, ?, ?, ?)",
+                    (spec, self.owner, now, now)).lastrowid
+            self._claimed.add(run_id)
+        self._start_heartbeat()
+        return run_id
+
+    def claim(self, run_id):
+        """
+        Claims an unfinished run, e.g. one listed by `interrupted`, counting one more attempt at it.
+
+        Args:
+            run_id (int): The run.
+
+        Returns:
+            bool: True if the run is now claimed by this queue, False if another job works on it
+                or it was finished meanwhile.
+        """
+        with self._lock, self._connection:
+            claimed = self._claim(run_id, time.time())
+            if claimed:
+                self._claimed.add(run_id)
+        if claimed:
+            self._start_heartbeat()
+        return claimed
+
+    def _claim(self, run_id, now):
+        # A single conditional update, so two processes racing for the same run cannot both get it
+        return self._connection.execute("""
+            UPDATE runs SET owner = ?, heartbeat = ?, attempts = attempts + 1
+            WHERE run_id = ? AND finished_at IS NULL AND (owner IS NULL OR heartbeat < ?)""",
+                                        (self.owner, now, run_id, now - CLAIM_TIMEOUT)).rowcount == 1
+
+    def release(self, run_id):
+        """
+        Gives up the claim on a run without finishing it, e.g. after it failed, so it may be resumed.
+
+        Args:
+            run_id (int): The run.
+
+        Returns:
+            None
+        """
+        with self._lock, self._connection:
+            self._claimed.discard(run_id)
+            self._connection.execute("UPDATE runs SET owner = NULL WHERE run_id = ? AND owner = ?",
+                                     (run_id, self.owner))
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is not None:
+                return
+            self._heartbeat = threading.Thread(target=self._refresh_claims, name="job-queue-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _refresh_claims(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock, self._connection:
+                self._connection.executemany("UPDATE runs SET heartbeat = ? WHERE run_id = ? AND owner = ?",
+                                             [(time.time(), run_id, self.owner) for run_id in self._claimed])
+
+    def interrupted(self):
+        """
+        Lists the runs that never finished and nobody works on, e.g. because the app was closed in
+        the middle of them. Runs already resumed `settings.JOB_QUEUE_MAX_RESUMES` times are given up on: they are marked
+        as finished instead.
+
+        Returns:
+            list: (run ID, `JobSpec`) pairs, oldest first.
+        """
+        with self._lock, self._connection:
+            abandoned = self._connection.execute(
+                "UPDATE runs SET finished_at = ? WHERE finished_at IS NULL AND attempts >= ? "
+                "AND (owner IS NULL OR heartbeat < ?)",
+                (time.time(), settings.JOB_QUEUE_MAX_RESUMES, time.time() - CLAIM_TIMEOUT)).rowcount
+            rows = self._connection.execute(
+                "SELECT run_id, job FROM runs WHERE finished_at IS NULL AND (owner IS NULL OR heartbeat < ?) "
+                "ORDER BY run_id", (time.time() - CLAIM_TIMEOUT,)).fetchall()
+        if abandoned:
+            print(f"Job queue: gave up on {abandoned} run(s) interrupted {settings.JOB_QUEUE_MAX_RESUMES} times")
+        return [(run_id, JobSpec.from_dict(json.loads(job))) for run_id, job in rows]
+
+    def is_enumerated(self, run_id):
+        """
+        Tells whether every video of a run was queued, so resuming it needs no playlist request.
+
+        Args:
+            run_id (int): The run.
+
+        Returns:
+            bool: True once `set_enumerated` was called for the run.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT enumerated FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return bool(row and row[0])
+
+    def set_enumerated(self, run_id):
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE runs SET enumerated = 1 WHERE run_id = ?", (run_id,))
+
+    def enqueue(self, run_id, videos):
+        """
+        Queues the videos of a run. Videos already queued keep their state.
+
+        Args:
+            run_id (int): The run.
+            videos (list): `PlaylistVideo` records.
+
+        Returns:
+            dict: The (state, data) pair of every video by URL, with its current state.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            position = self._connection.execute("SELECT COUNT(*) FROM video_jobs WHERE run_id = ?",
+                                                (run_id,)).fetchone()[0]
+            self._connection.executemany("""
+                INSERT OR IGNORE INTO video_jobs (run_id, video_url, video_id, title, position, state, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                         [(run_id, video.watch_url, video.video_id, video.title, position + offset,
+                                           QUEUED, now) for offset, video in enumerate(videos)])
+            states = {}
+            for video in videos:
+                state, data = self._connection.execute(
+                    "SELECT state, data FROM video_jobs WHERE run_id = ? AND video_url = ?",
+                    (run_id, video.watch_url)).fetchone()
+                states[video.watch_url] = (state, json.loads(data) if data else None)
+        return states
+
+    def queued_videos(self, run_id):
+        """
+        Returns the videos of a run, in playlist order, to resume it without enumerating the playlist again.
+
+        Args:
+            run_id (int): The run.
+
+        Returns:
+            list: `PlaylistVideo` records.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT video_id, title, position FROM video_jobs WHERE run_id = ? ORDER BY position",
+                (run_id,)).fetchall()
+        return [PlaylistVideo(video_id, title, index=position) for video_id, title, position in rows]
+
+    def set_state(self, run_id, video_url, state, data=None, error=None):
+        """
+        Records a state transition of a video, committed before returning.
+
+        Args:
+            run_id (int): The run.
+            video_url (str): The video.
+            state (str): The new state.
+            data (dict, optional): What resuming from that state needs, e.g. the downloaded file to convert.
+                Kept from the previous state if not given.
+            error (str, optional): Why the video failed.
+
+        Returns:
+            None
+        """
+        with self._lock, self._connection:
+            self._connection.execute("""
+                UPDATE video_jobs SET state = ?, data = COALESCE(?, data), error = ?, updated_at = ?
+                WHERE run_id = ? AND video_url = ?""",
+                                     (state, json.dumps(data) if data is not None else None, error, time.time(),
+                                      run_id, video_url))
+
+    def counts(self, run_id):
+        """
+        Counts the videos of a run in every state.
+
+        Args:
+            run_id (int): The run.
+
+        Returns:
+            dict: The number of videos by state.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT state, COUNT(*) FROM video_jobs WHERE run_id = ? GROUP BY state", (run_id,)).fetchall()
+        return dict(rows)
+
+    def finish_run(self, run_id):
+        """
+        Marks a run as finished, releasing it: every video of it is done or failed. Runs finished more than
+        `settings.JOB_QUEUE_RETENTION_DAYS` ago are dropped.
+
+        Args:
+            run_id (int): The run.
+
+        Returns:
+            None
+        """
+        now = time.time()
+        expired = now - settings.JOB_QUEUE_RETENTION_DAYS * 24 * 60 * 60
+        with self._lock, self._connection:
+            self._claimed.discard(run_id)
+            self._connection.execute("UPDATE runs SET finished_at = ?, owner = NULL WHERE run_id = ?", (now, run_id))
+            self._connection.execute("""
+                DELETE FROM video_jobs WHERE run_id IN (SELECT run_id FROM runs WHERE finished_at < ?)""",
+                                     (expired,))
+            self._connection.execute("DELETE FROM runs WHERE finished_at < ?", (expired,))
@@ -0,0 +1,77 @@
+import settings
+
+# Output formats offered for single videos
+OUTPUT_FORMATS = ["No conversion", "MP3", "M4A", "OPUS", "AVI", "MKV", "MP4"]
+
+
+class JobSpec:
+    """
+    Everything the downloader needs to know to process one URL, independent of any GUI.
+
+    Single videos use `output_format`, `quality`, `audio` and `video`.
+    Playlists use `only_audio` and `convert_to_mp3` for every item. With `sync`, only the items added
+    since the last sync of the playlist are downloaded, and `report_removed` lists the ones removed.
+    Both pick their streams with the `video_policy` and `audio_policy` selection policies, an explicit
+    `quality` narrowing the video policy to one resolution.
+    """
+
+    def __init__(self, url, output_dir, output_format="No conversion", quality=None, audio=True, video=True,
+                 only_audio=True, convert_to_mp3=False, sync=False, report_removed=False, video_policy=None,
+                 audio_policy=None):
+        self.url = url
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.quality = quality
+        self.audio = audio
+        self.video = video
+        self.only_audio = only_audio
+        self.convert_to_mp3 = convert_to_mp3
+        self.sync = sync
+        self.report_removed = report_removed
+        self.video_policy = video_policy or settings.VIDEO_POLICY
+        self.audio_policy = audio_policy or settings.AUDIO_POLICY
+
+    def __repr__(self):
+        return f"<JobSpec {self.url} -> {self.output_dir}>"
+
+    def as_dict(self):
+        """
+        The job as plain values, e.g. to send it to a worker process.
+
+        Returns:
+            dict: The constructor arguments.
+        """
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Rebuilds a job from `as_dict`.
+
+        Args:
+            values (dict): The constructor arguments.
+
+        Returns:
+            JobSpec: The job.
+        """
+        return cls(**values)
+
+    @property
+    def is_playlist(self):
+        return "playlist" in self.url
+
+    @property
+    def archive_format(self):
+        """
+        The format playlist items are saved in, which the download archive tells apart: "mp3", "audio" or "video".
+        """
+        if self.convert_to_mp3:
+            return "mp3"
+        return "audio" if self.only_audio else "video"
+
+    @property
+    def format(self):
+        """
+        The output format in lower case, e.g. "mp3" or "no conversion".
+        """
+        return self.output_format.lower()
@@ -1,7 +1,11 @@
+import multiprocessing
+
 import customtkinter
 import gui_setup
 
 if __name__ == "__main__":
+    # Playlist conversions run in worker processes, which frozen executables have to bootstrap
+    multiprocessing.freeze_support()
     root = customtkinter.CTk()
     app = gui_setup.YouTubeDownloaderApp(root)
     root.mainloop()
@@ -0,0 +1,247 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from pytube import YouTube, extract
+from pytube.streams import Stream
+
+import settings
+
+
+def stream_to_manifest_entry(stream):
+    """
+    Rebuilds the manifest entry a pytube `Stream` was created from, so it can be stored and
+    turned back into an equivalent `Stream` later.
+
+    Args:
+        stream (Stream): The pytube stream.
+
+    Returns:
+        dict: The manifest entry, with its signature already applied to the URL.
+    """
+    entry = {
+        "url": stream.url,
+        "itag": stream.itag,
+        "mimeType": f'{stream.mime_type}; codecs="{", ".join(stream.codecs)}"',
+        "is_otf": stream.is_otf,
+        "bitrate": stream.bitrate,
+        "contentLength": stream._filesize,
+    }
+    if hasattr(stream, "fps"):
+        entry["fps"] = stream.fps
+    return entry
+
+
+class CachedYouTube(YouTube):
+    """
+    A `YouTube` object that reads its metadata and stream manifest from a `MetadataCache` when
+    available, and stores whatever it has to fetch from YouTube for the next time.
+    """
+
+    def __init__(self, url, cache, **kwargs):
+        super().__init__(url, **kwargs)
+        self._cache = cache
+        self._manifest_from_cache = False
+        self._details_stored = False
+        self._publish_date_stored = False
+        self._cached_thumbnail_url = None
+
+    def check_availability(self):
+        # A cached manifest was only stored after the video passed this check
+        if self._manifest_from_cache:
+            return
+        super().check_availability()
+
+    @property
+    def vid_info(self):
+        vid_info = YouTube.vid_info.fget(self)
+        if not self._details_stored and not self._manifest_from_cache:
+            self._details_stored = True
+            self._cache.store_details(self.video_id, vid_info.get("videoDetails", {}))
+        return vid_info
+
+    @property
+    def publish_date(self):
+        publish_date = YouTube.publish_date.fget(self)
+        if not self._publish_date_stored:
+            self._publish_date_stored = True
+            self._cache.store_publish_date(self.video_id, publish_date)
+        return publish_date
+
+    @publish_date.setter
+    def publish_date(self, value):
+        self._publish_date = value
+
+    @property
+    def thumbnail_url(self):
+        if self._cached_thumbnail_url:
+            return self._cached_thumbnail_url
+        return YouTube.thumbnail_url.fget(self)
+
+    @property
+    def fmt_streams(self):
+        streams = YouTube.fmt_streams.fget(self)
+        if not self._manifest_from_cache:
+            self._manifest_from_cache = True
+            self._cache.store_manifest(self.video_id, [stream_to_manifest_entry(s) for s in streams])
+        return streams
+
+
+class MetadataCache:
+    """
+    On-disk cache of video metadata keyed by video ID, backed by SQLite.
+
+    Static fields (title, author, publish date, thumbnail URL...) never expire. The stream manifest
+    holds signed URLs that YouTube expires, so it is only reused for `stream_ttl` seconds.
+    """
+
+    def __init__(self, path=None, stream_ttl=settings.STREAM_MANIFEST_TTL):
+        self.path = path or os.path.join(settings.CACHE_DIR, "metadata.sqlite3")
+        self.stream_ttl = stream_ttl
+        self.stats = {"hits": 0, "misses": 0, "manifest_hits": 0, "manifest_misses": 0}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS videos (
+                    video_id TEXT PRIMARY KEY,
+                    title TEXT,
+                    author TEXT,
+                    publish_date TEXT,
+                    thumbnail_url TEXT,
+                    details TEXT
+                )""")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS manifests (
+                    video_id TEXT PRIMARY KEY,
+                    manifest TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )""")
+
+    def get_youtube(self, url, **kwargs):
+        """
+        Returns a `YouTube` object for the URL, primed with whatever the cache holds for the video.
+
+        Args:
+            url (str): The URL of the YouTube video.
+            **kwargs: Extra arguments for the `YouTube` constructor.
+
+        Returns:
+            CachedYouTube: The YouTube object.
+        """
+        yt = CachedYouTube(url, self, **kwargs)
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT title, author, publish_date, thumbnail_url, details FROM videos WHERE video_id = ?",
+                (yt.video_id,)).fetchone()
+            manifest = self._connection.execute(
+                "SELECT manifest FROM manifests WHERE video_id = ? AND fetched_at > ?",
+                (yt.video_id, time.time() - self.stream_ttl)).fetchone()
+
+            self.stats["hits" if row and row[4] is not None else "misses"] += 1
+            self.stats["manifest_hits" if manifest else "manifest_misses"] += 1
+
+        if row is None:
+            return yt
+
+        title, author, publish_date, thumbnail_url, details = row
+        if publish_date:
+            yt._publish_date = datetime.fromisoformat(publish_date)
+            yt._publish_date_stored = True
+        if details is None:
+            # Only the publish date was stored so far
+            return yt
+
+        yt._title = title
+        yt._author = author
+        yt._cached_thumbnail_url = thumbnail_url
+        yt._details_stored = True
+
+        if manifest is not None:
+            # With the manifest cached, no request to YouTube is needed at all
+            yt._manifest_from_cache = True
+            yt._vid_info = {"playabilityStatus": {"status": "OK"}, "videoDetails": json.loads(details)}
+            yt._fmt_streams = [Stream(stream=entry, monostate=yt.stream_monostate)
+                               for entry in json.loads(manifest[0])]
+            yt.stream_monostate.title = yt.title
+            yt.stream_monostate.duration = yt.length
+
+        return yt
+
+    def store_details(self, video_id, details):
+        """
+        Stores the static details of a video.
+
+        Args:
+            video_id (str): The video ID.
+            details (dict): The `videoDetails` section of the player response.
+
+        Returns:
+            None
+        """
+        thumbnails = details.get("thumbnail", {}).get("thumbnails")
+        thumbnail_url = (thumbnails[-1]["url"] if thumbnails
+                         else f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg")
+        with self._lock, self._connection:
+            self._connection.execute("""
+                INSERT INTO videos (video_id, title, author, thumbnail_url, details) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET title = excluded.title, author = excluded.author,
+                    thumbnail_url = excluded.thumbnail_url, details = excluded.details""",
+                                     (video_id, details.get("title"), details.get("author"), thumbnail_url,
+                                      json.dumps(details)))
+
+    def store_publish_date(self, video_id, publish_date):
+        """
+        Stores the publish date of a video. It comes from the watch page, separately from the other details.
+
+        Args:
+            video_id (str): The video ID.
+            publish_date (datetime): The publish date, or None if YouTube does not show one.
+
+        Returns:
+            None
+        """
+        if publish_date is None:
+            return
+        with self._lock, self._connection:
+            self._connection.execute("""
+                INSERT INTO videos (video_id, publish_date) VALUES (?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET publish_date = excluded.publish_date""",
+                                     (video_id, publish_date.isoformat()))
+
+    def store_manifest(self, video_id, manifest):
+        """
+        Stores the parsed stream manifest of a video.
+
+        Args:
+            video_id (str): The video ID.
+            manifest (list): The manifest entries, see `stream_to_manifest_entry`.
+
+        Returns:
+            None
+        """
+        with self._lock, self._connection:
+            self._connection.execute("""
+                INSERT INTO manifests (video_id, manifest, fetched_at) VALUES (?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET manifest = excluded.manifest, fetched_at = excluded.fetched_at""",
+                                     (video_id, json.dumps(manifest), time.time()))
+
+    def invalidate_manifest(self, url):
+        """
+        Drops the cached stream manifest of a video, keeping its static details, e.g. because its URLs were refused.
+
+        Args:
+            url (str): The URL of the YouTube video.
+
+        Returns:
+            None
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM manifests WHERE video_id = ?", (extract.video_id(url),))
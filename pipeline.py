@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import settings
+from concurrency import AdaptiveConcurrency
+from scheduler import NORMAL, Scheduler, running_as
+from tracing import Span, Tracer, timed_call
+
+
+class StagedPipeline:
+    """
+    Runs jobs through two stages with their own concurrency:
+    an I/O stage on threads (metadata, thumbnails, downloads) and a CPU stage on a process pool
+    (conversion, tagging). How many I/O jobs run at once is adapted by `concurrency` to the
+    throughput and errors it measures.
+
+    The stages are joined by a bounded queue: an I/O worker only hands a job over once one of
+    `queue_size` slots is free, so downloads run ahead of the encoders by at most that many jobs.
+    Items are also taken from their source only as jobs finish, so a lazy source (e.g. a playlist
+    enumerated page by page) feeds the pipeline as it goes and is never read far ahead.
+
+    Each CPU job is timed in its worker process and recorded on `tracer` as a span named after
+    `cpu_stage`, with the time it waited for a free process.
+
+    CPU jobs also take an encoder slot of `scheduler` before they are submitted, so pipelines
+    running at once and the conversions of single videos share the encoders by priority.
+    """
+
+    def __init__(self, concurrency=None, cpu_workers=settings.PIPELINE_CPU_WORKERS,
+                 queue_size=settings.PIPELINE_QUEUE_SIZE, tracer=None, scheduler=None):
+        self.concurrency = concurrency or AdaptiveConcurrency("pipeline")
+        self.tracer = tracer or Tracer()
+        self.cpu_workers = max(1, cpu_workers)
+        self.queue_size = max(1, queue_size)
+        self.scheduler = scheduler or Scheduler(self.cpu_workers)
+
+    def run(self, items, io_stage, cpu_stage, on_done=None, priority=NORMAL):
+        """
+        Runs every item through both stages and waits for all of them.
+
+        Args:
+            items (iterable): The jobs, possibly a generator still producing them.
+            io_stage (callable): Called with an item in a thread. Returns the argument tuple for
+                `cpu_stage`, or None if the item needs no CPU work.
+            cpu_stage (callable): A picklable, module-level function run in a worker process.
+            on_done (callable, optional): Called with (item, result, error) once an item leaves the pipeline.
+            priority (int): The priority class of the items' downloads and conversions, see `scheduler`.
+
+        Returns:
+            list: The (item, error) pairs of the items that failed.
+        """
+        slots = threading.BoundedSemaphore(self.queue_size)
+        # Items taken from the source and not finished yet: enough to keep every stage busy
+        admitted = threading.BoundedSemaphore(self.concurrency.max_workers + self.queue_size)
+        failures = []
+        failures_lock = threading.Lock()
+
+        def finish(item, result, error):
+            try:
+                if error is not None:
+                    print(f"Pipeline job failed for {item}: {error}")
+                    with failures_lock:
+                        failures.append((item, error))
+                if on_done is not None:
+                    on_done(item, result, error)
+            finally:
+                admitted.release()
+
+        with ProcessPoolExecutor(max_workers=self.cpu_workers) as processes:
+
+            def io_task(item):
+                try:
+                    with self.concurrency.slot(), running_as(priority):
+                        job = io_stage(item)
+                except Exception as e:
+                    finish(item, None, e)
+                    return
+                if job is None:
+                    finish(item, None, None)
+                    return
+
+                # Backpressure: wait for a free slot in the conversion queue
+                slots.acquire()
+                self.scheduler.acquire_encoder(priority)
+
+                submitted = time.time()
+
+                def cpu_done(future):
+                    self.scheduler.release_encoder()
+                    slots.release()
+                    error = future.exception()
+                    result = None
+                    if error is None:
+                        result, start, end, pid = future.result()
+                        span = Span(cpu_stage.__name__, str(item), start, end, pid, pid,
+                                    queued=round(start - submitted, 6))
+                    else:
+                        span = Span(cpu_stage.__name__, str(item), submitted, time.time())
+                        span.error = f"{type(error).__name__}: {error}"
+                    self.tracer.record(span)
+                    finish(item, result, error)
+
+                try:
+                    future = processes.submit(timed_call, cpu_stage, *job)
+                except Exception as e:
+                    # e.g. BrokenProcessPool after a worker crashed: give the slots back, or the run hangs
+                    self.scheduler.release_encoder()
+                    slots.release()
+                    finish(item, None, e)
+                    return
+                future.add_done_callback(cpu_done)
+
+            # Enough threads for the upper bound, the controller decides how many actually run
+            with ThreadPoolExecutor(max_workers=self.concurrency.max_workers) as threads:
+                for item in items:
+                    # The source is only read further once there is room for the next item
+                    admitted.acquire()
+                    threads.submit(io_task, item)
+
+            # Leaving the process pool block waits for the queued conversions
+        return failures
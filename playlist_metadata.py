@@ -0,0 +1,153 @@
+import json
+
+from pytube import request
+
+
+class PlaylistVideo:
+    """
+    Compact record of one playlist entry, read from the playlist page without opening the video.
+    """
+
+    __slots__ = ("video_id", "title", "duration", "thumbnail_url", "index")
+
+    def __init__(self, video_id, title=None, duration=None, thumbnail_url=None, index=None):
+        self.video_id = video_id
+        self.title = title
+        self.duration = duration
+        self.thumbnail_url = thumbnail_url
+        self.index = index
+
+    def __repr__(self):
+        return f"<PlaylistVideo {self.video_id} {self.title!r}>"
+
+    @property
+    def watch_url(self):
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+    def youtube(self, metadata_cache):
+        """
+        Lazily opens the video itself, for the details the playlist page does not carry.
+
+        Args:
+            metadata_cache (MetadataCache): The cache used to build the YouTube object.
+
+        Returns:
+            YouTube: The YouTube object of the video.
+        """
+        yt = metadata_cache.get_youtube(self.watch_url)
+        if self.title is None:
+            self.title = yt.title
+        return yt
+
+
+def _text(field):
+    """
+    Reads the text of a YouTube renderer text field, which comes either as `simpleText` or as `runs`.
+
+    Args:
+        field (dict): The text field.
+
+    Returns:
+        str: The text, or None if the field is empty.
+    """
+    if not field:
+        return None
+    if "simpleText" in field:
+        return field["simpleText"]
+    runs = field.get("runs")
+    return "".join(run.get("text", "") for run in runs) if runs else None
+
+
+def parse_video_renderer(renderer, position):
+    """
+    Builds a `PlaylistVideo` from a `playlistVideoRenderer`.
+
+    Args:
+        renderer (dict): The renderer data.
+        position (int): The position of the entry in the playlist, used when the renderer has no index.
+
+    Returns:
+        PlaylistVideo: The record.
+    """
+    thumbnails = renderer.get("thumbnail", {}).get("thumbnails")
+    duration = renderer.get("lengthSeconds")
+    index = _text(renderer.get("index"))
+    return PlaylistVideo(
+        video_id=renderer["videoId"],
+        title=_text(renderer.get("title")),
+        duration=int(duration) if duration else None,
+        thumbnail_url=thumbnails[-1]["url"] if thumbnails else None,
+        index=int(index) - 1 if index and index.isdigit() else position,
+    )
+
+
+def extract_page(data, position=0):
+    """
+    Extracts the video records and the continuation token from a playlist page's initial data,
+    or from a continuation response. Follows the same layouts as pytube's `Playlist._extract_videos`.
+
+    Args:
+        data (dict): The parsed initial data or continuation response.
+        position (int): The playlist position of the first entry on this page.
+
+    Returns:
+        tuple: A list of `PlaylistVideo` records and the continuation token (None on the last page).
+    """
+    try:
+        # Layout of the initial data embedded in the playlist page
+        section_contents = data["contents"]["twoColumnBrowseResultsRenderer"]["tabs"][0]["tabRenderer"][
+            "content"]["sectionListRenderer"]["contents"]
+        try:
+            # Playlist without submenus
+            items = section_contents[0]["itemSectionRenderer"]["contents"][0]["playlistVideoListRenderer"][
+                "contents"]
+        except (KeyError, IndexError, TypeError):
+            # Playlist with submenus
+            items = section_contents[1]["itemSectionRenderer"]["contents"][0]["playlistVideoListRenderer"][
+                "contents"]
+    except (KeyError, IndexError, TypeError):
+        try:
+            # Layout of a continuation response
+            items = data["onResponseReceivedActions"][0]["appendContinuationItemsAction"]["continuationItems"]
+        except (KeyError, IndexError, TypeError) as e:
+            print(f"Could not find playlist entries in the page: {e}")
+            return [], None
+
+    videos = []
+    continuation = None
+    seen = set()
+    for item in items:
+        if "playlistVideoRenderer" in item:
+            renderer = item["playlistVideoRenderer"]
+            if renderer.get("videoId") and renderer["videoId"] not in seen:
+                seen.add(renderer["videoId"])
+                videos.append(parse_video_renderer(renderer, position + len(videos)))
+        elif "continuationItemRenderer" in item:
+            try:
+                continuation = item["continuationItemRenderer"]["continuationEndpoint"][
+                    "continuationCommand"]["token"]
+            except KeyError:
+                continuation = None
+    return videos, continuation
+
+
+def iter_playlist_pages(playlist):
+    """
+    Walks a playlist page by page, yielding the video records of each page as it is fetched.
+
+    Args:
+        playlist (Playlist): The pytube playlist.
+
+    Yields:
+        list: The `PlaylistVideo` records of one page (up to 100).
+    """
+    videos, continuation = extract_page(playlist.initial_data)
+    position = len(videos)
+    yield videos
+
+    while continuation:
+        url, headers, data = playlist._build_continuation_url(continuation)
+        response = json.loads(request.post(url, extra_headers=headers, data=data))
+        videos, continuation = extract_page(response, position)
+        position += len(videos)
+        yield videos
@@ -0,0 +1,175 @@
+import os
+import sqlite3
+import threading
+import time
+
+from pytube import Playlist
+
+import settings
+from playlist_metadata import PlaylistVideo, iter_playlist_pages
+
+
+class SyncResult:
+    """
+    What changed in a playlist since its last sync.
+
+    `videos` are the entries to download: the new ones, and the ones whose download failed last time.
+    `seen` are the entries enumerated this time, in playlist order. `complete` tells whether the whole
+    playlist was enumerated; only then are the `removed` entries known.
+    """
+
+    __slots__ = ("playlist_id", "title", "videos", "seen", "removed", "complete")
+
+    def __init__(self, playlist_id, title, videos, seen, removed, complete):
+        self.playlist_id = playlist_id
+        self.title = title
+        self.videos = videos
+        self.seen = seen
+        self.removed = removed
+        self.complete = complete
+
+    def __repr__(self):
+        return (f"<SyncResult {self.playlist_id} {len(self.videos)} to download, {len(self.removed)} removed, "
+                f"{'complete' if self.complete else 'partial'}>")
+
+
+class PlaylistSync:
+    """
+    Remembers the entries of the playlists already downloaded, backed by SQLite, so the next run of a
+    playlist only downloads what changed.
+
+    For playlists listing the newest videos first (channel uploads), enumeration stops at the first
+    entry seen before, so a sync costs one page request when only a few videos are new. Other
+    playlists are enumerated in full, which also tells which entries were removed.
+
+    Entries whose download failed stay pending and are queued again by the next sync, wherever they are.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(settings.CACHE_DIR, "playlists.sqlite3")
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS playlists (
+                    playlist_id TEXT PRIMARY KEY,
+                    title TEXT,
+                    synced_at REAL NOT NULL
+                )""")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS playlist_items (
+                    playlist_id TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    title TEXT,
+                    pending INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (playlist_id, video_id)
+                ) WITHOUT ROWID""")
+
+    def known_items(self, playlist_id):
+        """
+        Returns the entries remembered for a playlist.
+
+        Args:
+            playlist_id (str): The playlist ID.
+
+        Returns:
+            dict: (position, title, pending) tuples by video ID.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT video_id, position, title, pending FROM playlist_items WHERE playlist_id = ?",
+                (playlist_id,)).fetchall()
+        return {video_id: (position, title, bool(pending)) for video_id, position, title, pending in rows}
+
+    def sync(self, url, newest_first=None, report_removed=False, videos=None):
+        """
+        Compares a playlist with what was remembered of it. Nothing is stored until `commit`.
+
+        Args:
+            url (str): The URL of the playlist.
+            newest_first (bool, optional): Whether new videos show up at the top of the playlist, so
+                enumeration can stop at the first known entry. Guessed from the playlist ID by default:
+                channel uploads ("UU...") are newest first.
+            report_removed (bool): Enumerate the whole playlist even when it could stop early, to find
+                the removed entries.
+            videos (list, optional): The `PlaylistVideo` records of the whole playlist, if they were
+                already fetched. No request is made then.
+
+        Returns:
+            SyncResult: The entries to download and the changes found.
+        """
+        playlist = Playlist(url)
+        playlist_id = playlist.playlist_id
+        known = self.known_items(playlist_id)
+        if newest_first is None:
+            newest_first = playlist_id.startswith("UU")
+        stop_early = bool(known) and newest_first and not report_removed and videos is None
+
+        seen = []
+        complete = True
+        for page in ([videos] if videos is not None else iter_playlist_pages(playlist)):
+            for video in page:
+                entry = known.get(video.video_id)
+                if stop_early and entry is not None and not entry[2]:
+                    # Everything below was there at the last sync
+                    complete = False
+                    break
+                seen.append(video)
+            if not complete:
+                break
+
+        seen_ids = {video.video_id for video in seen}
+        to_download = [video for video in seen if video.video_id not in known or known[video.video_id][2]]
+        removed = []
+        if complete:
+            removed = [(video_id, title) for video_id, (_, title, _) in known.items() if video_id not in seen_ids]
+        else:
+            # Pending entries below the stop point are still in the playlist as far as we know
+            to_download += [PlaylistVideo(video_id, title, index=position)
+                            for video_id, (position, title, pending) in sorted(known.items(), key=lambda i: i[1][0])
+                            if pending and video_id not in seen_ids]
+
+        # The title comes from the page already fetched, or is not needed when the caller enumerated
+        title = playlist.title if videos is None else None
+        return SyncResult(playlist_id, title, to_download, seen, removed, complete)
+
+    def commit(self, result, failed_ids=()):
+        """
+        Remembers the state of a playlist after its entries were downloaded.
+
+        Args:
+            result (SyncResult): The result of `sync`.
+            failed_ids (iterable): The IDs of the videos that failed to download, queued again next time.
+
+        Returns:
+            None
+        """
+        failed_ids = set(failed_ids)
+        with self._lock, self._connection:
+            if result.complete:
+                self._connection.execute("DELETE FROM playlist_items WHERE playlist_id = ?", (result.playlist_id,))
+            else:
+                # The entries seen this time come first, the ones remembered keep their order below them
+                self._connection.execute("UPDATE playlist_items SET position = position + ? WHERE playlist_id = ?",
+                                         (len(result.seen), result.playlist_id))
+            self._connection.executemany("""
+                INSERT INTO playlist_items (playlist_id, video_id, position, title, pending) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(playlist_id, video_id) DO UPDATE SET position = excluded.position,
+                    title = excluded.title, pending = excluded.pending""",
+                                         [(result.playlist_id, video.video_id, position, video.title,
+                                           int(video.video_id in failed_ids))
+                                          for position, video in enumerate(result.seen)])
+            # Pending entries retried from below the stop point
+            self._connection.executemany(
+                "UPDATE playlist_items SET pending = ? WHERE playlist_id = ? AND video_id = ?",
+                [(int(video.video_id in failed_ids), result.playlist_id, video.video_id)
+                 for video in result.videos])
+            self._connection.execute("""
+                INSERT INTO playlists (playlist_id, title, synced_at) VALUES (?, ?, ?)
+                ON CONFLICT(playlist_id) DO UPDATE SET title = COALESCE(excluded.title, playlists.title),
+                    synced_at = excluded.synced_at""",
+                                     (result.playlist_id, result.title, time.time()))
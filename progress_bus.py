@@ -0,0 +1,191 @@
+import threading
+import time
+
+
+class ProgressBus:
+    """
+    Thread-safe meeting point between download/conversion workers and the GUI.
+
+    Workers publish progress events as often as they like: each event only overwrites the latest
+    state of its job, so publishing is cheap and never touches Tk. The GUI thread drains a coalesced
+    snapshot at its own pace, typically from `root.after`. Headless callers can instead register
+    listeners, which receive every event in the publishing thread.
+
+    `rate_estimator`, if given, returns the download rate to expect in bytes/s (e.g. the bandwidth
+    cap); snapshots then carry ETAs for the jobs counted in bytes.
+    """
+
+    def __init__(self, rate_estimator=None):
+        self.rate_estimator = rate_estimator
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._status = ("", None)
+        self._version = 0
+        self._drained_version = 0
+
+    def add_listener(self, listener):
+        """
+        Registers a callback receiving every event as a dict with a "type" key ("progress" or "status").
+        Listeners run in the worker threads, so they must be quick and thread-safe.
+
+        Args:
+            listener (callable): The callback.
+
+        Returns:
+            None
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, event):
+        for listener in self._listeners:
+            listener(event)
+
+    def reset(self):
+        """
+        Forgets every job, e.g. when a new download or playlist starts.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._jobs.clear()
+            self._version += 1
+
+    def publish(self, job_id, stage, done, total, label=None, unit="bytes"):
+        """
+        Records the progress of a job.
+
+        Args:
+            job_id (str): Identifies the job, e.g. a video ID and stream itag.
+            stage (str): What the job is doing ("audio", "video", "converting"...).
+            done (int): Units done so far (bytes, frames...).
+            total (int): Total units of the stage.
+            label (str, optional): Human readable name of the job, e.g. the video title.
+            unit (str): What `done` and `total` count. Only "bytes" jobs get an ETA.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._jobs[job_id] = {"label": label or job_id, "started": time.monotonic()}
+            elif label:
+                job["label"] = label
+            job["stage"] = stage
+            job["unit"] = unit
+            job["done"] = done
+            job["total"] = total
+            self._version += 1
+            label = job["label"]
+
+        if self._listeners:
+            self._notify({"type": "progress", "job_id": job_id, "stage": stage, "done": done, "total": total,
+                          "label": label})
+
+    def status(self, text, color=None):
+        """
+        Sets the status line shown above the progress, replacing the previous one.
+
+        Args:
+            text (str): The message.
+            color (str, optional): The text color.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._status = (text, color)
+            self._version += 1
+
+        if self._listeners:
+            self._notify({"type": "status", "text": text, "color": color})
+
+    def snapshot(self, force=False):
+        """
+        Returns a consistent copy of the current state, or None if nothing changed since the last call.
+
+        Args:
+            force (bool): Return a snapshot even if nothing changed.
+
+        Returns:
+            dict: The status line, the per-job progress of the running jobs, the aggregate progress
+                and the ETA in seconds of the running downloads (None if unknown).
+        """
+        with self._lock:
+            if not force and self._version == self._drained_version:
+                return None
+            self._drained_version = self._version
+
+            jobs = {job_id: dict(job) for job_id, job in self._jobs.items()}
+            status = self._status
+
+        done = sum(job["done"] for job in jobs.values())
+        total = sum(job["total"] for job in jobs.values())
+        running = {job_id: job for job_id, job in jobs.items() if job["done"] < job["total"]}
+
+        # Downloads in flight share the expected rate evenly, as the bandwidth limiter shares its cap
+        downloads = [job for job in running.values() if job["unit"] == "bytes"]
+        rate = self.rate_estimator() if self.rate_estimator is not None and downloads else 0
+        for job in running.values():
+            job["eta"] = (job["total"] - job["done"]) / (rate / len(downloads)) if rate and job in downloads else None
+        eta = sum(job["total"] - job["done"] for job in downloads) / rate if rate else None
+
+        return {
+            "status": status,
+            "jobs": running,
+            "finished": len(jobs) - len(running),
+            "done": done,
+            "total": total,
+            "eta": eta,
+        }
+
+
+def format_eta(seconds):
+    """
+    Renders a duration as e.g. "42s", "3m 05s" or "1h 02m".
+
+    Args:
+        seconds (float): The duration.
+
+    Returns:
+        str: The text.
+    """
+    seconds = int(seconds + 0.5)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+def format_snapshot(snapshot, max_jobs=5):
+    """
+    Renders a progress snapshot as text for a status label.
+
+    Args:
+        snapshot (dict): A snapshot returned by `ProgressBus.snapshot`.
+        max_jobs (int): The maximum number of per-job lines.
+
+    Returns:
+        str: The text to display.
+    """
+    text, _ = snapshot["status"]
+    lines = [text] if text else []
+
+    if snapshot["jobs"]:
+        percentage = snapshot["done"] / snapshot["total"] * 100 if snapshot["total"] else 0
+        eta = f" - ETA {format_eta(snapshot['eta'])}" if snapshot.get("eta") is not None else ""
+        lines.append(f"Overall: {percentage:.1f}% - {len(snapshot['jobs'])} running, "
+                     f"{snapshot['finished']} finished{eta}")
+
+        jobs = sorted(snapshot["jobs"].values(), key=lambda job: job["started"])
+        for job in jobs[:max_jobs]:
+            job_percentage = job["done"] / job["total"] * 100 if job["total"] else 0
+            job_eta = f" (ETA {format_eta(job['eta'])})" if job.get("eta") is not None else ""
+            lines.append(f"{job['label'][:40]} - {job['stage']}: {job_percentage:.0f}%{job_eta}")
+        if len(jobs) > max_jobs:
+            lines.append(f"... and {len(jobs) - max_jobs} more")
+
+    return "\n".join(lines)
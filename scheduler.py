@@ -0,0 +1,223 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import settings
+
+# Priority classes, the lower the more urgent: a single video the user waits for, a command line or
+# worker job, and background playlist work
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+PRIORITY_NAMES = ("interactive", "normal", "bulk")
+
+# Upper bounds (seconds) of the job latency histogram buckets
+LATENCY_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600)
+
+_local = threading.local()
+
+
+def current_priority():
+    """
+    The priority class of the job the calling thread works on, NORMAL outside of any.
+    """
+    return getattr(_local, "priority", NORMAL)
+
+
+@contextmanager
+def running_as(priority):
+    """
+    Runs the block in a priority class: the downloads and conversions it starts are scheduled in it.
+
+    Args:
+        priority (int): INTERACTIVE, NORMAL or BULK.
+    """
+    previous = getattr(_local, "priority", None)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _local.priority
+        else:
+            _local.priority = previous
+
+
+class Scheduler:
+    """
+    Runs the downloader jobs in priority classes (interactive, normal, bulk) and hands the encoder
+    slots out to them, so bulk playlist work yields to the downloads the user waits for.
+
+    Encoder slots are granted in priority order, then in request order: an interactive conversion
+    takes the next free slot ahead of every queued bulk one. Running encodes are never interrupted.
+    Downloads yield their bandwidth through the limiter, see `BandwidthLimiter.register`.
+
+    The latency of every job is measured per class, against the targets in `latency_targets`, and
+    exported with the Prometheus metrics of the tracer.
+    """
+
+    def __init__(self, encoder_slots=settings.PIPELINE_CPU_WORKERS, latency_targets=None, tracer=None):
+        self.encoder_slots = max(1, encoder_slots)
+        if latency_targets is None:
+            latency_targets = {INTERACTIVE: settings.INTERACTIVE_LATENCY_TARGET}
+        self.latency_targets = {priority: target for priority, target in latency_targets.items() if target}
+        self.tracer = tracer
+
+        self._condition = threading.Condition()
+        self._busy = 0
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._stats = [{"running": 0, "jobs": 0, "misses": 0, "latency_sum": 0.0, "encoder_wait": 0.0,
+                        "buckets": [0] * len(LATENCY_BUCKETS)} for _ in PRIORITY_NAMES]
+
+    def submit(self, priority, function, *args, name=None):
+        """
+        Runs a job on a new thread, in a priority class.
+
+        Args:
+            priority (int): INTERACTIVE, NORMAL or BULK.
+            function (callable): The job.
+            *args: Its arguments.
+            name (str, optional): The job, e.g. its URL, for the spans and the latency reports.
+
+        Returns:
+            Thread: The thread running the job.
+        """
+        thread = threading.Thread(target=self.call, args=(priority, function) + args, kwargs={"name": name},
+                                  name=f"{PRIORITY_NAMES[priority]}-job")
+        thread.start()
+        return thread
+
+    def call(self, priority, function, *args, name=None):
+        """
+        Runs a job in the calling thread, in a priority class, and records its latency.
+
+        Args:
+            priority (int): INTERACTIVE, NORMAL or BULK.
+            function (callable): The job.
+            *args: Its arguments.
+            name (str, optional): The job, e.g. its URL, for the spans and the latency reports.
+
+        Returns:
+            object: What the job returned.
+        """
+        stats = self._stats[priority]
+        with self._condition:
+            stats["running"] += 1
+        started = time.monotonic()
+        try:
+            with running_as(priority):
+                if self.tracer is None:
+                    return function(*args)
+                with self.tracer.span("job", name, priority=PRIORITY_NAMES[priority]):
+                    return function(*args)
+        finally:
+            self._record(priority, time.monotonic() - started, name)
+
+    def _record(self, priority, latency, name):
+        stats = self._stats[priority]
+        target = self.latency_targets.get(priority)
+        with self._condition:
+            stats["running"] -= 1
+            stats["jobs"] += 1
+            stats["latency_sum"] += latency
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    stats["buckets"][index] += 1
+            if target and latency > target:
+                stats["misses"] += 1
+        if target and latency > target:
+            print(f"{PRIORITY_NAMES[priority].capitalize()} job {name or ''} took {latency:.1f}s, "
+                  f"over its {target}s target")
+
+    def acquire_encoder(self, priority=None):
+        """
+        Waits for a free encoder slot. Waiting jobs get the slots in priority order.
+
+        Args:
+            priority (int, optional): The class of the job, defaults to the one of the calling thread.
+
+        Returns:
+            None
+        """
+        priority = current_priority() if priority is None else priority
+        with self._condition:
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            started = time.monotonic()
+            while self._busy >= self.encoder_slots or self._waiting[0] != ticket:
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            self._busy += 1
+            self._stats[priority]["encoder_wait"] += time.monotonic() - started
+            # The next waiter may fit in another free slot
+            self._condition.notify_all()
+
+    def release_encoder(self):
+        with self._condition:
+            self._busy -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def encoder(self, priority=None):
+        """
+        Holds an encoder slot while the block runs, see `acquire_encoder`.
+
+        Args:
+            priority (int, optional): The class of the job, defaults to the one of the calling thread.
+        """
+        self.acquire_encoder(priority)
+        try:
+            yield
+        finally:
+            self.release_encoder()
+
+    def prometheus_lines(self):
+        """
+        Renders the job latencies, latency targets and encoder slots in the Prometheus text format.
+
+        Returns:
+            list: The lines, to append to `Tracer.prometheus_text`.
+        """
+        with self._condition:
+            stats = [dict(values, buckets=list(values["buckets"])) for values in self._stats]
+            busy = self._busy
+            waiting = [0] * len(PRIORITY_NAMES)
+            for priority, _ in self._waiting:
+                waiting[priority] += 1
+
+        lines = ["# HELP youber_job_latency_seconds Time from the start to the end of a job, per priority class.",
+                 "# TYPE youber_job_latency_seconds histogram"]
+        for name, values in zip(PRIORITY_NAMES, stats):
+            for bound, count in zip(LATENCY_BUCKETS, values["buckets"]):
+                lines.append(f'youber_job_latency_seconds_bucket{{class="{name}",le="{bound}"}} {count}')
+            lines.append(f'youber_job_latency_seconds_bucket{{class="{name}",le="+Inf"}} {values["jobs"]}')
+            lines.append(f'youber_job_latency_seconds_sum{{class="{name}"}} {round(values["latency_sum"], 6)}')
+            lines.append(f'youber_job_latency_seconds_count{{class="{name}"}} {values["jobs"]}')
+
+        lines += ["# HELP youber_job_latency_target_seconds Latency a job of the class should stay under.",
+                  "# TYPE youber_job_latency_target_seconds gauge"]
+        for priority, target in sorted(self.latency_targets.items()):
+            lines.append(f'youber_job_latency_target_seconds{{class="{PRIORITY_NAMES[priority]}"}} {target}')
+        lines += ["# HELP youber_job_latency_target_misses_total Jobs that took longer than their class target.",
+                  "# TYPE youber_job_latency_target_misses_total counter"]
+        for priority in sorted(self.latency_targets):
+            lines.append(f'youber_job_latency_target_misses_total{{class="{PRIORITY_NAMES[priority]}"}} '
+                         f'{stats[priority]["misses"]}')
+
+        lines += ["# HELP youber_jobs_running Jobs in progress, per priority class.",
+                  "# TYPE youber_jobs_running gauge"]
+        lines += [f'youber_jobs_running{{class="{name}"}} {values["running"]}'
+                  for name, values in zip(PRIORITY_NAMES, stats)]
+        lines += ["# HELP youber_encoder_wait_seconds_total Seconds jobs waited for an encoder slot, per priority class.",
+                  "# TYPE youber_encoder_wait_seconds_total counter"]
+        lines += [f'youber_encoder_wait_seconds_total{{class="{name}"}} {round(values["encoder_wait"], 6)}'
+                  for name, values in zip(PRIORITY_NAMES, stats)]
+        lines += ["# HELP youber_encoders_waiting Jobs waiting for an encoder slot, per priority class.",
+                  "# TYPE youber_encoders_waiting gauge"]
+        lines += [f'youber_encoders_waiting{{class="{name}"}} {count}' for name, count in zip(PRIORITY_NAMES, waiting)]
+        lines += ["# HELP youber_encoders_busy Encoder slots in use.", "# TYPE youber_encoders_busy gauge",
+                  f"youber_encoders_busy {busy}"]
+        return lines
@@ -0,0 +1,498 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+from pytube import request as pytube_request
+
+import settings
+from http_session import get_transport
+from scheduler import current_priority
+from tracing import Tracer
+
+
+class _WrittenChunk:
+    """
+    File object for `Stream.on_progress`, which writes the chunk before firing the pytube callback,
+    for chunks the caller already wrote itself.
+    """
+
+    def write(self, data):
+        return len(data)
+
+
+_WRITTEN = _WrittenChunk()
+
+
+def split_ranges(filesize, connections, min_segment_size=settings.MIN_SEGMENT_SIZE, offset=0):
+    """
+    Splits a file into contiguous byte ranges, one per connection.
+
+    Args:
+        filesize (int): The total size of the file (or of the span to split) in bytes.
+        connections (int): The maximum number of ranges to create.
+        min_segment_size (int): Ranges are never made smaller than this.
+        offset (int): The byte where the span starts.
+
+    Returns:
+        list: A list of (start, end) tuples with inclusive ends, covering the whole span.
+    """
+    if filesize <= 0:
+        return []
+
+    count = max(1, min(connections, filesize // max(min_segment_size, 1)))
+    segment_size = filesize // count
+
+    ranges = []
+    start = offset
+    for i in range(count):
+        # The last range absorbs the remainder of the division
+        end = offset + filesize - 1 if i == count - 1 else start + segment_size - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+class PartialDownload:
+    """
+    On-disk state of an unfinished download: a `.part` file with the bytes fetched so far
+    and a JSON sidecar recording which byte ranges of it are complete.
+    """
+
+    def __init__(self, file_path, itag, filesize):
+        self.file_path = file_path
+        self.part_path = file_path + ".part"
+        self.state_path = self.part_path + ".json"
+        self.itag = itag
+        self.filesize = filesize
+        self.completed = []
+        self._lock = threading.Lock()
+        self._last_save = 0
+
+    def load(self):
+        """
+        Loads the completed ranges of a previous attempt, if they belong to the same stream.
+        A sidecar that does not match the stream itag and size is ignored and the download starts over.
+
+        Returns:
+            bool: True if a previous attempt was found and can be resumed.
+        """
+        if not (os.path.exists(self.part_path) and os.path.exists(self.state_path)):
+            return False
+
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as fh:
+                state = json.load(fh)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable download state {self.state_path}: {e}")
+            return False
+
+        if (state.get("itag") != self.itag or state.get("filesize") != self.filesize
+                or os.path.getsize(self.part_path) != self.filesize):
+            print(f"Download state of {self.file_path} belongs to another stream, starting over.")
+            return False
+
+        self.completed = [tuple(r) for r in state.get("completed", [])]
+        return True
+
+    def create(self):
+        """
+        Creates a fresh `.part` file preallocated to the full stream size.
+
+        Returns:
+            None
+        """
+        os.makedirs(os.path.dirname(self.part_path) or ".", exist_ok=True)
+        with open(self.part_path, "wb") as fh:
+            fh.truncate(self.filesize)
+        self.completed = []
+        self.save(force=True)
+
+    def mark_done(self, start, end):
+        """
+        Records a byte range as written, merging it with its neighbours.
+        The sidecar is rewritten at most once per `settings.PARTIAL_STATE_INTERVAL` seconds.
+
+        Args:
+            start (int): The first byte written.
+            end (int): The last byte written (inclusive).
+
+        Returns:
+            None
+        """
+        with self._lock:
+            merged = []
+            for s, e in sorted(self.completed + [(start, end)]):
+                if merged and s <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+                else:
+                    merged.append((s, e))
+            self.completed = merged
+        self.save()
+
+    def missing(self):
+        """
+        Lists the byte ranges that still have to be fetched.
+
+        Returns:
+            list: A list of (start, end) tuples with inclusive ends.
+        """
+        gaps = []
+        position = 0
+        for s, e in self.completed:
+            if s > position:
+                gaps.append((position, s - 1))
+            position = max(position, e + 1)
+        if position < self.filesize:
+            gaps.append((position, self.filesize - 1))
+        return gaps
+
+    def save(self, force=False):
+        """
+        Atomically writes the sidecar file.
+
+        Args:
+            force (bool): Write even if the last save was less than the save interval ago.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_save < settings.PARTIAL_STATE_INTERVAL:
+                return
+            self._last_save = now
+            state = {"itag": self.itag, "filesize": self.filesize, "completed": self.completed}
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(state, fh)
+            os.replace(tmp_path, self.state_path)
+
+    def finish(self):
+        """
+        Moves the completed `.part` file to its final name and drops the sidecar.
+
+        Returns:
+            str: The path of the finished file.
+        """
+        os.replace(self.part_path, self.file_path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return self.file_path
+
+
+class SegmentedDownloader:
+    def __init__(self, connections=settings.CONNECTIONS_PER_STREAM, chunk_size=settings.CHUNK_SIZE,
+                 retries=settings.SEGMENT_RETRIES, timeout=settings.REQUEST_TIMEOUT, session=None, limiter=None,
+                 tracer=None):
+        self.connections = max(1, int(connections))
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.timeout = timeout
+        # Range requests share the keep-alive pool of the rest of the downloader
+        self.session = session or get_transport().session
+        # Every chunk read waits for the bandwidth limiter, if any, with the output file as its job
+        self.limiter = limiter
+        # Bytes received by every download so far, the throughput measure of the adaptive concurrency
+        self.bytes_downloaded = 0
+        # Every download is timed as a "download" span, with its bytes and retried requests
+        self.tracer = tracer or Tracer()
+        self._progress_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def download(self, stream, output_path, filename=None, refresh=None):
+        """
+        Downloads a pytube stream by fetching several byte ranges at once.
+
+        Bytes land in a preallocated `<filename>.part` file, each range at its own offset,
+        and the completed ranges are tracked in a sidecar next to it. If a previous attempt
+        for the same stream left a `.part` file behind, only the missing ranges are requested.
+        Streams without a known size (e.g. OTF streams) fall back to `Stream.download`.
+
+        Args:
+            stream (Stream): The pytube stream to download.
+            output_path (str): The directory where the file will be saved.
+            filename (str, optional): The file name. Defaults to `stream.default_filename`.
+            refresh (callable, optional): Returns a fresh copy of the stream when its URL has expired.
+
+        Returns:
+            str: The path of the downloaded file.
+        """
+        filename = filename or stream.default_filename
+        file_path = os.path.join(output_path, filename)
+
+        try:
+            filesize = stream.filesize
+        except Exception as e:
+            print(f"Could not read the size of stream {stream.itag}, using a single connection: {e}")
+            filesize = 0
+
+        with self.tracer.span("download", itag=stream.itag) as span:
+            if filesize <= 0:
+                file_path = stream.download(output_path=output_path, filename=filename, skip_existing=False)
+                span.bytes = os.path.getsize(file_path)
+                return file_path
+            return self._download_segments(stream, file_path, filesize, refresh, span)
+
+    def _download_segments(self, stream, file_path, filesize, refresh, span):
+        """
+        Downloads the missing ranges of a stream into its `.part` file, then moves it into place.
+
+        Args:
+            stream (Stream): The pytube stream to download.
+            file_path (str): The path of the downloaded file.
+            filesize (int): The size of the stream.
+            refresh (callable, optional): Returns a fresh copy of the stream when its URL has expired.
+            span (Span): The span of the download, receiving its bytes and retries.
+
+        Returns:
+            str: The path of the downloaded file.
+        """
+        filename = os.path.basename(file_path)
+        partial = PartialDownload(file_path, stream.itag, filesize)
+        if partial.load():
+            print(f"Resuming {filename}: {filesize - sum(e - s + 1 for s, e in partial.missing())} "
+                  f"of {filesize} bytes already on disk.")
+        else:
+            partial.create()
+
+        current = {"stream": self._fresh_stream(stream, refresh)}
+
+        ranges = []
+        for start, end in partial.missing():
+            ranges += split_ranges(end - start + 1, self.connections, offset=start)
+        progress = {"remaining": sum(end - start + 1 for start, end in ranges), "bytes": 0, "retries": 0}
+
+        if self.limiter is not None:
+            self.limiter.register(file_path, current_priority())
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(len(ranges), self.connections))) as executor:
+                futures = [executor.submit(self._download_range, current, refresh, partial, start, end, progress)
+                           for start, end in ranges]
+                for future in futures:
+                    future.result()
+        finally:
+            # Whatever happened, keep the record of what is on disk for the next attempt
+            partial.save(force=True)
+            if self.limiter is not None:
+                self.limiter.finish(file_path)
+            span.bytes, span.retries = progress["bytes"], progress["retries"]
+
+        partial.finish()
+        stream.on_complete(file_path)
+        return file_path
+
+    def iter_chunks(self, stream, refresh=None, job_id=None):
+        """
+        Yields the bytes of a pytube stream in order, without writing them to disk, e.g. to feed
+        an encoder while the download runs. Up to `connections` segments of `settings.MIN_SEGMENT_SIZE`
+        bytes are fetched ahead at once, so at most that many segments are held in memory.
+        Streams without a known size are read over a single connection.
+
+        Args:
+            stream (Stream): The pytube stream to download.
+            refresh (callable, optional): Returns a fresh copy of the stream when its URL has expired.
+            job_id (str, optional): Identifies the download for the bandwidth limiter.
+
+        Yields:
+            bytes: The next part of the stream, one segment at a time.
+        """
+        job_id = job_id or f"{stream.title}/{stream.itag}"
+        current = {"stream": self._fresh_stream(stream, refresh)}
+
+        try:
+            filesize = stream.filesize
+        except Exception as e:
+            print(f"Could not read the size of stream {stream.itag}, using a single connection: {e}")
+            filesize = 0
+
+        with self.tracer.span("download", itag=stream.itag, streamed=True) as span:
+            if filesize <= 0:
+                for chunk in pytube_request.stream(current["stream"].url):
+                    span.bytes += len(chunk)
+                    yield chunk
+                return
+            yield from self._iter_segments(current, refresh, job_id, filesize, span)
+
+    def _iter_segments(self, current, refresh, job_id, filesize, span):
+        """
+        Yields the segments of a stream in order, fetching the next ones ahead, see `iter_chunks`.
+
+        Args:
+            current (dict): The shared holder of the stream in use.
+            refresh (callable, optional): Returns a fresh copy of the stream.
+            job_id (str): Identifies the download for the bandwidth limiter.
+            filesize (int): The size of the stream.
+            span (Span): The span of the download, receiving its bytes and retries.
+
+        Yields:
+            bytes: The next segment of the stream.
+        """
+        segments = deque(split_ranges(filesize, max(1, filesize // settings.MIN_SEGMENT_SIZE),
+                                      settings.MIN_SEGMENT_SIZE))
+        progress = {"remaining": filesize, "bytes": 0, "retries": 0}
+
+        def fetch(start, end):
+            with BytesIO() as buffer:
+                self._fetch_range(current, refresh, job_id, buffer, start, start, end, progress)
+                return buffer.getvalue()
+
+        if self.limiter is not None:
+            self.limiter.register(job_id, current_priority())
+        executor = ThreadPoolExecutor(max_workers=self.connections)
+        try:
+            # Keep `connections` segments in flight and hand them over in order
+            pending = deque()
+            while segments or pending:
+                while segments and len(pending) < self.connections:
+                    pending.append(executor.submit(fetch, *segments.popleft()))
+                yield pending.popleft().result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if self.limiter is not None:
+                self.limiter.finish(job_id)
+            span.bytes, span.retries = progress["bytes"], progress["retries"]
+
+    def _fresh_stream(self, stream, refresh):
+        """
+        Returns the stream itself, or a refreshed copy if its signed URL is about to expire.
+
+        Args:
+            stream (Stream): The pytube stream.
+            refresh (callable, optional): Returns a fresh copy of the stream.
+
+        Returns:
+            Stream: A stream with a usable URL.
+        """
+        if refresh is None:
+            return stream
+        try:
+            expires_in = stream.expiration.timestamp() - time.time()
+        except Exception:
+            # URLs without an expire parameter never need refreshing
+            return stream
+        if expires_in > settings.URL_EXPIRY_MARGIN:
+            return stream
+        print(f"URL of stream {stream.itag} has expired, refreshing it.")
+        return refresh()
+
+    def _refresh(self, current, refresh, failed_url):
+        """
+        Swaps the shared stream for a refreshed one. Only the first worker that sees
+        an expired URL refreshes it, the others reuse its result.
+
+        Args:
+            current (dict): The shared holder of the stream in use.
+            refresh (callable): Returns a fresh copy of the stream.
+            failed_url (str): The URL the worker was using when its request was refused.
+
+        Returns:
+            None
+        """
+        with self._refresh_lock:
+            if current["stream"].url == failed_url:
+                print(f"Stream {current['stream'].itag} was refused, refreshing its URL.")
+                current["stream"] = refresh()
+
+    def _download_range(self, current, refresh, partial, start, end, progress):
+        """
+        Fetches one byte range of a stream and writes it at its offset in the `.part` file.
+
+        Args:
+            current (dict): The shared holder of the stream in use.
+            refresh (callable, optional): Returns a fresh copy of the stream.
+            partial (PartialDownload): The on-disk state of the download.
+            start (int): The first byte of the range.
+            end (int): The last byte of the range (inclusive).
+            progress (dict): Shared progress state holding the remaining byte count.
+
+        Returns:
+            None
+        """
+        # Unbuffered: every chunk reaches the file when it is written, without a flush
+        with open(partial.part_path, "r+b", buffering=0) as fh:
+            self._fetch_range(current, refresh, partial.file_path, fh, 0, start, end, progress,
+                              on_written=partial.mark_done)
+
+    def _fetch_range(self, current, refresh, job_id, fh, base, start, end, progress, on_written=None):
+        """
+        Fetches one byte range of a stream into a file object, where byte `base` of the stream sits at
+        offset 0. A dropped connection is retried from the last byte written, and a refused (403/410)
+        request refreshes the stream URL first.
+
+        Args:
+            current (dict): The shared holder of the stream in use.
+            refresh (callable, optional): Returns a fresh copy of the stream.
+            job_id (str): Identifies the download for the bandwidth limiter.
+            fh (file): The seekable file object receiving the bytes.
+            base (int): The stream byte at offset 0 of `fh`.
+            start (int): The first byte of the range.
+            end (int): The last byte of the range (inclusive).
+            progress (dict): Shared progress state holding the remaining byte count.
+            on_written (callable, optional): Called with the first and last byte of each chunk written.
+
+        Returns:
+            None
+
+        Raises:
+            requests.RequestException: If the range still fails after all retries.
+        """
+        position = start
+        attempt = 0
+
+        fh.seek(position - base)
+        while position <= end:
+            stream = current["stream"]
+            try:
+                # Closing the response hands its connection back to the shared pool, whatever happens
+                with self.session.get(stream.url, headers={"Range": f"bytes={position}-{end}"},
+                                      stream=True, timeout=self.timeout) as response:
+                    if response.status_code in (403, 410) and refresh is not None:
+                        self._refresh(current, refresh, stream.url)
+                        raise requests.RequestException(f"Stream {stream.itag} URL was refused")
+                    response.raise_for_status()
+                    if response.status_code != 206 and position != 0:
+                        raise requests.RequestException(
+                            f"Server ignored the range request for stream {stream.itag}")
+
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        if not chunk:
+                            continue
+                        # Never write past the end of the range, even if the server sends more
+                        chunk = chunk[:end - position + 1]
+                        if self.limiter is not None:
+                            self.limiter.consume(job_id, len(chunk))
+                        chunk_start = position
+                        position += len(chunk)
+
+                        # Each range writes at its own offset, connections never wait for each other's writes
+                        view = memoryview(chunk)
+                        while view:
+                            view = view[fh.write(view):]
+                        with self._progress_lock:
+                            progress["remaining"] -= len(chunk)
+                            progress["bytes"] += len(chunk)
+                            self.bytes_downloaded += len(chunk)
+                            # Fires the registered pytube callback, the chunk is already written
+                            stream.on_progress(chunk, _WRITTEN, progress["remaining"])
+                        if on_written is not None:
+                            on_written(chunk_start, position - 1)
+
+                        if position > end:
+                            break
+
+                if position <= end:
+                    raise requests.RequestException(f"Range {start}-{end} ended early at {position}")
+            except requests.RequestException as e:
+                attempt += 1
+                with self._progress_lock:
+                    progress["retries"] += 1
+                if attempt > self.retries:
+                    raise
+                print(f"Retrying range {position}-{end} of stream {stream.itag} "
+                      f"({attempt}/{self.retries}): {e}")
+                fh.seek(position - base)
@@ -0,0 +1,148 @@
+import os
+
+
+def _env_int(name, default):
+    """
+    Reads an integer setting from the environment, falling back to a default.
+
+    Args:
+        name (str): The environment variable name.
+        default (int): The value used when the variable is missing or invalid.
+
+    Returns:
+        int: The configured value.
+    """
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        print(f"Ignoring invalid value for {name}, using {default}")
+        return default
+
+
+# Number of parallel HTTP connections used to fetch a single stream
+CONNECTIONS_PER_STREAM = _env_int("YOUBER_CONNECTIONS_PER_STREAM", 4)
+
+# Streams smaller than this are fetched over a single connection
+MIN_SEGMENT_SIZE = _env_int("YOUBER_MIN_SEGMENT_SIZE", 1024 * 1024)
+
+# Size of each read from a range response
+CHUNK_SIZE = _env_int("YOUBER_CHUNK_SIZE", 64 * 1024)
+
+# How many times a dropped range is retried before the download fails
+SEGMENT_RETRIES = _env_int("YOUBER_SEGMENT_RETRIES", 3)
+
+# Socket timeout (seconds) for range requests
+REQUEST_TIMEOUT = _env_int("YOUBER_REQUEST_TIMEOUT", 30)
+
+# Cap on the total download rate, in bytes/s with an optional K/M/G suffix ("2M"). 0 means unlimited
+BANDWIDTH_LIMIT = os.environ.get("YOUBER_BANDWIDTH_LIMIT", "0")
+
+# Time-of-day limits overriding BANDWIDTH_LIMIT, e.g. "08:00-19:00=1M, 19:00-08:00=0" (full speed at night)
+BANDWIDTH_SCHEDULE = os.environ.get("YOUBER_BANDWIDTH_SCHEDULE", "")
+
+# Download rate (bytes/s, K/M/G suffix) shared by the downloads yielding to a higher priority class, e.g. a
+# playlist while a single video downloads. It keeps their connections alive. 0 disables yielding
+YIELD_RATE = os.environ.get("YOUBER_YIELD_RATE", "64K")
+
+# Seconds an interactive job (a single video started from the GUI) should take at most, exported
+# with the scheduler metrics. 0 disables the target
+INTERACTIVE_LATENCY_TARGET = _env_int("YOUBER_INTERACTIVE_LATENCY_TARGET", 60)
+
+# Keep-alive connections the shared HTTP pool opens to a single host, further requests wait for a free one
+HTTP_CONNECTIONS_PER_HOST = _env_int("YOUBER_HTTP_CONNECTIONS_PER_HOST", 16)
+
+# Hosts the shared HTTP pool keeps connections to at the same time
+HTTP_POOL_HOSTS = _env_int("YOUBER_HTTP_POOL_HOSTS", 32)
+
+# Minimum interval (seconds) between rewrites of a `.part` file's progress sidecar
+PARTIAL_STATE_INTERVAL = _env_int("YOUBER_PARTIAL_STATE_INTERVAL", 1)
+
+# Stream URLs expiring within this many seconds are refreshed before a download starts
+URL_EXPIRY_MARGIN = _env_int("YOUBER_URL_EXPIRY_MARGIN", 60)
+
+# Directory holding the on-disk caches (metadata, thumbnails...)
+CACHE_DIR = os.environ.get("YOUBER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".youber", "cache"))
+
+# Stream selection policies, e.g. "best <=1080p", "smallest >=128kbps" or "best prefer opus"
+# (see stream_selection.SelectionPolicy). The video policy also applies to playlists downloaded as video
+VIDEO_POLICY = os.environ.get("YOUBER_VIDEO_POLICY", "best")
+AUDIO_POLICY = os.environ.get("YOUBER_AUDIO_POLICY", "best")
+
+# Skip playlist items already downloaded in the same format, as recorded in the download archive
+DOWNLOAD_ARCHIVE = _env_int("YOUBER_DOWNLOAD_ARCHIVE", 1)
+
+# Record the state of every playlist item in the job queue, so an interrupted run resumes where it stopped
+JOB_QUEUE = _env_int("YOUBER_JOB_QUEUE", 1)
+
+# Times an interrupted run is resumed before the job queue gives up on it, e.g. a playlist that no longer exists
+JOB_QUEUE_MAX_RESUMES = _env_int("YOUBER_JOB_QUEUE_MAX_RESUMES", 3)
+
+# Days the job queue keeps finished runs before dropping them
+JOB_QUEUE_RETENTION_DAYS = _env_int("YOUBER_JOB_QUEUE_RETENTION_DAYS", 7)
+
+# Seconds a cached stream manifest is reused. YouTube signs stream URLs for about six hours
+STREAM_MANIFEST_TTL = _env_int("YOUBER_STREAM_MANIFEST_TTL", 4 * 60 * 60)
+
+# Size bound (bytes) of the thumbnail store, least recently used files are evicted past it
+THUMBNAIL_CACHE_BYTES = _env_int("YOUBER_THUMBNAIL_CACHE_BYTES", 200 * 1024 * 1024)
+
+# Bounds and starting point of the adaptive number of concurrent playlist I/O tasks (metadata, thumbnails,
+# downloads). The limit moves between the bounds with the measured throughput and error rate
+PIPELINE_IO_MIN_WORKERS = _env_int("YOUBER_PIPELINE_IO_MIN_WORKERS", 1)
+PIPELINE_IO_MAX_WORKERS = _env_int("YOUBER_PIPELINE_IO_MAX_WORKERS", 16)
+PIPELINE_IO_INITIAL_WORKERS = _env_int("YOUBER_PIPELINE_IO_INITIAL_WORKERS", 2)
+
+# Seconds of measurements behind each adjustment of an adaptive concurrency limit
+ADAPTIVE_WINDOW = _env_int("YOUBER_ADAPTIVE_WINDOW", 2)
+
+# Backend converting downloaded audio: "ffmpeg" runs a single ffmpeg process per file (decoding, encoding,
+# tags and cover at once), "moviepy" decodes through moviepy and pipes the samples into ffmpeg, which encodes
+# them and writes the tags and cover at the same time
+AUDIO_BACKEND = os.environ.get("YOUBER_AUDIO_BACKEND", "ffmpeg")
+
+# Bitrate of encoded audio (MP3, M4A, Opus)
+AUDIO_BITRATE = os.environ.get("YOUBER_AUDIO_BITRATE", "192k")
+
+# LAME VBR quality of MP3s, from 0 (best) to 9 (smallest). Negative values use AUDIO_BITRATE instead
+MP3_VBR_QUALITY = _env_int("YOUBER_MP3_VBR_QUALITY", -1)
+
+# MP3 files tagged per worker call when tagging existing files in batches
+TAG_BATCH_SIZE = _env_int("YOUBER_TAG_BATCH_SIZE", 50)
+
+# Encode MP3s while the audio downloads, piping the stream into ffmpeg instead of converting a file afterwards.
+# Falls back to the file conversion if ffmpeg cannot read the stream from a pipe
+STREAM_CONVERSION = _env_int("YOUBER_STREAM_CONVERSION", 1)
+
+# File the timing spans of every stage are written to when the CLI exits: a Chrome trace if it ends
+# with ".json" (chrome://tracing, Perfetto), JSON lines otherwise. Empty disables the export
+TRACE_FILE = os.environ.get("YOUBER_TRACE_FILE", "")
+
+# Spans kept in memory for the trace export, the oldest are dropped past it
+TRACE_MAX_SPANS = _env_int("YOUBER_TRACE_MAX_SPANS", 100000)
+
+# "host:port" the CLI serves Prometheus metrics of the stages on, at /metrics. Empty disables it
+METRICS_ADDRESS = os.environ.get("YOUBER_METRICS_ADDRESS", "")
+
+# Address the coordinator of a multi-worker run listens on and workers connect to:
+# "host:port" for TCP, "unix:/path/to/socket" for a Unix socket
+CLUSTER_ADDRESS = os.environ.get("YOUBER_CLUSTER_ADDRESS", "127.0.0.1:8765")
+
+# Shared secret workers present to the coordinator. Empty accepts any worker, only safe on a trusted network
+CLUSTER_TOKEN = os.environ.get("YOUBER_CLUSTER_TOKEN", "")
+
+# Times a video job is handed to a worker again after failing or after its worker disconnected
+CLUSTER_RETRIES = _env_int("YOUBER_CLUSTER_RETRIES", 1)
+
+# Seconds a video job may go without progress before the coordinator counts it as failed and hands it out
+# again, e.g. when the worker hangs on a stalled download while still connected. Workers renew the lease
+# of a job several times per timeout while it downloads
+CLUSTER_LEASE_TIMEOUT = _env_int("YOUBER_CLUSTER_LEASE_TIMEOUT", 30 * 60)
+
+# Processes of the playlist CPU stage (conversion, tagging)
+PIPELINE_CPU_WORKERS = _env_int("YOUBER_PIPELINE_CPU_WORKERS", max(1, (os.cpu_count() or 2) - 1))
+
+# Downloaded jobs allowed to wait for a free encoder before the I/O stage pauses
+PIPELINE_QUEUE_SIZE = _env_int("YOUBER_PIPELINE_QUEUE_SIZE", 2 * PIPELINE_CPU_WORKERS)
+
+# Interval (milliseconds) at which the GUI renders the progress published by the workers
+PROGRESS_REFRESH_MS = _env_int("YOUBER_PROGRESS_REFRESH_MS", 100)
@@ -0,0 +1,250 @@
+import re
+
+# Codec families as the policies name them, by codec prefix in the manifest
+CODEC_FAMILIES = {
+    "avc1": "h264",
+    "hev1": "hevc",
+    "hvc1": "hevc",
+    "vp9": "vp9",
+    "vp09": "vp9",
+    "vp8": "vp8",
+    "av01": "av1",
+    "mp4a": "aac",
+    "opus": "opus",
+    "vorbis": "vorbis",
+}
+
+_HEIGHT_PATTERN = re.compile(r"^(<=|>=|<|>|=)?(\d+)p$")
+_BITRATE_PATTERN = re.compile(r"^(<=|>=|<|>|=)?(\d+)kbps$")
+
+
+class StreamInfo:
+    """
+    The properties stream selection looks at, read once from a pytube `Stream`.
+    """
+
+    __slots__ = ("stream", "itag", "kind", "height", "fps", "codec", "container", "progressive", "kbps")
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.itag = stream.itag
+        self.progressive = stream.is_progressive
+        self.kind = "audio" if stream.type == "audio" else "video"
+        self.height = int(stream.resolution[:-1]) if getattr(stream, "resolution", None) else None
+        self.fps = getattr(stream, "fps", None)
+        codec = stream.audio_codec if self.kind == "audio" else stream.video_codec
+        self.codec = CODEC_FAMILIES.get((codec or "").split(".")[0], codec)
+        self.container = stream.subtype
+        abr = getattr(stream, "abr", None)
+        self.kbps = int(abr[:-4]) if abr else (stream.bitrate or 0) // 1000
+
+    def __repr__(self):
+        height = f" {self.height}p" if self.height else ""
+        return f"<StreamInfo itag={self.itag} {self.kind}{height} {self.codec}/{self.container} {self.kbps}kbps>"
+
+
+def _compare(value, operator, bound):
+    if value is None:
+        return False
+    return {"<=": value <= bound, ">=": value >= bound, "<": value < bound, ">": value > bound,
+            "=": value == bound}[operator]
+
+
+class SelectionPolicy:
+    """
+    A declarative rule picking one stream, parsed from text such as "best <=1080p",
+    "smallest >=128kbps" or "best prefer opus":
+
+    - "best" (default) or "smallest" orders the candidates by resolution, then frame rate and bitrate;
+    - "<=1080p", ">=720p", ">=128kbps"... bound the resolution or the bitrate;
+    - "progressive" or "adaptive" keeps only single-file or separate-track streams;
+    - "prefer X" favors a codec ("opus", "h264", "av1"...) or a container ("mp4", "webm") among the
+      candidates meeting the bounds, it can be repeated.
+
+    When no stream meets the bounds, they are relaxed: the closest stream to them is taken instead.
+    """
+
+    def __init__(self, text="best"):
+        self.text = text
+        self.smallest = False
+        self.bounds = []
+        self.progressive = None
+        self.prefer = []
+
+        tokens = text.lower().replace(",", " ").split()
+        position = 0
+        while position < len(tokens):
+            token = tokens[position]
+            if token in ("best", "smallest"):
+                self.smallest = token == "smallest"
+            elif token in ("progressive", "adaptive"):
+                self.progressive = token == "progressive"
+            elif token == "prefer" and position + 1 < len(tokens):
+                position += 1
+                self.prefer.append(tokens[position])
+            elif _HEIGHT_PATTERN.match(token):
+                operator, value = _HEIGHT_PATTERN.match(token).groups()
+                self.bounds.append(("height", operator or "=", int(value)))
+            elif _BITRATE_PATTERN.match(token):
+                operator, value = _BITRATE_PATTERN.match(token).groups()
+                self.bounds.append(("kbps", operator or "=", int(value)))
+            elif token not in ("audio", "video"):
+                raise ValueError(f"Invalid selection policy {text!r}: unknown term {token!r}")
+            position += 1
+
+    def __repr__(self):
+        return f"<SelectionPolicy {self.text!r}>"
+
+    def _rank(self, info):
+        # Higher is better: preferred codecs and containers first, then quality
+        preference = [info.codec == prefer or info.container == prefer for prefer in self.prefer]
+        quality = (info.height or 0, info.fps or 0, info.kbps)
+        if self.smallest:
+            quality = tuple(-value for value in quality)
+        return preference, quality
+
+    def _distance(self, info):
+        # How far a stream is from meeting the bounds, to relax them when nothing meets them
+        distance = 0
+        for field, operator, bound in self.bounds:
+            value = getattr(info, field) or 0
+            if not _compare(value, operator, bound):
+                distance += abs(value - bound)
+        return distance
+
+    def select(self, candidates):
+        """
+        Picks the stream this policy describes.
+
+        Args:
+            candidates (list): The `StreamInfo` records to choose from.
+
+        Returns:
+            StreamInfo: The chosen stream, or None if there are no candidates.
+        """
+        if self.progressive is not None:
+            candidates = [info for info in candidates if info.progressive == self.progressive] or candidates
+        if not candidates:
+            return None
+        matching = [info for info in candidates
+                    if all(_compare(getattr(info, field), operator, bound) for field, operator, bound in self.bounds)]
+        if not matching:
+            closest = min(self._distance(info) for info in candidates)
+            matching = [info for info in candidates if self._distance(info) == closest]
+        return max(matching, key=self._rank)
+
+
+class StreamIndex:
+    """
+    The streams of one manifest, indexed once for every selection made on them: by kind
+    (audio or video) and by resolution.
+    """
+
+    def __init__(self, streams):
+        self.streams = [StreamInfo(stream) for stream in streams]
+        self.audio = [info for info in self.streams if info.kind == "audio"]
+        self.video = [info for info in self.streams if info.kind == "video"]
+        self.by_height = {}
+        for info in self.video:
+            self.by_height.setdefault(info.height, []).append(info)
+
+    def select_audio(self, policy):
+        """
+        Picks an audio-only stream.
+
+        Args:
+            policy (SelectionPolicy or str): The selection policy.
+
+        Returns:
+            Stream: The pytube stream, or None if the manifest has no audio-only stream.
+        """
+        info = as_policy(policy).select(self.audio)
+        return info.stream if info else None
+
+    def select_video(self, policy, progressive=None):
+        """
+        Picks a stream holding a video track.
+
+        Args:
+            policy (SelectionPolicy or str): The selection policy.
+            progressive (bool, optional): Only consider progressive (True) or video-only (False) streams,
+                whatever the policy says. Ignored if there are none.
+
+        Returns:
+            Stream: The pytube stream, or None if the manifest has no video stream.
+        """
+        candidates = self.video
+        if progressive is not None:
+            candidates = [info for info in candidates if info.progressive == progressive] or candidates
+        info = as_policy(policy).select(candidates)
+        return info.stream if info else None
+
+    def at_resolution(self, resolution, progressive=None):
+        """
+        Returns the video streams of one resolution.
+
+        Args:
+            resolution (str): The resolution, e.g. "720p".
+            progressive (bool, optional): Only keep progressive (True) or video-only (False) streams.
+
+        Returns:
+            list: The pytube streams, empty for an unknown resolution.
+        """
+        height = int(resolution[:-1]) if resolution else None
+        return [info.stream for info in self.by_height.get(height, [])
+                if progressive is None or info.progressive == progressive]
+
+    def resolutions(self):
+        """
+        Lists the resolutions available, highest first.
+
+        Returns:
+            list: (resolution label, whether a progressive stream has it, frame rate) tuples.
+        """
+        resolutions = []
+        for height in sorted((height for height in self.by_height if height), reverse=True):
+            infos = self.by_height[height]
+            progressive = any(info.progressive for info in infos)
+            fps = max((info.fps for info in infos if info.fps), default=None)
+            resolutions.append((f"{height}p", progressive, fps))
+        return resolutions
+
+
+_policies = {}
+
+
+def as_policy(policy):
+    """
+    Returns a policy object for a policy or its text, parsing each text only once.
+
+    Args:
+        policy (SelectionPolicy or str): The policy.
+
+    Returns:
+        SelectionPolicy: The policy.
+
+    Raises:
+        ValueError: If the text is not a valid policy.
+    """
+    if isinstance(policy, SelectionPolicy):
+        return policy
+    if policy not in _policies:
+        _policies[policy] = SelectionPolicy(policy)
+    return _policies[policy]
+
+
+def stream_index(yt):
+    """
+    Returns the stream index of a video, built on first use and kept on the `YouTube` object,
+    so every selection on the same manifest shares it.
+
+    Args:
+        yt (YouTube): The video.
+
+    Returns:
+        StreamIndex: The index of its streams.
+    """
+    index = getattr(yt, "_stream_index", None)
+    if index is None:
+        index = yt._stream_index = StreamIndex(yt.fmt_streams)
+    return index
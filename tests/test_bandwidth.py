@@ -0,0 +1,106 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from bandwidth import BandwidthLimiter, parse_rate, parse_schedule
+from scheduler import BULK, INTERACTIVE
+
+
+@pytest.mark.parametrize("text, rate", [
+    ("0", 0),
+    ("1000000", 1000000),
+    ("500K", 500 * 1024),
+    ("2.5M", int(2.5 * 1024 ** 2)),
+    ("1g", 1024 ** 3),
+    (" 2MB ", 2 * 1024 ** 2),
+])
+def test_parse_rate(text, rate):
+    assert parse_rate(text) == rate
+
+
+@pytest.mark.parametrize("text", ["", "fast", "2T", "-1M"])
+def test_parse_rate_rejects_invalid_rates(text):
+    with pytest.raises(ValueError):
+        parse_rate(text)
+
+
+def test_parse_schedule():
+    assert parse_schedule("08:00-18:00=1M, 22:00-06:30=0") == [(8 * 60, 18 * 60, 1024 ** 2),
+                                                              (22 * 60, 6 * 60 + 30, 0)]
+    assert parse_schedule("") == []
+
+
+@pytest.mark.parametrize("text", ["08:00=1M", "8-18=1M", "08:00-18:00=fast"])
+def test_parse_schedule_rejects_invalid_entries(text):
+    with pytest.raises(ValueError):
+        parse_schedule(text)
+
+
+@pytest.mark.parametrize("hour, minute, rate", [
+    (9, 0, 1024 ** 2),
+    (19, 0, 4096),
+    (23, 0, 0),
+    (6, 29, 0),
+    (6, 30, 4096),
+])
+def test_schedule_overrides_the_default_rate(hour, minute, rate):
+    limiter = BandwidthLimiter(4096, parse_schedule("08:00-18:00=1M, 22:00-06:30=0"))
+
+    assert limiter.current_rate(datetime(2024, 1, 1, hour, minute)) == rate
+
+
+def test_unlimited_reads_do_not_wait():
+    limiter = BandwidthLimiter(0)
+    started = time.monotonic()
+    for _ in range(1000):
+        limiter.consume("job", 1024 * 1024)
+
+    assert time.monotonic() - started < 1
+
+
+def consume_for(limiter, job_id, connections, seconds, chunk_size=4096):
+    # Reads of `connections` threads of one job, for `seconds`
+    totals = [0] * connections
+    deadline = time.monotonic() + seconds
+
+    def read(slot):
+        while time.monotonic() < deadline:
+            limiter.consume(job_id, chunk_size)
+            totals[slot] += chunk_size
+
+    threads = [threading.Thread(target=read, args=(slot,)) for slot in range(connections)]
+    return threads, totals
+
+
+def test_jobs_share_the_rate_evenly_whatever_their_connections():
+    rate = 256 * 1024
+    limiter = BandwidthLimiter(rate, burst=0.05)
+    many, many_totals = consume_for(limiter, "many", 4, 1.5)
+    one, one_totals = consume_for(limiter, "one", 1, 1.5)
+    started = time.monotonic()
+    for thread in many + one:
+        thread.start()
+    for thread in many + one:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    total = sum(many_totals) + sum(one_totals)
+    assert total <= rate * (elapsed + limiter.burst) + 5 * 4096
+    assert 0.7 < sum(many_totals) / sum(one_totals) < 1.4
+
+
+def test_lower_priority_jobs_yield_to_higher_ones():
+    limiter = BandwidthLimiter(0, yield_rate=64 * 1024, burst=0.05)
+    limiter.register("playlist", BULK)
+    limiter.register("video", INTERACTIVE)
+    bulk, bulk_totals = consume_for(limiter, "playlist", 2, 1)
+    interactive, interactive_totals = consume_for(limiter, "video", 1, 1)
+    for thread in bulk + interactive:
+        thread.start()
+    for thread in bulk + interactive:
+        thread.join()
+
+    assert sum(bulk_totals) <= 64 * 1024 * 1.5
+    assert sum(interactive_totals) > 10 * sum(bulk_totals)
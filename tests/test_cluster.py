@@ -0,0 +1,207 @@
+import os
+import socket
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import cluster
+from cluster import Coordinator, Worker, parse_address
+from download_archive import DownloadArchive
+from jobs import JobSpec
+from playlist_metadata import PlaylistVideo
+
+
+class FakePlaylist:
+    """
+    Stands in for `pytube.Playlist`, its pages are set by the test.
+    """
+
+    pages = []
+
+    def __init__(self, url):
+        self.url = url
+
+
+@pytest.fixture(autouse=True)
+def fake_playlists(monkeypatch):
+    monkeypatch.setattr(cluster, "Playlist", FakePlaylist)
+    monkeypatch.setattr(cluster, "iter_playlist_pages", lambda playlist: iter(FakePlaylist.pages))
+    FakePlaylist.pages = [[PlaylistVideo("a", "A"), PlaylistVideo("b", "B")], [PlaylistVideo("c", "C")]]
+
+
+@pytest.fixture
+def playlist(tmp_path):
+    return JobSpec(url="https://www.youtube.com/playlist?list=PLx", output_dir=str(tmp_path), convert_to_mp3=True)
+
+
+def video(tmp_path, video_id="v"):
+    return JobSpec(url=f"https://www.youtube.com/watch?v={video_id}", output_dir=str(tmp_path))
+
+
+@pytest.mark.parametrize("address, parsed", [
+    ("127.0.0.1:8765", (socket.AF_INET, ("127.0.0.1", 8765))),
+    ("[::1]:8765", (socket.AF_INET6, ("::1", 8765))),
+    ("unix:/tmp/youber.sock", (getattr(socket, "AF_UNIX", None), "/tmp/youber.sock")),
+])
+def test_parse_address(address, parsed):
+    if parsed[0] is None:
+        pytest.skip("No Unix sockets on this platform")
+    assert parse_address(address) == parsed
+
+
+@pytest.mark.parametrize("address", ["localhost", ":8765", "localhost:http"])
+def test_parse_address_rejects_invalid_addresses(address):
+    with pytest.raises(ValueError):
+        parse_address(address)
+
+
+def test_jobs_are_handed_out_in_order_then_done(playlist):
+    coordinator = Coordinator([playlist])
+
+    tasks = [coordinator.assign("w") for _ in range(3)]
+
+    assert [task["video_id"] for task in tasks] == ["a", "b", "c"]
+    assert coordinator.assign("w")["type"] == "wait"
+    for task in tasks:
+        coordinator.complete("w", {"lease": task["lease"], "error": None, "bytes": 10, "seconds": 1})
+    assert coordinator.assign("w")["type"] == "done"
+    assert coordinator.workers["w"]["jobs"] == 3
+    assert coordinator.workers["w"]["bytes"] == 30
+
+
+def expire(coordinator, lease):
+    # As if the worker holding the lease stopped renewing it `lease_timeout` seconds ago
+    coordinator._in_flight[lease].renewed_at -= coordinator.lease_timeout + 1
+
+
+def test_expired_leases_are_handed_out_again(tmp_path):
+    coordinator = Coordinator([video(tmp_path)], retries=1)
+    task = coordinator.assign("stalled")
+
+    expire(coordinator, task["lease"])
+    retried = coordinator.assign("other")
+
+    assert retried["task_id"] == task["task_id"]
+    assert retried["lease"] != task["lease"]
+    # The late result of the stalled worker is ignored
+    coordinator.complete("stalled", {"lease": task["lease"], "error": None})
+    assert coordinator.assign("other")["type"] == "wait"
+    coordinator.complete("other", {"lease": retried["lease"], "error": None})
+    assert coordinator.assign("other")["type"] == "done"
+    assert coordinator.failures == []
+
+
+def test_renewed_leases_do_not_expire(tmp_path):
+    coordinator = Coordinator([video(tmp_path)], retries=1)
+    task = coordinator.assign("w")
+
+    expire(coordinator, task["lease"])
+    assert coordinator.renew(task["lease"])
+
+    assert coordinator.assign("other")["type"] == "wait"
+    assert task["lease"] in coordinator._in_flight
+
+
+def test_expired_leases_cannot_be_renewed(tmp_path):
+    coordinator = Coordinator([video(tmp_path)], retries=1)
+    task = coordinator.assign("w")
+    expire(coordinator, task["lease"])
+    coordinator.assign("other")
+
+    assert not coordinator.renew(task["lease"])
+
+
+def test_jobs_fail_for_good_after_the_retries(tmp_path):
+    job = video(tmp_path)
+    coordinator = Coordinator([job], retries=1)
+
+    for _ in range(2):
+        task = coordinator.assign("w")
+        coordinator.complete("w", {"lease": task["lease"], "error": "HTTP 403"})
+
+    assert coordinator.assign("w")["type"] == "done"
+    assert coordinator.failures == [(job.url, "HTTP 403")]
+    assert coordinator.workers["w"]["failed"] == 2
+
+
+def test_jobs_of_a_disconnected_worker_are_handed_out_again(tmp_path):
+    coordinator = Coordinator([video(tmp_path)], retries=1)
+    task = coordinator.assign("gone")
+
+    coordinator.release("gone", [task["lease"]])
+
+    assert coordinator.assign("other")["task_id"] == task["task_id"]
+
+
+def test_reported_items_are_archived_and_skipped_next_run(tmp_path, playlist):
+    archive = DownloadArchive(str(tmp_path / "archive.sqlite3"))
+    coordinator = Coordinator([playlist], archive=archive)
+
+    for _ in range(3):
+        task = coordinator.assign("w")
+        entry = {"video_id": task["video_id"], "format": "mp3", "itag": 140, "path": f"/remote/{task['video_id']}.mp3",
+                 "size": 100, "host": "remote-host"}
+        coordinator.complete("w", {"lease": task["lease"], "error": None, "archive": entry})
+
+    assert coordinator.assign("w")["type"] == "done"
+    assert Coordinator([playlist], archive=archive).assign("w")["type"] == "done"
+
+
+class FakeDownloader:
+    """
+    Runs jobs instantly, recording the URLs it was given.
+    """
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.urls = []
+        self.archive = None
+        self.stream_downloader = SimpleNamespace(bytes_downloaded=0)
+        self.scheduler = SimpleNamespace(call=lambda priority, fn, *args, name=None: fn(*args))
+        self._lock = threading.Lock()
+
+    def process_playlist_item(self, url, job):
+        self.run(SimpleNamespace(url=url))
+
+    def run(self, job):
+        with self._lock:
+            self.urls.append(job.url)
+            self.stream_downloader.bytes_downloaded += 100
+        if job.url in self.fail:
+            raise RuntimeError("unavailable")
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="No Unix sockets on this platform")
+def test_workers_run_every_job_over_a_socket(tmp_path, playlist):
+    address = f"unix:{tmp_path / 'coordinator.sock'}"
+    failing = video(tmp_path, "broken")
+    coordinator = Coordinator([playlist, failing], address=address, token="secret", retries=1)
+    downloader = FakeDownloader(fail={failing.url})
+
+    server = threading.Thread(target=coordinator.run)
+    server.start()
+    stats = Worker(downloader, address=address, token="secret", name="w").run(slots=2)
+    server.join(10)
+
+    assert not server.is_alive()
+    assert sorted(downloader.urls) == sorted([f"https://www.youtube.com/watch?v={video_id}" for video_id in "abc"]
+                                             + [failing.url] * 2)
+    assert stats == {"jobs": 5, "failed": 2, "bytes": 500}
+    assert coordinator.failures == [(failing.url, "RuntimeError: unavailable")]
+    assert not os.path.exists(str(tmp_path / "coordinator.sock"))
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="No Unix sockets on this platform")
+def test_workers_with_the_wrong_token_are_rejected(tmp_path, playlist, capsys):
+    address = f"unix:{tmp_path / 'coordinator.sock'}"
+    coordinator = Coordinator([playlist], address=address, token="secret")
+    server = threading.Thread(target=coordinator.run, daemon=True)
+    server.start()
+
+    stats = Worker(FakeDownloader(), address=address, token="wrong", name="w").run()
+
+    assert stats["jobs"] == 0
+    assert "Rejected by the coordinator" in capsys.readouterr().out
+    coordinator._finished.set()
+    server.join(10)
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import download_archive
+from download_archive import DownloadArchive
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return DownloadArchive(str(tmp_path / "archive.sqlite3"))
+
+
+def output(tmp_path, name, size=100):
+    path = str(tmp_path / name)
+    with open(path, "wb") as fh:
+        fh.write(b"x" * size)
+    return path
+
+
+def test_recorded_outputs_are_archived(tmp_path, archive):
+    archive.record("a", "mp3", 140, output(tmp_path, "a.mp3"))
+    archive.record("b", "mp3", 140, output(tmp_path, "b.mp3"))
+
+    assert archive.archived(["a", "b", "c"], "mp3") == {"a", "b"}
+    assert archive.archived(["a", "b"], "video") == set()
+    assert archive.stats == {"hits": 2, "recorded": 2}
+
+
+def test_outputs_of_another_size_are_not_archived(tmp_path, archive):
+    path = output(tmp_path, "a.mp3")
+    archive.record("a", "mp3", 140, path)
+    with open(path, "ab") as fh:
+        fh.write(b"changed")
+
+    assert archive.archived(["a"], "mp3") == set()
+    # Still there, e.g. a file retagged by another tool is downloaded again and recorded anew
+    assert archive.lookup("a", "mp3")["size"] == 100
+
+
+def test_deleted_outputs_are_forgotten(tmp_path, archive):
+    path = output(tmp_path, "a.mp3")
+    archive.record("a", "mp3", 140, path)
+    os.remove(path)
+
+    assert archive.archived(["a"], "mp3") == set()
+    assert archive.lookup("a", "mp3") is None
+
+
+def test_missing_outputs_are_not_recorded(tmp_path, archive):
+    archive.record("a", "mp3", 140, str(tmp_path / "missing.mp3"))
+
+    assert archive.lookup("a", "mp3") is None
+
+
+def test_outputs_of_other_hosts_are_trusted(archive):
+    archive.record("a", "mp3", 140, "/elsewhere/a.mp3", 100, "another-host")
+
+    assert archive.archived(["a"], "mp3") == {"a"}
+    assert archive.lookup("a", "mp3")["path"] == "/elsewhere/a.mp3"
+
+
+def test_recording_again_replaces_the_entry(tmp_path, archive):
+    archive.record("a", "mp3", 140, output(tmp_path, "a.mp3"))
+    archive.record("a", "mp3", 251, output(tmp_path, "a2.mp3", size=50))
+
+    entry = archive.lookup("a", "mp3")
+    assert (entry["itag"], entry["size"]) == (251, 50)
+
+
+def test_lookups_are_batched(tmp_path, archive, monkeypatch):
+    monkeypatch.setattr(download_archive, "_LOOKUP_BATCH", 2)
+    for video_id in "abcde":
+        archive.record(video_id, "mp3", 140, output(tmp_path, f"{video_id}.mp3"))
+
+    assert archive.archived(list("abcdefg"), "mp3") == set("abcde")
+
+
+def test_entries_in_a_directory(tmp_path, archive):
+    (tmp_path / "other").mkdir()
+    archive.record("a", "mp3", 140, output(tmp_path, "a.mp3"))
+    archive.record("b", "mp3", 140, output(tmp_path, os.path.join("other", "b.mp3")))
+    archive.record("c", "audio", 140, output(tmp_path, "c.m4a"))
+
+    assert archive.entries_in(str(tmp_path), "mp3") == [("a", str(tmp_path / "a.mp3"))]
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+import job_queue
+import settings
+from job_queue import CONVERTING, DONE, FAILED, QUEUED, JobQueue
+from jobs import JobSpec
+from playlist_metadata import PlaylistVideo
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+@pytest.fixture
+def job(tmp_path):
+    return JobSpec(url="https://www.youtube.com/playlist?list=PLx", output_dir=str(tmp_path), convert_to_mp3=True)
+
+
+def test_a_claimed_run_is_not_shared(path, job):
+    first, second = JobQueue(path), JobQueue(path)
+
+    run_id = first.open_run(job)
+
+    assert second.open_run(job) != run_id
+    assert not second.claim(run_id)
+    assert run_id not in [run for run, _ in second.interrupted()]
+
+
+def test_a_released_run_is_carried_on(path, job):
+    first, second = JobQueue(path), JobQueue(path)
+    run_id = first.open_run(job)
+    first.release(run_id)
+
+    assert second.open_run(job) == run_id
+
+
+def test_a_finished_run_is_not_carried_on(path, job):
+    queue = JobQueue(path)
+    run_id = queue.open_run(job)
+    queue.finish_run(run_id)
+
+    assert queue.open_run(job) != run_id
+    assert not queue.claim(run_id)
+
+
+def test_interrupted_runs_are_listed_with_their_job(path, job):
+    queue = JobQueue(path)
+    run_id = queue.open_run(job)
+    queue.release(run_id)
+
+    interrupted = JobQueue(path).interrupted()
+
+    assert [run for run, _ in interrupted] == [run_id]
+    assert interrupted[0][1].as_dict() == job.as_dict()
+
+
+def test_the_claims_of_a_process_that_is_gone_expire(path, job, monkeypatch):
+    monkeypatch.setattr(job_queue, "CLAIM_TIMEOUT", 0.2)
+    crashed = JobQueue(path)
+    run_id = crashed.open_run(job)
+    # The heartbeat of a crashed process stops refreshing its claims
+    crashed._claimed.clear()
+
+    time.sleep(0.3)
+    other = JobQueue(path)
+
+    assert [run for run, _ in other.interrupted()] == [run_id]
+    assert other.claim(run_id)
+
+
+def test_the_heartbeat_keeps_the_claims_alive(path, job, monkeypatch):
+    monkeypatch.setattr(job_queue, "HEARTBEAT_INTERVAL", 0.05)
+    monkeypatch.setattr(job_queue, "CLAIM_TIMEOUT", 0.3)
+    run_id = JobQueue(path).open_run(job)
+
+    time.sleep(0.6)
+
+    assert not JobQueue(path).claim(run_id)
+
+
+def test_runs_are_given_up_after_the_maximum_resumes(path, job, monkeypatch, capsys):
+    monkeypatch.setattr(settings, "JOB_QUEUE_MAX_RESUMES", 2)
+    queue = JobQueue(path)
+    run_id = queue.open_run(job)
+    queue.release(run_id)
+    for _ in range(2):
+        assert [run for run, _ in queue.interrupted()] == [run_id]
+        assert queue.claim(run_id)
+        queue.release(run_id)
+
+    assert queue.interrupted() == []
+    assert "gave up on 1 run(s)" in capsys.readouterr().out
+    assert queue.open_run(job) != run_id
+
+
+def test_video_states_are_recorded(path, job):
+    queue = JobQueue(path)
+    run_id = queue.open_run(job)
+    videos = [PlaylistVideo(f"video{index}", f"Video {index}", index=index) for index in range(3)]
+
+    states = queue.enqueue(run_id, videos)
+    queue.set_state(run_id, videos[0].watch_url, DONE)
+    queue.set_state(run_id, videos[1].watch_url, CONVERTING, {"path": "video1.m4a"})
+    queue.set_state(run_id, videos[2].watch_url, FAILED, error="HTTP 403")
+
+    assert set(states.values()) == {(QUEUED, None)}
+    assert queue.counts(run_id) == {DONE: 1, CONVERTING: 1, FAILED: 1}
+    # Enqueuing again keeps the states, and what resuming a conversion needs
+    assert queue.enqueue(run_id, videos)[videos[1].watch_url] == (CONVERTING, {"path": "video1.m4a"})
+    assert [video.video_id for video in queue.queued_videos(run_id)] == ["video0", "video1", "video2"]
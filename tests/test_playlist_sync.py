@@ -0,0 +1,115 @@
+import pytest
+
+import playlist_sync
+from playlist_metadata import PlaylistVideo
+from playlist_sync import PlaylistSync
+
+
+class FakePlaylist:
+    """
+    Stands in for `pytube.Playlist`: its pages are set by the test, fetching them is counted.
+    """
+
+    pages = []
+    fetched = 0
+
+    def __init__(self, url):
+        self.playlist_id = url.split("list=")[1]
+        self.title = f"Playlist {self.playlist_id}"
+
+
+def fake_pages(playlist):
+    for page in FakePlaylist.pages:
+        FakePlaylist.fetched += 1
+        yield page
+
+
+def videos(*video_ids):
+    return [PlaylistVideo(video_id, f"Title of {video_id}") for video_id in video_ids]
+
+
+@pytest.fixture
+def sync(tmp_path, monkeypatch):
+    monkeypatch.setattr(playlist_sync, "Playlist", FakePlaylist)
+    monkeypatch.setattr(playlist_sync, "iter_playlist_pages", fake_pages)
+    FakePlaylist.fetched = 0
+    return PlaylistSync(str(tmp_path / "playlists.sqlite3"))
+
+
+def synced(sync, url, pages, failed_ids=(), **kwargs):
+    FakePlaylist.pages = pages
+    FakePlaylist.fetched = 0
+    result = sync.sync(url, **kwargs)
+    sync.commit(result, failed_ids)
+    return result
+
+
+def ids(result_videos):
+    return [video.video_id for video in result_videos]
+
+
+def test_first_sync_downloads_everything(sync):
+    result = synced(sync, "https://www.youtube.com/playlist?list=UUchannel", [videos("c", "b"), videos("a")])
+
+    assert ids(result.videos) == ["c", "b", "a"]
+    assert result.complete
+    assert result.title == "Playlist UUchannel"
+    assert set(sync.known_items("UUchannel")) == {"a", "b", "c"}
+
+
+def test_newest_first_playlists_stop_at_the_first_known_entry(sync):
+    url = "https://www.youtube.com/playlist?list=UUchannel"
+    synced(sync, url, [videos("c", "b"), videos("a")])
+
+    result = synced(sync, url, [videos("e", "d", "c"), videos("b", "a")])
+
+    assert ids(result.videos) == ["e", "d"]
+    assert not result.complete
+    assert result.removed == []
+    assert FakePlaylist.fetched == 1
+    # The new entries come first, the known ones keep their order below them
+    known = sync.known_items("UUchannel")
+    assert sorted(known, key=lambda video_id: known[video_id][0]) == ["e", "d", "c", "b", "a"]
+
+
+def test_other_playlists_are_enumerated_in_full_and_report_removed_entries(sync):
+    url = "https://www.youtube.com/playlist?list=PLmix"
+    synced(sync, url, [videos("a", "b", "c")])
+
+    result = synced(sync, url, [videos("a", "d"), videos("c")])
+
+    assert ids(result.videos) == ["d"]
+    assert result.complete
+    assert result.removed == [("b", "Title of b")]
+    assert FakePlaylist.fetched == 2
+    assert "b" not in sync.known_items("PLmix")
+
+
+def test_report_removed_enumerates_newest_first_playlists_in_full(sync):
+    url = "https://www.youtube.com/playlist?list=UUchannel"
+    synced(sync, url, [videos("b", "a")])
+
+    result = synced(sync, url, [videos("c", "b")], report_removed=True)
+
+    assert ids(result.videos) == ["c"]
+    assert result.complete
+    assert result.removed == [("a", "Title of a")]
+
+
+def test_failed_entries_are_queued_again_below_the_stop_point(sync):
+    url = "https://www.youtube.com/playlist?list=UUchannel"
+    synced(sync, url, [videos("c", "b", "a")], failed_ids={"b"})
+    assert sync.known_items("UUchannel")["b"][2]
+
+    result = synced(sync, url, [videos("d", "c", "b", "a")])
+
+    assert ids(result.videos) == ["d", "b"]
+    assert FakePlaylist.fetched == 1
+    assert not sync.known_items("UUchannel")["b"][2]
+
+
+def test_nothing_is_remembered_before_commit(sync):
+    FakePlaylist.pages = [videos("a")]
+    sync.sync("https://www.youtube.com/playlist?list=PLmix")
+
+    assert sync.known_items("PLmix") == {}
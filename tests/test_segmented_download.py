@@ -0,0 +1,188 @@
+import http.server
+import json
+import os
+import re
+import threading
+
+import pytest
+import requests
+
+from segmented_download import PartialDownload, SegmentedDownloader, split_ranges
+
+DATA = os.urandom(4 * 1024 * 1024 + 123)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = DATA
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2) or len(DATA) - 1)
+            self.server.requested.append((start, end))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+            data = DATA[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.requested = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeStream:
+    itag = 140
+    default_filename = "audio.m4a"
+    filesize = len(DATA)
+
+    def __init__(self, url):
+        self.url = url
+        self.remaining = []
+        self.completed = None
+
+    def on_progress(self, chunk, file_handler, bytes_remaining):
+        file_handler.write(chunk)
+        self.remaining.append(bytes_remaining)
+
+    def on_complete(self, file_path):
+        self.completed = file_path
+
+
+@pytest.mark.parametrize("filesize, connections, min_segment_size, expected_count", [
+    (100, 4, 1, 4),
+    (100, 4, 40, 2),
+    (100, 4, 1000, 1),
+    (7, 10, 1, 7),
+])
+def test_split_ranges_covers_the_span_contiguously(filesize, connections, min_segment_size, expected_count):
+    ranges = split_ranges(filesize, connections, min_segment_size)
+
+    assert len(ranges) == expected_count
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == filesize - 1
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert start == end + 1
+
+
+def test_split_ranges_starts_at_the_offset():
+    assert split_ranges(10, 2, 1, offset=100) == [(100, 104), (105, 109)]
+
+
+def test_split_ranges_of_an_empty_span():
+    assert split_ranges(0, 4, 1) == []
+
+
+def test_partial_download_resumes_the_completed_ranges(tmp_path):
+    file_path = str(tmp_path / "audio.m4a")
+    partial = PartialDownload(file_path, 140, 100)
+    partial.create()
+    partial.mark_done(0, 9)
+    partial.mark_done(10, 19)
+    partial.mark_done(50, 59)
+    partial.save(force=True)
+
+    resumed = PartialDownload(file_path, 140, 100)
+
+    assert resumed.load()
+    assert resumed.completed == [(0, 19), (50, 59)]
+    assert resumed.missing() == [(20, 49), (60, 99)]
+
+
+@pytest.mark.parametrize("itag, filesize", [(251, 100), (140, 200)])
+def test_partial_download_of_another_stream_starts_over(tmp_path, itag, filesize):
+    file_path = str(tmp_path / "audio.m4a")
+    partial = PartialDownload(file_path, 140, 100)
+    partial.create()
+    partial.mark_done(0, 49)
+    partial.save(force=True)
+
+    assert not PartialDownload(file_path, itag, filesize).load()
+
+
+def test_partial_download_with_a_truncated_part_file_starts_over(tmp_path):
+    file_path = str(tmp_path / "audio.m4a")
+    partial = PartialDownload(file_path, 140, 100)
+    partial.create()
+    partial.save(force=True)
+    with open(partial.part_path, "r+b") as fh:
+        fh.truncate(50)
+
+    assert not PartialDownload(file_path, 140, 100).load()
+
+
+def test_partial_download_with_an_unreadable_sidecar_starts_over(tmp_path):
+    file_path = str(tmp_path / "audio.m4a")
+    partial = PartialDownload(file_path, 140, 100)
+    partial.create()
+    with open(partial.state_path, "w", encoding="utf-8") as fh:
+        fh.write("{not json")
+
+    assert not PartialDownload(file_path, 140, 100).load()
+
+
+def test_download_fetches_the_ranges_over_several_connections(tmp_path, server):
+    stream = FakeStream(f"http://127.0.0.1:{server.server_port}/stream")
+
+    path = SegmentedDownloader(connections=4, session=requests.Session()).download(stream, str(tmp_path))
+
+    with open(path, "rb") as fh:
+        assert fh.read() == DATA
+    assert len(server.requested) == 4
+    assert min(stream.remaining) == 0
+    assert stream.completed == path
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.json")
+
+
+def test_download_only_fetches_the_missing_ranges(tmp_path, server):
+    file_path = str(tmp_path / FakeStream.default_filename)
+    half = len(DATA) // 2
+    partial = PartialDownload(file_path, FakeStream.itag, len(DATA))
+    partial.create()
+    with open(partial.part_path, "r+b") as fh:
+        fh.write(DATA[:half])
+    partial.mark_done(0, half - 1)
+    partial.save(force=True)
+
+    stream = FakeStream(f"http://127.0.0.1:{server.server_port}/stream")
+    path = SegmentedDownloader(connections=2, session=requests.Session()).download(stream, str(tmp_path))
+
+    with open(path, "rb") as fh:
+        assert fh.read() == DATA
+    assert min(start for start, _ in server.requested) == half
+    assert sum(end - start + 1 for start, end in server.requested) == len(DATA) - half
+
+
+def test_failed_download_keeps_its_progress(tmp_path, server):
+    stream = FakeStream(f"http://127.0.0.1:{server.server_port}/stream")
+    downloader = SegmentedDownloader(connections=2, retries=0, session=requests.Session())
+    real_get = downloader.session.get
+    calls = []
+
+    def get(url, headers=None, **kwargs):
+        calls.append(headers)
+        if len(calls) > 1:
+            raise requests.ConnectionError("connection dropped")
+        return real_get(url, headers=headers, **kwargs)
+
+    downloader.session.get = get
+    with pytest.raises(requests.RequestException):
+        downloader.download(stream, str(tmp_path))
+
+    with open(str(tmp_path / "audio.m4a.part.json"), encoding="utf-8") as fh:
+        state = json.load(fh)
+    assert state["itag"] == 140
+    assert state["completed"]
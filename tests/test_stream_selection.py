@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import pytest
+
+from stream_selection import SelectionPolicy, StreamIndex, as_policy
+
+
+def video(itag, height, codec="avc1.640028", container="mp4", fps=30, progressive=False):
+    return SimpleNamespace(itag=itag, is_progressive=progressive, type="video", resolution=f"{height}p", fps=fps,
+                           video_codec=codec, audio_codec="mp4a.40.2" if progressive else None, subtype=container,
+                           abr=None, bitrate=height * 1000)
+
+
+def audio(itag, kbps, codec="mp4a.40.2", container="mp4"):
+    return SimpleNamespace(itag=itag, is_progressive=False, type="audio", resolution=None, fps=None,
+                           video_codec=None, audio_codec=codec, subtype=container, abr=f"{kbps}kbps",
+                           bitrate=kbps * 1000)
+
+
+@pytest.fixture
+def index():
+    return StreamIndex([
+        video(18, 360, progressive=True),
+        video(22, 720, progressive=True),
+        video(137, 1080),
+        video(248, 1080, codec="vp9", container="webm"),
+        video(313, 2160, codec="vp9", container="webm"),
+        audio(139, 48),
+        audio(140, 128),
+        audio(251, 160, codec="opus", container="webm"),
+    ])
+
+
+def test_policy_parsing():
+    policy = SelectionPolicy("smallest >=720p, <=1080p progressive prefer vp9 prefer webm")
+
+    assert policy.smallest
+    assert policy.bounds == [("height", ">=", 720), ("height", "<=", 1080)]
+    assert policy.progressive is True
+    assert policy.prefer == ["vp9", "webm"]
+
+
+def test_policy_bounds_without_operator_are_exact():
+    assert SelectionPolicy("720p 128kbps").bounds == [("height", "=", 720), ("kbps", "=", 128)]
+
+
+def test_policy_rejects_unknown_terms():
+    with pytest.raises(ValueError):
+        SelectionPolicy("best quality")
+
+
+def test_policies_are_parsed_once():
+    assert as_policy("best <=720p") is as_policy("best <=720p")
+
+
+def test_best_video_within_bounds(index):
+    assert index.select_video("best <=1080p").itag in (137, 248)
+    assert index.select_video("best <=1080p prefer mp4").itag == 137
+    assert index.select_video("best").itag == 313
+
+
+def test_smallest_audio_above_a_bitrate(index):
+    assert index.select_audio("smallest >=128kbps").itag == 140
+
+
+def test_preferred_codec_wins_over_quality(index):
+    assert index.select_audio("best prefer opus").itag == 251
+    assert index.select_audio("best prefer aac").itag == 140
+
+
+def test_bounds_are_relaxed_to_the_closest_stream(index):
+    assert index.select_video("best >=4320p").itag == 313
+    assert index.select_video("best <=144p").itag == 18
+    assert index.select_audio("best >=320kbps").itag == 251
+
+
+def test_progressive_streams_only(index):
+    assert index.select_video("best", progressive=True).itag == 22
+    assert index.select_video("best progressive").itag == 22
+    assert index.select_video("best", progressive=False).itag == 313
+
+
+def test_resolutions_and_streams_by_resolution(index):
+    assert index.resolutions() == [("2160p", False, 30), ("1080p", False, 30), ("720p", True, 30),
+                                   ("360p", True, 30)]
+    assert [stream.itag for stream in index.at_resolution("1080p")] == [137, 248]
+    assert [stream.itag for stream in index.at_resolution("720p", progressive=True)] == [22]
+    assert index.at_resolution("480p") == []
+
+
+def test_selection_without_candidates():
+    assert StreamIndex([video(18, 360, progressive=True)]).select_audio("best") is None
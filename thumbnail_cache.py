@@ -0,0 +1,209 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import settings
+from http_session import get_transport
+
+# Longest side of the thumbnail shown in the GUI, large enough for HiDPI scaling of the 100x100 label
+GUI_THUMBNAIL_SIZE = (200, 200)
+
+_VIDEO_ID_PATTERN = re.compile(r"/vi(?:_webp)?/([\w-]{11})/")
+
+
+def video_id_from_thumbnail_url(thumbnail_url):
+    """
+    Extracts the video ID from a YouTube thumbnail URL.
+
+    Args:
+        thumbnail_url (str): The thumbnail URL, e.g. https://i.ytimg.com/vi/<id>/maxresdefault.jpg
+
+    Returns:
+        str: The video ID, or None if the URL does not contain one.
+    """
+    match = _VIDEO_ID_PATTERN.search(thumbnail_url)
+    return match.group(1) if match else None
+
+
+class ThumbnailCache:
+    """
+    On-disk store of video thumbnails keyed by video ID.
+
+    The original image is downloaded once and kept as is. The variants (GUI preview, MP3 cover art)
+    are derived from it on first use and stored next to it. Files are evicted least recently used
+    first once the store grows past `max_bytes`.
+    """
+
+    def __init__(self, directory=None, max_bytes=settings.THUMBNAIL_CACHE_BYTES, session=None):
+        self.directory = directory or os.path.join(settings.CACHE_DIR, "thumbnails")
+        self.max_bytes = max_bytes
+        self.session = session or get_transport().session
+        self._lock = threading.Lock()
+        self._fetch_locks = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Least recently used first, rebuilt from the modification times left by previous sessions
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                entries.append((os.path.getmtime(path), name, os.path.getsize(path)))
+        self._entries = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self._total = sum(self._entries.values())
+
+    def get_original(self, video_id, thumbnail_url):
+        """
+        Returns the original thumbnail bytes, downloading them only if they are not stored yet.
+
+        Args:
+            video_id (str): The video ID.
+            thumbnail_url (str): The URL to download the thumbnail from.
+
+        Returns:
+            bytes: The image data, or None if the download failed.
+        """
+        name = f"{video_id}.orig"
+
+        # Concurrent requests for the same video wait for a single download
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(video_id, threading.Lock())
+
+        try:
+            with fetch_lock:
+                data = self._read(name)
+                if data is not None:
+                    return data
+
+                response = self.session.get(thumbnail_url, timeout=settings.REQUEST_TIMEOUT)
+                if response.status_code != 200:
+                    print(f"Could not download thumbnail for {video_id}: HTTP {response.status_code}")
+                    return None
+
+                self._write(name, response.content)
+                return response.content
+        finally:
+            # Drop the lock once the fetch is over, or one is kept per video ever requested. Requests
+            # still waiting on it find the stored thumbnail, later ones start from a new lock
+            with self._lock:
+                if self._fetch_locks.get(video_id) is fetch_lock:
+                    del self._fetch_locks[video_id]
+
+    def get_cover(self, video_id, thumbnail_url):
+        """
+        Returns the thumbnail as JPEG bytes, ready to be embedded as MP3 cover art.
+
+        Args:
+            video_id (str): The video ID.
+            thumbnail_url (str): The URL to download the thumbnail from.
+
+        Returns:
+            bytes: The JPEG data, or None if the thumbnail could not be downloaded.
+        """
+        name = f"{video_id}.cover.jpg"
+        data = self._read(name)
+        if data is not None:
+            return data
+
+        original = self.get_original(video_id, thumbnail_url)
+        if original is None:
+            return None
+
+        if original.startswith(b"\xff\xd8"):
+            # Already a JPEG, no need to decode and re-encode it
+            return original
+
+        # Pillow is only imported when an image has to be decoded, most covers are served as they are
+        from PIL import Image
+
+        with BytesIO() as img_bytes_io:
+            Image.open(BytesIO(original)).convert("RGB").save(img_bytes_io, format="JPEG")
+            data = img_bytes_io.getvalue()
+        self._write(name, data)
+        return data
+
+    def get_gui_image(self, video_id, thumbnail_url):
+        """
+        Returns the thumbnail as a small Pillow image for the GUI preview.
+
+        Args:
+            video_id (str): The video ID.
+            thumbnail_url (str): The URL to download the thumbnail from.
+
+        Returns:
+            Image: The Pillow image, or None if the thumbnail could not be downloaded.
+        """
+        from PIL import Image
+
+        name = f"{video_id}.gui.png"
+        data = self._read(name)
+        if data is None:
+            original = self.get_original(video_id, thumbnail_url)
+            if original is None:
+                return None
+
+            img = Image.open(BytesIO(original))
+            img.thumbnail(GUI_THUMBNAIL_SIZE)
+            with BytesIO() as img_bytes_io:
+                img.save(img_bytes_io, format="PNG")
+                data = img_bytes_io.getvalue()
+            self._write(name, data)
+
+        return Image.open(BytesIO(data))
+
+    def _read(self, name):
+        """
+        Reads a stored file and marks it as recently used.
+
+        Args:
+            name (str): The file name inside the cache directory.
+
+        Returns:
+            bytes: The file contents, or None if it is not stored.
+        """
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            # The modification time carries the LRU order over to the next session
+            os.utime(path)
+            return data
+        except OSError:
+            with self._lock:
+                self._total -= self._entries.pop(name, 0)
+            return None
+
+    def _write(self, name, data):
+        """
+        Stores a file and evicts the least recently used ones if the store is over its size bound.
+
+        Args:
+            name (str): The file name inside the cache directory.
+            data (bytes): The file contents.
+
+        Returns:
+            None
+        """
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                evicted, size = self._entries.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(os.path.join(self.directory, evicted))
+                except OSError:
+                    pass
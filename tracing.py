@@ -0,0 +1,311 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import settings
+
+# Per-stage totals exported as Prometheus counters: (metric suffix, Span attribute summed, help text)
+_COUNTERS = (
+    ("runs_total", None, "Spans finished per stage."),
+    ("errors_total", "error", "Spans per stage that ended with an error."),
+    ("seconds_total", "duration", "Seconds spent per stage."),
+    ("bytes_total", "bytes", "Bytes transferred or written per stage."),
+    ("retries_total", "retries", "Retried requests per stage."),
+)
+
+
+class Span:
+    """
+    The timing of one stage of one job, e.g. the "download" of a video: its wall clock start and end,
+    the bytes it transferred, its retries and its error, if any.
+    """
+
+    __slots__ = ("name", "job", "start", "end", "bytes", "retries", "error", "pid", "thread", "attributes")
+
+    def __init__(self, name, job=None, start=None, end=None, pid=None, thread=None, **attributes):
+        self.name = name
+        self.job = job
+        self.start = time.time() if start is None else start
+        self.end = end
+        self.bytes = 0
+        self.retries = 0
+        self.error = None
+        self.pid = pid or os.getpid()
+        self.thread = thread or threading.get_ident()
+        self.attributes = attributes
+
+    def __repr__(self):
+        return f"<Span {self.name} {self.job} {self.duration:.3f}s>"
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def rate(self):
+        """
+        The throughput of the span in bytes/s, 0 if it transferred nothing.
+        """
+        return self.bytes / self.duration if self.bytes and self.duration > 0 else 0.0
+
+    def as_dict(self):
+        """
+        The span as plain values, as written to the JSON lines export.
+
+        Returns:
+            dict: The span.
+        """
+        record = {"name": self.name, "job": self.job, "start": round(self.start, 6), "end": round(self.end, 6),
+                  "duration": round(self.duration, 6), "bytes": self.bytes, "bytes_per_second": round(self.rate),
+                  "retries": self.retries, "error": self.error, "pid": self.pid, "thread": self.thread}
+        record.update(self.attributes)
+        return record
+
+
+class Tracer:
+    """
+    Collects spans of the stages every job goes through (metadata, thumbnail, download, convert...)
+    and exports them as JSON lines, as a Chrome trace (chrome://tracing, Perfetto) or as Prometheus
+    counters.
+
+    Spans inherit the job their thread is working on, see `job`. Only the last `max_spans` spans are
+    kept for the exports, while the per-stage totals cover the whole run.
+    """
+
+    def __init__(self, max_spans=settings.TRACE_MAX_SPANS):
+        self.spans = deque(maxlen=max(1, max_spans))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._totals = {}
+        self._active = {}
+        self._collectors = []
+
+    @contextmanager
+    def job(self, job_id):
+        """
+        Attributes the spans opened by the calling thread to a job while the block runs.
+
+        Args:
+            job_id (str): The job, e.g. the video URL.
+        """
+        previous = getattr(self._local, "job", None)
+        self._local.job = job_id
+        try:
+            yield
+        finally:
+            self._local.job = previous
+
+    @contextmanager
+    def span(self, name, job=None, **attributes):
+        """
+        Times the block as a span of stage `name`. The block may set the `bytes` and `retries` of the
+        span it receives. An exception leaving the block is recorded as the span error and re-raised.
+
+        Args:
+            name (str): The stage, e.g. "download".
+            job (str, optional): The job, defaults to the one of the calling thread.
+            **attributes: Extra values exported with the span.
+
+        Yields:
+            Span: The open span.
+        """
+        span = Span(name, job or getattr(self._local, "job", None), **attributes)
+        with self._lock:
+            self._active[name] = self._active.get(name, 0) + 1
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end = time.time()
+            with self._lock:
+                self._active[name] -= 1
+            self.record(span)
+
+    def record(self, span):
+        """
+        Adds a finished span, e.g. one timed in a worker process.
+
+        Args:
+            span (Span): The span.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.spans.append(span)
+            totals = self._totals.setdefault(span.name, dict.fromkeys((suffix for suffix, _, _ in _COUNTERS), 0))
+            for suffix, attribute, _ in _COUNTERS:
+                if attribute is None:
+                    value = 1
+                elif attribute == "error":
+                    value = int(span.error is not None)
+                else:
+                    value = getattr(span, attribute)
+                totals[suffix] += value
+
+    def summary(self):
+        """
+        Sums up the time spent per stage, e.g. "metadata 1.20s (10), download 8.41s (10)".
+
+        Returns:
+            str: The summary, stages in order of their first span.
+        """
+        with self._lock:
+            totals = {name: dict(values) for name, values in self._totals.items()}
+        return ", ".join(f"{name} {values['seconds_total']:.2f}s ({values['runs_total']})"
+                         for name, values in totals.items()) or "nothing timed"
+
+    def write_jsonl(self, path):
+        """
+        Writes the spans as JSON lines, one span per line.
+
+        Args:
+            path (str): The output file.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            spans = list(self.spans)
+        with open(path, "w", encoding="utf-8") as fh:
+            for span in spans:
+                fh.write(json.dumps(span.as_dict()) + "\n")
+
+    def write_chrome_trace(self, path):
+        """
+        Writes the spans in the Chrome trace event format, one track per process and thread.
+
+        Args:
+            path (str): The output file.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            spans = list(self.spans)
+        events = []
+        for span in spans:
+            args = {"job": span.job, "bytes": span.bytes, "bytes_per_second": round(span.rate),
+                    "retries": span.retries}
+            if span.error:
+                args["error"] = span.error
+            args.update(span.attributes)
+            events.append({"name": span.name, "cat": "youber", "ph": "X", "ts": round(span.start * 1e6),
+                           "dur": round(span.duration * 1e6), "pid": span.pid, "tid": span.thread, "args": args})
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fh)
+
+    def export(self, path):
+        """
+        Writes the spans to a file, as a Chrome trace if its name ends with ".json", else as JSON lines.
+
+        Args:
+            path (str): The output file.
+
+        Returns:
+            None
+        """
+        if path.endswith(".json"):
+            self.write_chrome_trace(path)
+        else:
+            self.write_jsonl(path)
+
+    def add_collector(self, collector):
+        """
+        Adds metrics of another component to `prometheus_text`.
+
+        Args:
+            collector (callable): Returns more lines in the Prometheus text format.
+
+        Returns:
+            None
+        """
+        self._collectors.append(collector)
+
+    def prometheus_text(self):
+        """
+        Renders the per-stage totals in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        with self._lock:
+            totals = {name: dict(values) for name, values in self._totals.items()}
+            active = dict(self._active)
+        lines = []
+        for suffix, _, help_text in _COUNTERS:
+            lines.append(f"# HELP youber_stage_{suffix} {help_text}")
+            lines.append(f"# TYPE youber_stage_{suffix} counter")
+            for name, values in sorted(totals.items()):
+                value = values[suffix]
+                lines.append(f'youber_stage_{suffix}{{stage="{name}"}} '
+                             f'{round(value, 6) if isinstance(value, float) else value}')
+        lines.append("# HELP youber_stage_in_progress Spans currently open per stage.")
+        lines.append("# TYPE youber_stage_in_progress gauge")
+        for name, count in sorted(active.items()):
+            lines.append(f'youber_stage_in_progress{{stage="{name}"}} {count}')
+        for collector in self._collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self, address):
+        """
+        Serves `prometheus_text` over HTTP at /metrics, on a background thread.
+
+        Args:
+            address (str): "host:port" to listen on.
+
+        Returns:
+            ThreadingHTTPServer: The server, to `shutdown` when done.
+
+        Raises:
+            ValueError: If the address is malformed.
+        """
+        host, _, port = address.rpartition(":")
+        if not port.isdigit():
+            raise ValueError(f"Invalid metrics address {address!r}, expected host:port")
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the console
+                pass
+
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host or '127.0.0.1'}:{server.server_address[1]}/metrics")
+        return server
+
+
+def timed_call(function, *args):
+    """
+    Calls a function and times it, so a worker process can report spans to the tracer of its parent.
+
+    Args:
+        function (callable): A picklable, module-level function.
+        *args: Its arguments.
+
+    Returns:
+        tuple: The result, the wall clock start and end, and the process ID.
+    """
+    start = time.time()
+    result = function(*args)
+    return result, start, time.time(), os.getpid()